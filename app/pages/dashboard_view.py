@@ -1,20 +1,28 @@
 import pandas as pd
 import streamlit as st
 from streamlit_extras.grid import grid
-from src.api import OilPriceAPI, WeatherAPI
+from src.api import OilPriceAPI, PriceHistoryStore, WeatherAPI, WeatherArchive
+from src.feature_store import FeatureStore
+from src.storage import load_readings
+from src.fleet_state import FleetState
+from src.utils.snapshot import Snapshot
 from datetime import datetime, timedelta
 from openai import OpenAI
 import plotly.express as px
 import time
+from typing import Optional
 
 # Initialize the OpenAI client
 client = OpenAI(api_key=None)  # Ensure the API key is stored as an environment variable
 
+STATE_PATH = "data/processed/fleet_state.pickle"
 
-def load_data(file_path: str) -> pd.DataFrame:
-    # Load data from the specified file
-    data = pd.read_pickle(file_path)
-    print(data.head())
+
+def load_data(file_path: str, state: Optional[FleetState] = None) -> FleetState:
+    # Continue from the previous fleet state, only readings from its watermark on are loaded. The previous state
+    # is still served to the sessions while this one is updated.
+    state = state.copy() if state is not None else FleetState()
+    data = load_readings(file_path, start=state.watermark)
 
     # Remove all rows where Tank-ID = 5
     data = data[data["Tank-ID"] != 5]
@@ -23,145 +31,76 @@ def load_data(file_path: str) -> pd.DataFrame:
     data["PLZ"] = data["PLZ"].astype(str)
     data["PLZ"] = data["PLZ"].str.replace(".0", "", regex=False)
 
-    # Get min and max date from the data
-    start_date = data["Zeitstempel"].min().strftime("%Y-%m-%d")
-    end_date = data["Zeitstempel"].max().strftime("%Y-%m-%d")
+    # Rename Linear Prozentwert to Prozentualer Füllstand
+    data.rename(columns={"Linear Prozentwert": "Prozentualer Füllstand"}, inplace=True)
+    state.update_readings(data)
 
-    # Get OilPrice for each Tank-ID from OilPriceAPI
-    oil_price_api = OilPriceAPI()
+    # Prices and weather come from the feature store while it holds these readings, from the APIs otherwise
+    features = FeatureStore.load()
+    if features.is_current(file_path):
+        update_from_feature_store(state, features)
+    else:
+        update_from_apis(state)
 
-    # Get unique PLZ codes
-    plz = data["PLZ"].unique()
+    return state
 
-    all_oil_prices = pd.DataFrame()  # Initialize an empty DataFrame for all oil prices
-    # Loop through all unique PLZ codes
-    for plz_code in plz:
-        print(plz_code)
 
-        # Fetch oil prices for the given PLZ, start date, and end date
-        oil_price_df = oil_price_api.get_heizoel(plz_code, start_date, end_date)
+def update_from_feature_store(state: FleetState, features: FeatureStore) -> None:
+    # Oil prices of the days held in the state, forward-filled over days without a quote
+    start_date, end_date = state.dates
+    prices = features.frame(["Price"], start=start_date, end=end_date)
+    state.update_prices(prices[["PLZ", "Zeitstempel", "Price"]].dropna())
 
-        # Add a column for the PLZ code (optional, if you want to keep track of which PLZ each row belongs to)
-        oil_price_df["PLZ_Code"] = plz_code
+    # Mean temperature per tank from yesterday to 15 days ahead
+    start_date = datetime.now() - timedelta(days=1)
+    end_date = datetime.now() + timedelta(days=15)
+    weather = features.frame(["Außentemperatur"], start=start_date.date(), end=end_date.date())
+    state.update_weather(weather.groupby("Tank-ID")["Außentemperatur"].mean())
 
-        # Concatenate the fetched DataFrame to the main DataFrame
-        all_oil_prices = pd.concat([all_oil_prices, oil_price_df], ignore_index=True)
 
-    # Optionally, reset the index of the final DataFrame
-    all_oil_prices.reset_index(drop=True, inplace=True)
+def update_from_apis(state: FleetState) -> None:
+    # Oil prices are only needed for the days held in the state
+    start_date, end_date = (date.strftime("%Y-%m-%d") for date in state.dates)
+    plz = state.today()["PLZ"].unique()
 
-    # Rename Date to Zeitstempel
+    # Fetch oil prices for all PLZ codes concurrently and assemble them in one DataFrame
+    oil_price_api = OilPriceAPI(store=PriceHistoryStore())
+    all_oil_prices = oil_price_api.get_heizoel_bulk(plz, start_date, end_date)
     all_oil_prices.rename(columns={"Date": "Zeitstempel"}, inplace=True)
-
-    # Rename Linear Prozentwert to Prozentualer Füllstand
-    data.rename(columns={"Linear Prozentwert": "Prozentualer Füllstand"}, inplace=True)
-    # Format to timestamp
-    all_oil_prices["Zeitstempel"] = pd.to_datetime(all_oil_prices["Zeitstempel"])
-
-    # Ensure "Zeitstempel" is of the same type in both DataFrames
-    data["Zeitstempel"] = pd.to_datetime(data["Zeitstempel"])
-    all_oil_prices["Zeitstempel"] = pd.to_datetime(all_oil_prices["Zeitstempel"])
-
-    # Merge the data with the Prices
-    data = pd.merge(data, all_oil_prices, on=["Zeitstempel", "PLZ"], how="left")
-    data["Oil Price"] = data["Price"]
-
-    # Today DataSet
-    today_data = data.sort_values("Zeitstempel").groupby("Tank-ID").tail(1)
-    today_data = today_data[
-        [
-            "Tank-ID",
-            "Füllstand",
-            "Prozentualer Füllstand",
-            "Maximale Füllgrenze",
-            "PLZ",
-            "Oil Price",
-            "Längengrad",
-            "Breitengrad",
-        ]
-    ]
-
-    # Yesterday DataSet
-    yesterday_data = data.sort_values("Zeitstempel").groupby("Tank-ID").nth(-2)
-    yesterday_data = yesterday_data[
-        [
-            "Tank-ID",
-            "Füllstand",
-            "Prozentualer Füllstand",
-            "Maximale Füllgrenze",
-            "PLZ",
-            "Oil Price",
-            "Längengrad",
-            "Breitengrad",
-        ]
-    ]
+    state.update_prices(all_oil_prices)
 
     # Get all Tank-IDs with Latitude and Longitude
-    tank_ids_wth = data[["Tank-ID", "Längengrad", "Breitengrad"]].drop_duplicates()
+    tank_ids_wth = state.locations()
 
     # for each get the Weather data
-    weather_api = WeatherAPI()
+    weather_api = WeatherAPI(archive=WeatherArchive())
     start_date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
     end_date = (datetime.now() + timedelta(days=15)).strftime("%Y-%m-%d")
 
-    results = []
-    for index, tank in tank_ids_wth.iterrows():
-        tank_id = tank["Tank-ID"]  # Retrieve tank ID
-        lat = tank["Breitengrad"]  # Retrieve latitude
-        lon = tank["Längengrad"]  # Retrieve longitude
-
-        # Get weather data for the current tank
-        weather_data = weather_api.get_data(lat, lon, start_date, end_date)
-
-        # Calculate mean temperature
-        mean_temp = weather_data["temperature_2m_mean"].mean()
-
-        results.append((tank_id, mean_temp))
-
-    # Add Results to today_data based on tank_id
-    for tank_id, mean_temp in results:
-        today_data.loc[today_data["Tank-ID"] == tank_id, "Avg. Temperatur (+15 Tage)"] = mean_temp
-        yesterday_data.loc[yesterday_data["Tank-ID"] == tank_id, "Avg. Temperatur (+15 Tage)"] = mean_temp
-
-    # Today DataSet Final
-    today_data = today_data[
-        [
-            "Tank-ID",
-            "Füllstand",
-            "Prozentualer Füllstand",
-            "Maximale Füllgrenze",
-            "PLZ",
-            "Oil Price",
-            "Avg. Temperatur (+15 Tage)",
-            "Längengrad",
-            "Breitengrad",
-        ]
-    ]
-    today_data["Avg. Temperatur (+15 Tage)"] = today_data["Avg. Temperatur (+15 Tage)"].round(2)
-
-    # Yesterday DataSet Final
-    yesterday_data = yesterday_data[
-        [
-            "Tank-ID",
-            "Füllstand",
-            "Prozentualer Füllstand",
-            "Maximale Füllgrenze",
-            "PLZ",
-            "Oil Price",
-            "Avg. Temperatur (+15 Tage)",
-            "Längengrad",
-            "Breitengrad",
-        ]
-    ]
-    yesterday_data["Avg. Temperatur (+15 Tage)"] = yesterday_data["Avg. Temperatur (+15 Tage)"].round(2)
+    # Get weather data for all tanks at once, tanks in the same grid cell share one request
+    weather_data = weather_api.get_data_bulk(
+        tank_ids_wth["Breitengrad"], tank_ids_wth["Längengrad"], start_date, end_date
+    )
 
-    return today_data, yesterday_data
+    # Calculate mean temperature per tank
+    mean_temps = weather_data.groupby("location")["temperature_2m_mean"].mean()
+    mean_temps = pd.Series(mean_temps.reindex(range(len(tank_ids_wth))).to_numpy(), index=tank_ids_wth["Tank-ID"])
+    state.update_weather(mean_temps)
 
 
-today_data, yesterday_data = load_data("data/processed/data_one_day_clean.pickle")
+# Fleet state is loaded on first use of the Dashboard page, persisted and brought up to date in the background
+FLEET_SNAPSHOT = Snapshot(
+    STATE_PATH,
+    lambda state: load_data("data/processed/data_one_day_clean.pickle", state),
+    load=FleetState.load,
+    save=FleetState.save,
+)
 
 
 def view_dashboard_page(CFG: dict) -> None:
+    fleet_state = FLEET_SNAPSHOT.get()
+    today_data, yesterday_data = fleet_state.today(), fleet_state.yesterday()
+
     # Own Styles
     st.markdown(
         """
@@ -206,38 +145,32 @@ def view_dashboard_page(CFG: dict) -> None:
             filtered_data_yesterday["Prozentualer Füllstand"] <= max_percentage
         ]
 
+    refreshing = " (refreshing in the background ...)" if FLEET_SNAPSHOT.is_refreshing else ""
+    st.caption(f"Data as of {datetime.fromtimestamp(FLEET_SNAPSHOT.loaded_at):%Y-%m-%d %H:%M}{refreshing}")
+
     # Grid layout for dashboard metrics
     my_grid = grid([2, 2, 2, 2], 1, vertical_align="bottom")
 
     # Row 1:
+    metrics = fleet_state.metrics(selected_tank_ids, max_percentage)
     with my_grid.container():
-        st.metric(
-            "Total Sensors",
-            len(filtered_data_today["Tank-ID"].unique()),
-            len(filtered_data_today["Tank-ID"].unique()) - len(filtered_data_yesterday["Tank-ID"].unique()),
-        )
+        sensors, sensors_delta = metrics["Total Sensors"]
+        st.metric("Total Sensors", sensors, sensors_delta)
 
     with my_grid.container():
-        st.metric(
-            "Total Liter",
-            f"{filtered_data_today['Füllstand'].sum():.0f} liters",
-            f"{filtered_data_today['Füllstand'].sum() - filtered_data_yesterday['Füllstand'].sum():.0f}",
-        )
+        liters, liters_delta = metrics["Total Liter"]
+        st.metric("Total Liter", f"{liters:.0f} liters", f"{liters_delta:.0f}")
 
     with my_grid.container():
-        st.metric(
-            "Avg. Utilization in percent",
-            f"{filtered_data_today['Prozentualer Füllstand'].mean():.2f}%",
-            f"{filtered_data_today['Prozentualer Füllstand'].mean() - filtered_data_yesterday['Prozentualer Füllstand'].mean():.2f}",
-        )
+        utilization, utilization_delta = metrics["Avg. Utilization in percent"]
+        st.metric("Avg. Utilization in percent", f"{utilization:.2f}%", f"{utilization_delta:.2f}")
 
     with my_grid.container():
-        avg_oil_price_today = filtered_data_today["Oil Price"].mean()
-        avg_oil_price_yesterday = filtered_data_yesterday["Oil Price"].mean()
+        avg_oil_price, avg_oil_price_delta = metrics["Avg. Heating Oil Price"]
         st.metric(
             "Avg. Heating Oil Price:",
-            f"{avg_oil_price_today:.2f} EUR",
-            f"{avg_oil_price_today - avg_oil_price_yesterday:.2f} EUR",
+            f"{avg_oil_price:.2f} EUR",
+            f"{avg_oil_price_delta:.2f} EUR",
             delta_color="inverse",
         )
 
@@ -6,13 +6,18 @@ import matplotlib.pyplot as plt
 import numpy as np 
 from datetime import datetime
 
-from src.forcasting import run_oil_consumption_forecasting, get_cleaned_data, fit_linear_model
+from src.forcasting import get_forecast, get_fleet_coefs
+from src.depletion import get_depletion_dates, get_depletion_intervals, format_depletion_date
+from src.storage import load_readings
+
+# Degree of the consumption model behind the depletion dates and their intervals
+DEPLETION_DEGREE = 3
 
 
 # Charts
 
 def load_data(file_path: str):
-    df = pd.read_pickle(file_path)
+    df = load_readings(file_path)
     df = df[df["Tank-ID"] != 5]
 
     # Berechne mindesfüllmenge mit 20%
@@ -79,83 +84,42 @@ def view_oil_forecast_page(CFG: dict) -> None:
                 f"One week before: {one_week_before} liters"
             )
         with col2:
-            reserve = filtered_data.sort_values('Zeitstempel', ascending=False).head(1)['Warnungsfüllstand'].values[0]
-            current_liters = filtered_data.sort_values('Zeitstempel', ascending=False).head(1)['Füllstand'].values[0]
-
-            clean_data = get_cleaned_data()
-            y_train, y_pred, y_pred_future = fit_linear_model(df=clean_data, context=2, forecast_days=10000)
-
-             # Convert timestamps
-            y_train["Zeitstempel"] = y_train["Zeitstempel"].astype("datetime64[ns]")
-            y_pred["Zeitstempel"] = y_pred["Zeitstempel"].astype("datetime64[ns]")
-            y_pred_future["Zeitstempel"] = y_pred_future["Zeitstempel"].astype("datetime64[ns]")
-            filtered_data["Zeitstempel"] = filtered_data["Zeitstempel"].astype("datetime64[ns]")
+            latest = filtered_data.sort_values("Zeitstempel").tail(1).set_index("Tank-ID")
+            reserve = latest["Warnungsfüllstand"].values[0]
 
-            # Add Füllstand
-            y_train = y_train.merge(filtered_data[["Zeitstempel", "Füllstand"]], left_on=["Zeitstempel"], right_on=["Zeitstempel"], how="left")
-            y_pred_future["Füllstand"] = current_liters
-            y_pred_future["Verbrauch kummuliert"] = y_pred_future['Verbrauch'].cumsum()
-            y_pred_future["Füllstand"] = y_pred_future["Füllstand"] - y_pred_future["Verbrauch kummuliert"]
-            y_pred_future["Prognostizierter Füllstand"] = y_pred_future["Füllstand"]
-            y_pred_future.drop("Füllstand", axis=1, inplace=True)
+            # First day the predicted level falls below the reserve, solved directly on the fitted model
+            coefs = get_fleet_coefs(context=number_of_days, degree=DEPLETION_DEGREE).loc[[tank_id]]
+            reserve_kauf = get_depletion_dates(coefs, latest["Füllstand"], latest["Warnungsfüllstand"])["date"]
+            reserve_kauf = format_depletion_date(reserve_kauf.values[0])
 
-            consumption_mean = filtered_data.sort_values('Zeitstempel', ascending=False).head(5)['Verbrauch'].sum() / 5
-            #prog_days = int(np.abs(current_liters / consumption_mean))
-
-            reserve_kauf = y_pred_future[y_pred_future["Prognostizierter Füllstand"] < reserve].head(1)["Zeitstempel"].values[0]
-            today = datetime.today()
-            # Differenz in Tagen berechnen
-            #days_difference = (today - datetime((reserve_kauf))).days
-            reserve_kauf = str(reserve_kauf).split('T')[0]
-
-            leer_kauf = y_pred_future[y_pred_future["Prognostizierter Füllstand"] < 0].head().values[0]
+            # P10 - P90 of the date from a residual bootstrap of the same fit
+            reserve_band = get_depletion_intervals(tank_id, reserve=0.2, context=number_of_days, degree=DEPLETION_DEGREE)
 
             st.metric(
                 "Need to buy (at a reserve of 20%):",
                 f"{reserve_kauf}",
-                f"{reserve} liters"
+                f"{reserve} liters",
+                help=f"80% interval: {format_depletion_date(reserve_band['date_P10'])} to "
+                f"{format_depletion_date(reserve_band['date_P90'])}",
             )
 
     # Row 2:
     with my_grid.container():
         col3, col4 = st.columns(2)  # Create two columns for the second row
         with col3:
-            reserve = filtered_data.sort_values('Zeitstempel', ascending=False).head(1)['Warnungsfüllstand'].values[0]
-            current_liters = filtered_data.sort_values('Zeitstempel', ascending=False).head(1)['Füllstand'].values[0]
+            latest = filtered_data.sort_values("Zeitstempel").tail(1).set_index("Tank-ID")
 
-            clean_data = get_cleaned_data()
-            y_train, y_pred, y_pred_future = fit_linear_model(df=clean_data, context=2, forecast_days=10000)
-
-             # Convert timestamps
-            y_train["Zeitstempel"] = y_train["Zeitstempel"].astype("datetime64[ns]")
-            y_pred["Zeitstempel"] = y_pred["Zeitstempel"].astype("datetime64[ns]")
-            y_pred_future["Zeitstempel"] = y_pred_future["Zeitstempel"].astype("datetime64[ns]")
-            filtered_data["Zeitstempel"] = filtered_data["Zeitstempel"].astype("datetime64[ns]")
-
-            # Add Füllstand
-            y_train = y_train.merge(filtered_data[["Zeitstempel", "Füllstand"]], left_on=["Zeitstempel"], right_on=["Zeitstempel"], how="left")
-            y_pred_future["Füllstand"] = current_liters
-            y_pred_future["Verbrauch kummuliert"] = y_pred_future['Verbrauch'].cumsum()
-            y_pred_future["Füllstand"] = y_pred_future["Füllstand"] - y_pred_future["Verbrauch kummuliert"]
-            y_pred_future["Prognostizierter Füllstand"] = y_pred_future["Füllstand"]
-            y_pred_future.drop("Füllstand", axis=1, inplace=True)
-
-            consumption_mean = filtered_data.sort_values('Zeitstempel', ascending=False).head(5)['Verbrauch'].sum() / 5
-            #prog_days = int(np.abs(current_liters / consumption_mean))
-
-            reserve_kauf = y_pred_future[y_pred_future["Prognostizierter Füllstand"] < reserve].head(1)["Zeitstempel"].values[0]
-            today = datetime.today()
-            # Differenz in Tagen berechnen
-            #days_difference = (today - datetime((reserve_kauf))).days
-            reserve_kauf = str(reserve_kauf).split('T')[0]
-
-            leer_kauf = y_pred_future[y_pred_future["Prognostizierter Füllstand"] < 0].head(1)["Zeitstempel"].values[0]
-            empty = str(leer_kauf).split('T')[0]
+            coefs = get_fleet_coefs(context=number_of_days, degree=DEPLETION_DEGREE).loc[[tank_id]]
+            leer_kauf = get_depletion_dates(coefs, latest["Füllstand"], latest["Füllstand"] * 0)["date"]
+            empty = format_depletion_date(leer_kauf.values[0])
+            empty_band = get_depletion_intervals(tank_id, context=number_of_days, degree=DEPLETION_DEGREE)
 
             st.metric(
                 "Empty on:",
                 f"{empty} ",
-                "-"
+                "-",
+                help=f"80% interval: {format_depletion_date(empty_band['date_P10'])} to "
+                f"{format_depletion_date(empty_band['date_P90'])}",
             )
 
         with col4:
@@ -176,8 +140,9 @@ def view_oil_forecast_page(CFG: dict) -> None:
         #     color=["#0000FF", "#FF0000", "#FF0000"],
         # )
 
-        clean_data = get_cleaned_data()
-        y_train, y_pred, y_pred_future = fit_linear_model(df=clean_data, context=number_of_days, forecast_days=number_of_forecast, degree=1)
+        y_train, y_pred, y_pred_future = get_forecast(
+            tank_id, context=number_of_days, forecast_days=number_of_forecast, degree=1
+        )
 
         # Convert timestamps
         y_train["Zeitstempel"] = y_train["Zeitstempel"].astype("datetime64[ns]")
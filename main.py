@@ -1,10 +1,14 @@
 """
 Entry point of the Pipeline
 Execute from root dir via "python3 main.py --config configs/config.yaml"
+
+Runs the whole pipeline without the dashboard and writes the results as parquet, e.g. from cron:
+"python3 main.py --tanks 1 2 3 --horizon 30 --workers 8", see src/batch.py
 """
 
 import src.utils.utils as utils
 
+from src.batch import BATCH_PATH, run_batch
 from src.utils.config_manager import ConfigManager
 from src.utils.logger import setup_logger
 
@@ -16,8 +20,17 @@ def main():
     CLI_ARGS: dict = utils.parse_args()
     CFG_MNGR: ConfigManager = ConfigManager(CLI_ARGS.get("config"))
     CFG: dict = CFG_MNGR.config
-
-    print(CFG)
+    logger.info(f"Loaded config: {CFG}")
+
+    manifest = run_batch(
+        tank_ids=CLI_ARGS.get("tanks"),
+        horizon=CLI_ARGS.get("horizon"),
+        context=CLI_ARGS.get("context"),
+        workers=CLI_ARGS.get("workers"),
+        output=CLI_ARGS.get("output") or CFG.get("batch", {}).get("output", BATCH_PATH),
+        resume=not CLI_ARGS.get("restart"),
+    )
+    print(f"Processed {manifest['run']['n_tanks']} tank(s), results in the recommendations/ and forecasts/ datasets.")
 
 
 if __name__ == "__main__":
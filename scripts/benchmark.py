@@ -0,0 +1,182 @@
+"""
+Benchmarks of the data pipeline on synthetic fleets, run from root via
+"python3 -m scripts.benchmark --tanks 10 1000 10000"
+
+Every benchmark reports its best wall time over --repeat runs, its throughput and the peak memory allocated while
+it runs (tracemalloc, measured in a separate run). Results are compared against the stored baselines, a benchmark
+that got slower than --tolerance times its baseline counts as a regression and makes the script exit with 1.
+Baselines are machine specific, record them with --update-baseline on the machine of the nightly run.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from src.fleet_state import FleetState
+from src.forcasting import fit_linear_model, fit_linear_models, get_cleaned_data
+from src.recommendation import forecast_consumption, optimize_purchases
+from src.storage import convert_pickle
+from src.utils.logger import setup_logger
+from src.utils.synthetic import generate_fleet
+
+logger = setup_logger(__name__)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+
+
+def measure(function: Callable, repeat: int) -> tuple:
+    """Returns the best wall time in seconds over repeat runs and the peak traced memory in MB of one more run."""
+    seconds = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 1024**2
+
+
+def prepare_dashboard_readings(fleet: pd.DataFrame) -> pd.DataFrame:
+    """Same preparation as the dashboard's load_data before the readings enter the FleetState."""
+    data = fleet[fleet["Tank-ID"] != 5].copy()
+    data["PLZ"] = data["PLZ"].astype(str).str.replace(".0", "", regex=False)
+    return data.rename(columns={"Linear Prozentwert": "Prozentualer Füllstand"})
+
+
+def run_benchmarks(n_tanks: int, days: int, repeat: int, sample: int, horizon: int) -> dict:
+    """
+    Runs all benchmarks on a synthetic fleet of n_tanks tanks over days days.
+
+    :return: dict -- Benchmark name -> {"seconds", "throughput", "unit", "peak_mb"}
+    """
+    results = {}
+
+    def record(name: str, function: Callable, items: int, unit: str) -> None:
+        seconds, peak_mb = measure(function, repeat)
+        results[name] = {"seconds": seconds, "throughput": items / seconds, "unit": unit, "peak_mb": peak_mb}
+        logger.info(f"{n_tanks} tanks x {days} days | {name}: {seconds:.4f} s, {items / seconds:,.0f} {unit}")
+
+    fleet = generate_fleet(n_tanks, days=days)
+    rows = len(fleet)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data_one_day_clean.pickle")
+        fleet.to_pickle(path)
+        convert_pickle(path)
+        record("get_cleaned_data", lambda: get_cleaned_data(path), rows, "rows/s")
+        clean_data = get_cleaned_data(path)
+
+    sample_ids = clean_data["Tank-ID"].unique()[:sample]
+    per_tank = [clean_data[clean_data["Tank-ID"] == tank_id] for tank_id in sample_ids]
+    record(
+        "fit_linear_model",
+        lambda: [fit_linear_model(df, context=90, degree=3, forecast_days=7) for df in per_tank],
+        len(per_tank),
+        "tanks/s",
+    )
+    record(
+        "fit_linear_models",
+        lambda: fit_linear_models(clean_data, context=90, degree=3, forecast_days=7),
+        n_tanks,
+        "tanks/s",
+    )
+
+    readings = prepare_dashboard_readings(fleet)
+
+    def _dashboard():
+        state = FleetState()
+        state.update_readings(readings)
+        state.today(), state.yesterday(), state.metrics()
+
+    record("load_data aggregation", _dashboard, rows, "rows/s")
+
+    coefs, _ = fit_linear_models(clean_data, context=90, degree=3, forecast_days=0)
+    latest = fleet.groupby("Tank-ID").tail(1).set_index("Tank-ID").reindex(coefs.index)
+    prices = 100 + np.cumsum(np.random.default_rng(0).normal(0, 0.5, (len(coefs), horizon)), axis=1)
+
+    def _recommendation():
+        optimize_purchases(
+            latest["Füllstand"].to_numpy(),
+            latest["Maximale Füllgrenze"].to_numpy(),
+            forecast_consumption(coefs, horizon),
+            prices,
+        )
+
+    record("recommendation scoring", _recommendation, len(coefs), "tanks/s")
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns a message for every benchmark that is slower than tolerance times its baseline."""
+    regressions = []
+    for scale, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            reference = baseline.get(scale, {}).get(name)
+            if reference is None:
+                continue
+            ratio = result["seconds"] / reference["seconds"]
+            status = "REGRESSION" if ratio > tolerance else "ok"
+            print(f"{scale:>14} | {name:<24} | {result['seconds']:9.4f} s | {ratio:5.2f}x baseline | {status}")
+            if ratio > tolerance:
+                regressions.append(f"{scale} {name}: {ratio:.2f}x slower than the baseline")
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    print(f"{'scale':>14} | {'benchmark':<24} | {'time':>11} | {'throughput':>22} | {'peak memory':>11}")
+    for scale, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            throughput = f"{result['throughput']:,.0f} {result['unit']}"
+            print(
+                f"{scale:>14} | {name:<24} | {result['seconds']:9.4f} s | {throughput:>22} | "
+                f"{result['peak_mb']:8.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tanks", nargs="+", default=[10, 1000], type=int, help="Fleet sizes to benchmark")
+    parser.add_argument("--days", default=3 * 365, type=int, help="Number of days per tank")
+    parser.add_argument("--repeat", default=3, type=int, help="Number of timed runs per benchmark")
+    parser.add_argument("--sample", default=100, type=int, help="Number of tanks fitted with fit_linear_model")
+    parser.add_argument("--horizon", default=30, type=int, help="Horizon of the recommendation in days")
+    parser.add_argument("--tolerance", default=1.5, type=float, help="Allowed slowdown relative to the baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="JSON file with the baseline results")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    results = {
+        f"{n_tanks}x{args.days}": run_benchmarks(n_tanks, args.days, args.repeat, args.sample, args.horizon)
+        for n_tanks in args.tanks
+    }
+    print_results(results)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(baseline, file, indent=2)
+            file.write("\n")
+        print(f"Stored the baseline in '{args.baseline}'")
+        sys.exit(0)
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\n".join(regressions))
+        sys.exit(1)
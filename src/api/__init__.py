@@ -1,7 +1,10 @@
 # src/api/__init__.py
 
 from .weather import WeatherAPI
+from .weather_store import WeatherArchive
 from .oil_price import OilPriceAPI
+from .price_store import PriceHistoryStore
+from .standin import StandInServer
 
 # Weitere API-Handler können hier importiert werden
 # Example later: from src.api import WeatherAPI, AnotherAPI
@@ -1,7 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import requests
 import pandas as pd
 
+from requests.adapters import HTTPAdapter
+
 
 class OilPriceAPI:
     """
@@ -16,13 +19,38 @@ class OilPriceAPI:
     -------
     get_heizoel(plz, start_date, end_date=None):
         Retrieves heating oil price data for a specified postal code and date range.
+
+    get_heizoel_bulk(plzs, start_date, end_date=None, max_workers=8):
+        Retrieves heating oil price data for many postal codes concurrently.
+
+    get_price_history(plz, start_date=None, end_date=None):
+        Retrieves typed heating oil prices from the local price history store, syncing missing days first.
     """
 
-    def __init__(self):
+    # rangeType values of the history-local endpoint by the number of days they cover, 7 is the full history.
+    # A delta that does not reach back to the last stored day falls back to the full history.
+    RANGE_TYPES = {1: 31, 2: 92, 3: 183, 4: 365, 7: None}
+
+    def __init__(self, max_workers=8, store=None, transport=None):
         """
-        Initializes the OilPriceAPI instance, setting up the API URL.
+        Initializes the OilPriceAPI instance, setting up the API URL and a pooled HTTP session
+        that is shared by all requests, so concurrent requests reuse their connections.
+
+        If a PriceHistoryStore is given, prices are answered from the store, which is topped up
+        with the days missing since the last sync.
+
+        A transport (requests adapter, e.g. StandInServer.adapter()) replaces the HTTPS connection
+        to Heizöl24, e.g. to run against a local stand-in.
         """
         self.heizoel24url = "https://www.heizoel24.de/api/site/1/{}/prices/history-local?"
+        self.max_workers = max_workers
+        self.store = store
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        if transport is not None:
+            self.session.mount("https://www.heizoel24.de", transport)
 
     def get_heizoel(self, plz, start_date, end_date=None):
         """
@@ -59,11 +87,21 @@ class OilPriceAPI:
         if end_date is None or end_date > current_date:
             end_date = current_date  # Use the current date as the default end date
 
+        if self.store is not None:
+            prices = self.get_price_history(plz, start_date, end_date)
+            if prices is None:
+                return None
+            df = prices.reset_index()
+            df["Date"] = df["Date"].dt.strftime("%Y-%m-%d")
+            df["Measurement"] = "EUR/100L"
+            df["PLZ"] = plz
+            return df
+
         heizoel24url_api = self.heizoel24url.format(plz)
 
         params = {"rangeType": 7, "withEndDate": False, "productGroup": "heizöl"}
 
-        response = requests.get(heizoel24url_api, params=params)
+        response = self.session.get(heizoel24url_api, params=params)
 
         if response.status_code == 200:
             data = response.json()
@@ -87,6 +125,112 @@ class OilPriceAPI:
 
         return df
 
+    def get_price_history(self, plz, start_date=None, end_date=None):
+        """
+        Retrieves heating oil prices from the local price history store. After the first load only the
+        days missing since the last sync are requested, and each postal code is synced at most once a day.
+
+        Parameters:
+        ----------
+        plz : str
+            The postal code for which to retrieve heating oil prices.
+
+        start_date, end_date : str, optional
+            Bounds of the date range (inclusive) in the format 'YYYY-MM-DD'.
+
+        Returns:
+        -------
+        pandas.DataFrame
+            A DataFrame with a DatetimeIndex "Date" and a float column "Price".
+            If nothing is stored and the request fails, None is returned.
+        """
+        if self.store is None:
+            raise ValueError("get_price_history requires a PriceHistoryStore")
+
+        today = pd.Timestamp.now().normalize()
+        if self.store.last_sync(plz) != today.strftime("%Y-%m-%d"):
+            last_date = self.store.last_date(plz)
+            range_type = self._range_type(None if last_date is None else (today - last_date).days)
+            prices = self._fetch_prices(plz, range_type)
+
+            if prices is not None and last_date is not None:
+                if range_type != 7 and (prices.empty or prices.index.min() > last_date):
+                    prices = self._fetch_prices(plz, 7)
+                if prices is not None:
+                    prices = prices[prices.index > last_date]
+
+            if prices is not None:
+                self.store.update(plz, prices)
+            elif last_date is None:
+                return None
+
+        return self.store.query(plz, start_date, end_date)
+
+    def _range_type(self, missing_days):
+        """Smallest rangeType that covers the missing days, the full history if nothing is stored yet."""
+        if missing_days is None:
+            return 7
+        covering = [rt for rt, days in self.RANGE_TYPES.items() if days is not None and days > missing_days]
+        return min(covering, key=self.RANGE_TYPES.get) if covering else 7
+
+    def _fetch_prices(self, plz, range_type):
+        """Requests a price history and returns it with a DatetimeIndex "Date" and a float column "Price"."""
+        params = {"rangeType": range_type, "withEndDate": False, "productGroup": "heizöl"}
+        response = self.session.get(self.heizoel24url.format(plz), params=params)
+
+        if response.status_code != 200:
+            print(f"Failed to retrieve data. Status code: {response.status_code}")
+            return None
+
+        df = pd.DataFrame(response.json())
+        if df.empty:
+            return pd.DataFrame({"Price": pd.Series(dtype=float)}, index=pd.DatetimeIndex([], name="Date"))
+
+        dates = pd.to_datetime(df["DateTime"])
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_localize(None)
+        prices = pd.DataFrame(
+            {"Price": df["Price"].astype(float).to_numpy()}, index=pd.DatetimeIndex(dates.dt.normalize(), name="Date")
+        )
+        prices = prices[~prices.index.duplicated(keep="last")].sort_index()
+        return prices
+
+    def get_heizoel_bulk(self, plzs, start_date, end_date=None, max_workers=None):
+        """
+        Retrieves heating oil price data for many postal codes concurrently on a bounded thread pool.
+
+        Parameters:
+        ----------
+        plzs : Iterable[str]
+            The postal codes for which to retrieve heating oil prices. Duplicates are fetched once.
+
+        start_date : str
+            The start date for the data retrieval in the format 'YYYY-MM-DD'.
+
+        end_date : str, optional
+            The end date for the data retrieval in the format 'YYYY-MM-DD'.
+
+        max_workers : int, optional
+            Maximum number of concurrent requests, defaults to the value given at initialization.
+
+        Returns:
+        -------
+        pandas.DataFrame
+            The frames of get_heizoel for all postal codes, assembled with a single concat.
+            Postal codes whose request failed are left out.
+        """
+        plzs = list(dict.fromkeys(plzs))
+        max_workers = max_workers or self.max_workers
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(executor.map(lambda plz: self.get_heizoel(plz, start_date, end_date), plzs))
+
+        frames = [df for df in frames if df is not None]
+        if not frames:
+            return pd.DataFrame(columns=["Date", "Price", "Measurement", "PLZ"])
+
+        return pd.concat(frames, ignore_index=True)
+
 
 # main
 if __name__ == "__main__":
@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+
+import pandas as pd
+
+
+class PriceHistoryStore:
+    """
+    A local store of heating oil price histories, one parquet file per postal code.
+
+    Every history is kept as a DataFrame with a typed DatetimeIndex ("Date") and a float "Price" column,
+    so date-range queries are index slices instead of string comparisons. The store also remembers the
+    day each postal code was last synced, which lets OilPriceAPI request only the missing days.
+
+    Methods:
+    -------
+    load(plz):
+        Returns the stored history of a postal code.
+    query(plz, start_date, end_date):
+        Returns the stored prices of a postal code within a date range.
+    update(plz, prices):
+        Merges new prices into the stored history and marks the postal code as synced today.
+    last_date(plz):
+        Returns the newest stored day of a postal code.
+    last_sync(plz):
+        Returns the day a postal code was last synced.
+    """
+
+    def __init__(self, root="data/processed/prices"):
+        """
+        Initializes the store in the given directory, creating it if necessary.
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sync_file = os.path.join(root, "_synced.json")
+        self._synced = {}
+        if os.path.exists(self._sync_file):
+            with open(self._sync_file, "r", encoding="utf-8") as file:
+                self._synced = json.load(file)
+        self._histories = {}
+
+    def load(self, plz):
+        plz = str(plz)
+        if plz not in self._histories:
+            path = self._path(plz)
+            if os.path.exists(path):
+                self._histories[plz] = pd.read_parquet(path)
+            else:
+                self._histories[plz] = pd.DataFrame(
+                    {"Price": pd.Series(dtype=float)}, index=pd.DatetimeIndex([], name="Date")
+                )
+        return self._histories[plz]
+
+    def query(self, plz, start_date=None, end_date=None):
+        return self.load(plz).loc[start_date:end_date]
+
+    def update(self, plz, prices):
+        """
+        Merges new prices (DatetimeIndex "Date", column "Price") into the history, newer values win.
+        """
+        plz = str(plz)
+        history = pd.concat([self.load(plz), prices[["Price"]].astype(float)])
+        history = history[~history.index.duplicated(keep="last")].sort_index()
+        history.index.name = "Date"
+        history.to_parquet(self._path(plz))
+        self._histories[plz] = history
+
+        with self._lock:
+            self._synced[plz] = pd.Timestamp.now().strftime("%Y-%m-%d")
+            with open(self._sync_file, "w", encoding="utf-8") as file:
+                json.dump(self._synced, file, indent=2)
+
+    def last_date(self, plz):
+        history = self.load(plz)
+        return history.index.max() if len(history) else None
+
+    def last_sync(self, plz):
+        return self._synced.get(str(plz))
+
+    def _path(self, plz):
+        return os.path.join(self.root, f"{plz}.parquet")
@@ -0,0 +1,299 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+import flatbuffers
+import numpy as np
+import pandas as pd
+
+from requests.adapters import HTTPAdapter
+
+
+class StandInServer:
+    """
+    A local stand-in for the Heizöl24 and Open-Meteo APIs, running an HTTP server on localhost in a daemon thread.
+
+    The server answers with synthetic responses (`synthetic_heizoel24`, `synthetic_open_meteo`) or replays
+    recorded ones (`ReplayHandler`), and injects latency, errors and rate limits so that concurrency, caching and
+    retry behaviour of the API clients can be measured reproducibly without the network. The APIs are pointed at
+    the server through their `transport` argument, see `adapter`.
+
+    Methods:
+    -------
+    start():
+        Starts the server, also done by entering the server as a context manager.
+    stop():
+        Stops the server.
+    adapter(pool_maxsize=10):
+        Returns a requests transport adapter that sends all requests to the server instead of the real host.
+    stats:
+        Number of requests per path and per status code, and the log of all requests.
+    """
+
+    def __init__(self, handlers=None, latency=0.0, error_rate=0.0, error_status=500, rate_limit=None, seed=0):
+        """
+        :param handlers: dict -- Path prefix -> handler(path, query) returning (status, content type, body).
+            Defaults to the synthetic handlers of both APIs.
+        :param latency: float or tuple -- Delay per request in seconds, or (min, max) of a uniform delay
+        :param error_rate: float -- Share of requests answered with an error
+        :param error_status: int -- Status code of the injected errors
+        :param rate_limit: float -- Requests per second (with an equal burst) before answering with 429, unlimited
+            if None
+        :param seed: int -- Seed of the injected latency and errors
+        """
+        self.handlers = handlers or {
+            "/api/site/1/": synthetic_heizoel24,
+            "/v1/": synthetic_open_meteo,
+        }
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit = rate_limit
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = rate_limit or 0.0
+        self._refilled = time.monotonic()
+        self._log = []
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self):
+        with self._lock:
+            log = pd.DataFrame(self._log, columns=["time", "path", "status", "seconds"])
+        return {
+            "requests": len(log),
+            "by_path": log.groupby("path").size().to_dict(),
+            "by_status": log.groupby("status").size().to_dict(),
+            "log": log,
+        }
+
+    def start(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def adapter(self, pool_maxsize=10):
+        return StandInAdapter(self.url, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+
+    def _handle(self, request):
+        started = time.perf_counter()
+        url = urlsplit(request.path)
+        with self._lock:
+            delay = self.latency if not isinstance(self.latency, tuple) else self._random.uniform(*self.latency)
+            failed = self._random.random() < self.error_rate
+            limited = not self._take_token()
+        time.sleep(delay)
+
+        if limited:
+            status, content_type, body = 429, "application/json", _error("Too many requests")
+        elif failed:
+            status, content_type, body = self.error_status, "application/json", _error("Injected error")
+        else:
+            handler = next((h for prefix, h in self.handlers.items() if url.path.startswith(prefix)), None)
+            if handler is None:
+                status, content_type, body = 404, "application/json", _error(f"No handler for {url.path}")
+            else:
+                status, content_type, body = handler(url.path, parse_qs(url.query))
+
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            request.send_header("Retry-After", "1")
+        request.end_headers()
+        request.wfile.write(body)
+
+        with self._lock:
+            self._log.append((time.time(), url.path, status, time.perf_counter() - started))
+
+    def _take_token(self):
+        """Token bucket of the rate limit, called with the lock held."""
+        if self.rate_limit is None:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class StandInAdapter(HTTPAdapter):
+    """
+    Transport adapter that sends requests to a stand-in server instead of their host. Connection pooling and
+    retries (max_retries) behave as with the real HTTPS adapter.
+    """
+
+    def __init__(self, base_url, **kwargs):
+        self.base_url = urlsplit(base_url)
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        request.url = urlunsplit((self.base_url.scheme, self.base_url.netloc, url.path, url.query, url.fragment))
+        return super().send(request, **kwargs)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Transport adapter that passes requests on to their host and stores every response in a directory,
+    to be replayed by ReplayHandler.
+    """
+
+    def __init__(self, directory, **kwargs):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        url = urlsplit(request.url)
+        path = os.path.join(self.directory, request_key(url.path, parse_qs(url.query)))
+        with open(path, "wb") as file:
+            file.write(json.dumps([response.status_code, response.headers.get("Content-Type", "")]).encode() + b"\n")
+            file.write(response.content)
+        return response
+
+
+class ReplayHandler:
+    """Handler that answers with the responses stored by RecordingAdapter, 404 for unknown requests."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __call__(self, path, query):
+        file_path = os.path.join(self.directory, request_key(path, query))
+        if not os.path.exists(file_path):
+            return 404, "application/json", _error(f"No recording for {path}")
+        with open(file_path, "rb") as file:
+            status, content_type = json.loads(file.readline())
+            return status, content_type, file.read()
+
+
+def request_key(path, query):
+    """Name of the recording of a request, independent of the order of the query parameters."""
+    query = sorted((key, sorted(values)) for key, values in query.items())
+    return hashlib.sha1(json.dumps([path, query]).encode()).hexdigest()
+
+
+def synthetic_heizoel24(path, query):
+    """Deterministic price history per postal code in the format of the history-local endpoint."""
+    plz = path.split("/")[4]
+    days = {1: 31, 2: 92, 3: 183, 4: 365}.get(int(query.get("rangeType", ["7"])[0]), 3 * 365)
+    dates = pd.date_range(end=pd.Timestamp.now().normalize(), periods=days, freq="D")
+    dates = dates[dates.dayofweek < 5]
+
+    rng = np.random.default_rng(int(plz) if plz.isdigit() else 0)
+    prices = 95 + int(plz[:2] if plz[:2].isdigit() else 0) * 0.05 + np.cumsum(rng.normal(0, 0.4, len(dates)))
+    body = [
+        {"DateTime": date.strftime("%Y-%m-%dT00:00:00"), "Price": round(float(price), 2)}
+        for date, price in zip(dates, prices)
+    ]
+    return 200, "application/json", json.dumps(body).encode()
+
+
+def synthetic_open_meteo(path, query):
+    """Deterministic daily weather per location, encoded like the FlatBuffers format of Open-Meteo."""
+    latitudes = _floats(query.get("latitude", []))
+    longitudes = _floats(query.get("longitude", []))
+    variables = [v for values in query.get("daily", []) for v in values.split(",")]
+    today = pd.Timestamp.now(tz="UTC").normalize()
+
+    if path.endswith("/forecast"):
+        dates = pd.date_range(today, periods=int(query.get("forecast_days", ["7"])[0]), freq="D")
+    else:
+        dates = pd.date_range(query["start_date"][0], query["end_date"][0], freq="D", tz="UTC")
+
+    season = np.cos(2 * np.pi * (dates.dayofyear.to_numpy() - 200) / 365)
+    body = b""
+    for latitude, longitude in zip(latitudes, longitudes):
+        mean = 9 - 10 * season - (latitude - 50) * 0.6
+        columns = []
+        for variable in variables:
+            if variable.startswith(("temperature", "apparent_temperature")):
+                offset = 4 if variable.endswith("max") else -4 if variable.endswith("min") else 0
+                columns.append(mean + offset)
+            elif variable == "sunshine_duration":
+                columns.append(3600 * (8 + 4 * -season))
+            else:
+                columns.append(np.abs(np.sin(dates.dayofyear.to_numpy() * (latitude + longitude))) * 3)
+        body += encode_daily_response(latitude, longitude, dates, columns)
+    return 200, "application/octet-stream", body
+
+
+def encode_daily_response(latitude, longitude, dates, columns):
+    """
+    Encodes one location as a size-prefixed WeatherApiResponse with daily variables, as read by
+    openmeteo_requests. openmeteo_sdk only ships the readers, so the tables are built field by field.
+    """
+    builder = flatbuffers.Builder(1024)
+
+    variables = []
+    for values in columns:
+        vector = builder.CreateNumpyVector(np.asarray(values, dtype=np.float32))
+        builder.StartObject(13)  # VariableWithValues
+        builder.PrependUOffsetTRelativeSlot(3, vector, 0)  # values
+        variables.append(builder.EndObject())
+
+    builder.StartVector(4, len(variables), 4)
+    for variable in reversed(variables):
+        builder.PrependUOffsetTRelative(variable)
+    variables = builder.EndVector()
+
+    interval = 24 * 3600
+    builder.StartObject(4)  # VariablesWithTime
+    builder.PrependInt64Slot(0, int(dates[0].timestamp()), 0)  # time
+    builder.PrependInt64Slot(1, int(dates[-1].timestamp()) + interval, 0)  # time_end
+    builder.PrependInt32Slot(2, interval, 0)  # interval
+    builder.PrependUOffsetTRelativeSlot(3, variables, 0)  # variables
+    daily = builder.EndObject()
+
+    builder.StartObject(15)  # WeatherApiResponse
+    builder.PrependFloat32Slot(0, latitude, 0.0)
+    builder.PrependFloat32Slot(1, longitude, 0.0)
+    builder.PrependUOffsetTRelativeSlot(10, daily, 0)  # daily
+    builder.FinishSizePrefixed(builder.EndObject())
+    return bytes(builder.Output())
+
+
+def _floats(values):
+    return [float(v) for value in values for v in value.split(",")]
+
+
+def _error(reason):
+    return json.dumps({"error": True, "reason": reason}).encode()
@@ -1,9 +1,24 @@
+import numpy as np
 import openmeteo_requests
 import requests_cache
 import pandas as pd
 from retry_requests import retry
+from contextlib import nullcontext
 from datetime import datetime
 
+DAILY_VARIABLES = [
+    "temperature_2m_max",
+    "temperature_2m_min",
+    "temperature_2m_mean",
+    "apparent_temperature_max",
+    "apparent_temperature_min",
+    "apparent_temperature_mean",
+    "sunshine_duration",
+    "precipitation_sum",
+    "rain_sum",
+    "snowfall_sum",
+]
+
 
 class WeatherAPI:
     """
@@ -20,6 +35,8 @@ class WeatherAPI:
         The URL endpoint for accessing forecast weather data from the Open-Meteo API.
     openmeteo : Client
         A client object that makes HTTP requests to the Open-Meteo API, with caching enabled and automatic retries.
+    archive : WeatherArchive
+        Optional local archive of daily weather data, see src.api.weather_store.
 
     Methods:
     -------
@@ -35,6 +52,13 @@ class WeatherAPI:
         Helper method that retrieves forecast weather data from the Open-Meteo API using the provided parameters.
         Returns the data as a pandas DataFrame.
 
+    get_history(latitude, longitude, start_date, end_date):
+        Returns past days from the local archive, e.g. for historical weather joins in model training.
+
+    get_data_bulk(latitudes, longitudes, start_date, end_date, grid=0.1, batch_size=100):
+        Fetches the same data as `get_data` for many locations at once. Locations in the same grid cell are
+        fetched once and the remaining cells are sent as batched multi-coordinate requests.
+
     Usage:
     ------
         - Instantiate the class and call the `get_data` method to retrieve weather data for a specified latitude, longitude, and date range.
@@ -48,17 +72,36 @@ class WeatherAPI:
         print(data)
     """
 
-    def __init__(self):
+    def __init__(self, archive=None, forecast_ttl=3600, transport=None):
         """
         Initializes the WeatherAPI instance, setting up the API key, URLs, and the Open-Meteo client
         with caching and retry functionality.
+
+        The HTTP cache keeps forecast responses for `forecast_ttl` seconds and archive responses for a day.
+        If a WeatherArchive is given, past days are served from the archive and only missing days are requested.
+        A transport (requests adapter, e.g. StandInServer.adapter()) replaces the HTTPS connection to
+        Open-Meteo. Its responses are cached in memory only, so they never mix with the on-disk cache.
         """
         self.api_key = None
         self.history_url = "https://archive-api.open-meteo.com/v1/archive"
         self.forecast_url = "https://api.open-meteo.com/v1/forecast"
-
-        cache_session = requests_cache.CachedSession(".cache", expire_after=3600)
+        self.archive = archive
+
+        cache_session = requests_cache.CachedSession(
+            ".cache",
+            backend="sqlite" if transport is None else "memory",
+            expire_after=3600,
+            urls_expire_after={
+                "archive-api.open-meteo.com": 24 * 3600,
+                "api.open-meteo.com": forecast_ttl,
+            },
+        )
         retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
+        if transport is not None:
+            # Keep the retries of the default adapter
+            transport.max_retries = retry_session.get_adapter("https://").max_retries
+            retry_session.mount(self.history_url, transport)
+            retry_session.mount(self.forecast_url, transport)
         self.openmeteo = openmeteo_requests.Client(session=retry_session)
 
     def get_data(self, latitude, longitude, start_date, end_date):
@@ -89,95 +132,113 @@ class WeatherAPI:
             forecast data are included. If only historical data is requested, the DataFrame will only
             contain historical metrics.
         """
-        current_date = datetime.now().strftime("%Y-%m-%d")
+        return self._get_locations([latitude], [longitude], start_date, end_date)[0]
 
-        param_day = (datetime.now() - pd.Timedelta(days=1)).strftime("%Y-%m-%d")
-
-        def get_history_data(params):
-            """
-            Helper method to retrieve historical weather data from the Open-Meteo API.
-
-            Parameters:
-            ----------
-            params : dict
-                The parameters to be sent to the Open-Meteo API for retrieving historical data.
+    def get_data_bulk(self, latitudes, longitudes, start_date, end_date, grid=0.1, batch_size=100):
+        """
+        Retrieves the same data as `get_data` for many locations. Locations are snapped to a grid of
+        `grid` degrees, every occupied grid cell is fetched once, and the cells are sent as multi-coordinate
+        requests of up to `batch_size` locations (one archive and one forecast request per batch).
 
-            Returns:
-            -------
-            pandas.DataFrame
-                A DataFrame containing historical weather data.
-            """
-            responses = self.openmeteo.weather_api("https://archive-api.open-meteo.com/v1/archive", params=params)
+        Parameters:
+        ----------
+        latitudes, longitudes : array-like of float
+            The coordinates of the locations, e.g. one per tank.
 
-            response = responses[0]
+        start_date, end_date : str
+            The date range in the format 'YYYY-MM-DD', see `get_data`.
 
-            daily = response.Daily()
+        grid : float, optional
+            Size of a grid cell in degrees. Locations within the same cell share one weather series.
 
-            daily_data = {
-                "date": pd.date_range(
-                    start=pd.to_datetime(daily.Time(), unit="s", utc=True),
-                    end=pd.to_datetime(daily.TimeEnd(), unit="s", utc=True),
-                    freq=pd.Timedelta(seconds=daily.Interval()),
-                    inclusive="left",
-                ),
-                "temperature_2m_max": daily.Variables(0).ValuesAsNumpy(),
-                "temperature_2m_min": daily.Variables(1).ValuesAsNumpy(),
-                "temperature_2m_mean": daily.Variables(2).ValuesAsNumpy(),
-                "apparent_temperature_max": daily.Variables(3).ValuesAsNumpy(),
-                "apparent_temperature_min": daily.Variables(4).ValuesAsNumpy(),
-                "apparent_temperature_mean": daily.Variables(5).ValuesAsNumpy(),
-                "sunshine_duration": daily.Variables(6).ValuesAsNumpy(),
-                "precipitation_sum": daily.Variables(7).ValuesAsNumpy(),
-                "rain_sum": daily.Variables(8).ValuesAsNumpy(),
-                "snowfall_sum": daily.Variables(9).ValuesAsNumpy(),
-            }
+        batch_size : int, optional
+            Maximum number of coordinates per request.
 
-            daily_history = pd.DataFrame(daily_data)
+        Returns:
+        -------
+        pandas.DataFrame
+            A long-format DataFrame with the column "location" (position of the location in the input),
+            "latitude", "longitude" and the columns returned by `get_data`.
+        """
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+
+        cells = pd.DataFrame({"lat": np.round(latitudes / grid) * grid, "lon": np.round(longitudes / grid) * grid})
+        # Cells are numbered in order of first appearance, same order as drop_duplicates
+        cell_ids = cells.groupby(["lat", "lon"], sort=False).ngroup().to_numpy()
+        unique_cells = cells.drop_duplicates(ignore_index=True)
+
+        frames = []
+        # The archive index is saved once for all batches
+        with self.archive.batch() if self.archive is not None else nullcontext():
+            for start in range(0, len(unique_cells), batch_size):
+                batch = unique_cells.iloc[start : start + batch_size]
+                frames.extend(self._get_locations(batch["lat"].tolist(), batch["lon"].tolist(), start_date, end_date))
+
+        results = []
+        for location, cell_id in enumerate(cell_ids):
+            frame = frames[cell_id].copy()
+            frame.insert(0, "longitude", longitudes[location])
+            frame.insert(0, "latitude", latitudes[location])
+            frame.insert(0, "location", location)
+            results.append(frame)
+
+        return pd.concat(results, ignore_index=True)
+
+    def get_history(self, latitude, longitude, start_date, end_date):
+        """
+        Retrieves past days for one location from the local archive, requesting only the days
+        that are not archived yet. Requires an archive.
 
-            return daily_history
+        Returns:
+        -------
+        pandas.DataFrame
+            A DataFrame with the same columns as `get_data`.
+        """
+        if self.archive is None:
+            raise ValueError("get_history requires a WeatherArchive")
+        return self._get_histories([latitude], [longitude], start_date, end_date)[0]
 
-        def get_forecast_data(params):
-            """
-            Helper method to retrieve forecast weather data from the Open-Meteo API.
+    def get_history_data(self, params):
+        """
+        Helper method to retrieve historical weather data from the Open-Meteo API.
 
-            Parameters:
-            ----------
-            params : dict
-                The parameters to be sent to the Open-Meteo API for retrieving forecast data.
+        Parameters:
+        ----------
+        params : dict
+            The parameters to be sent to the Open-Meteo API for retrieving historical data.
 
-            Returns:
-            -------
-            pandas.DataFrame
-                A DataFrame containing forecast weather data.
-            """
-            responses = self.openmeteo.weather_api("https://api.open-meteo.com/v1/forecast", params=params)
+        Returns:
+        -------
+        pandas.DataFrame
+            A DataFrame containing historical weather data.
+        """
+        return self._get_daily_frames(self.history_url, params)[0]
 
-            response = responses[0]
+    def get_forecast_data(self, params):
+        """
+        Helper method to retrieve forecast weather data from the Open-Meteo API.
 
-            daily = response.Daily()
+        Parameters:
+        ----------
+        params : dict
+            The parameters to be sent to the Open-Meteo API for retrieving forecast data.
 
-            daily_data = {
-                "date": pd.date_range(
-                    start=pd.to_datetime(daily.Time(), unit="s", utc=True),
-                    end=pd.to_datetime(daily.TimeEnd(), unit="s", utc=True),
-                    freq=pd.Timedelta(seconds=daily.Interval()),
-                    inclusive="left",
-                ),
-                "temperature_2m_max": daily.Variables(0).ValuesAsNumpy(),
-                "temperature_2m_min": daily.Variables(1).ValuesAsNumpy(),
-                "temperature_2m_mean": daily.Variables(2).ValuesAsNumpy(),
-                "apparent_temperature_max": daily.Variables(3).ValuesAsNumpy(),
-                "apparent_temperature_min": daily.Variables(4).ValuesAsNumpy(),
-                "apparent_temperature_mean": daily.Variables(5).ValuesAsNumpy(),
-                "sunshine_duration": daily.Variables(6).ValuesAsNumpy(),
-                "precipitation_sum": daily.Variables(7).ValuesAsNumpy(),
-                "rain_sum": daily.Variables(8).ValuesAsNumpy(),
-                "snowfall_sum": daily.Variables(9).ValuesAsNumpy(),
-            }
+        Returns:
+        -------
+        pandas.DataFrame
+            A DataFrame containing forecast weather data.
+        """
+        return self._get_daily_frames(self.forecast_url, params)[0]
 
-            daily_forecast = pd.DataFrame(daily_data)
+    def _get_locations(self, latitudes, longitudes, start_date, end_date):
+        """
+        Retrieves the data of `get_data` for a list of locations with one request per endpoint.
+        Returns one DataFrame per location, in the order of the input.
+        """
+        current_date = datetime.now().strftime("%Y-%m-%d")
 
-            return daily_forecast
+        param_day = (datetime.now() - pd.Timedelta(days=1)).strftime("%Y-%m-%d")
 
         if end_date > current_date:
             days_difference = (
@@ -185,71 +246,105 @@ class WeatherAPI:
             ).days
 
             forecast_days = min(days_difference, 16)
-            print(forecast_days)
-
-            params_history = {
-                "latitude": latitude,
-                "longitude": longitude,
-                "start_date": start_date,
-                "end_date": param_day,
-                "daily": [
-                    "temperature_2m_max",
-                    "temperature_2m_min",
-                    "temperature_2m_mean",
-                    "apparent_temperature_max",
-                    "apparent_temperature_min",
-                    "apparent_temperature_mean",
-                    "sunshine_duration",
-                    "precipitation_sum",
-                    "rain_sum",
-                    "snowfall_sum",
-                ],
-            }
-
-            params_forecast = {
-                "latitude": latitude,
-                "longitude": longitude,
-                "daily": [
-                    "temperature_2m_max",
-                    "temperature_2m_min",
-                    "temperature_2m_mean",
-                    "apparent_temperature_max",
-                    "apparent_temperature_min",
-                    "apparent_temperature_mean",
-                    "sunshine_duration",
-                    "precipitation_sum",
-                    "rain_sum",
-                    "snowfall_sum",
-                ],
-                "forecast_days": forecast_days + 1,
-            }
 
-            history = get_history_data(params_history)
-            forecast = get_forecast_data(params_forecast)
+            histories = self._get_histories(latitudes, longitudes, start_date, param_day)
+            forecasts = self._get_forecasts(latitudes, longitudes, forecast_days + 1)
 
-            combined_data = pd.concat([history, forecast], ignore_index=True)
-            return combined_data
+            return [
+                pd.concat([history, forecast], ignore_index=True) for history, forecast in zip(histories, forecasts)
+            ]
 
         else:
 
+            return self._get_histories(latitudes, longitudes, start_date, end_date)
+
+    def _get_histories(self, latitudes, longitudes, start_date, end_date):
+        """
+        Retrieves past days for a list of locations. With an archive, only the days that are not stored
+        (or have not settled yet) are requested, with one request for all incomplete locations.
+        """
+        if self.archive is None:
             params_history = {
-                "latitude": latitude,
-                "longitude": longitude,
+                "latitude": latitudes,
+                "longitude": longitudes,
                 "start_date": start_date,
                 "end_date": end_date,
-                "daily": [
-                    "temperature_2m_max",
-                    "temperature_2m_min",
-                    "temperature_2m_mean",
-                    "apparent_temperature_max",
-                    "apparent_temperature_min",
-                    "apparent_temperature_mean",
-                    "sunshine_duration",
-                    "precipitation_sum",
-                    "rain_sum",
-                    "snowfall_sum",
-                ],
+                "daily": DAILY_VARIABLES,
+            }
+            return self._get_daily_frames(self.history_url, params_history)
+
+        with self.archive.batch():
+            keys = [self.archive.location_key(lat, lon) for lat, lon in zip(latitudes, longitudes)]
+            missing = {i: self.archive.missing(key, start_date, end_date) for i, key in enumerate(keys)}
+            missing = {i: days for i, days in missing.items() if days is not None}
+
+            if missing:
+                params_history = {
+                    "latitude": [latitudes[i] for i in missing],
+                    "longitude": [longitudes[i] for i in missing],
+                    "start_date": min(days[0] for days in missing.values()),
+                    "end_date": max(days[1] for days in missing.values()),
+                    "daily": DAILY_VARIABLES,
+                }
+                frames = self._get_daily_frames(self.history_url, params_history)
+                for i, frame in zip(missing, frames):
+                    self.archive.put_history(keys[i], frame)
+
+            return [self.archive.history(key, start_date, end_date) for key in keys]
+
+    def _get_forecasts(self, latitudes, longitudes, forecast_days):
+        """
+        Retrieves forecasts for a list of locations. With an archive, forecasts younger than its TTL are reused.
+        """
+        if self.archive is None:
+            params_forecast = {
+                "latitude": latitudes,
+                "longitude": longitudes,
+                "daily": DAILY_VARIABLES,
+                "forecast_days": forecast_days,
+            }
+            return self._get_daily_frames(self.forecast_url, params_forecast)
+
+        with self.archive.batch():
+            keys = [self.archive.location_key(lat, lon) for lat, lon in zip(latitudes, longitudes)]
+            forecasts = [self.archive.forecast(key, forecast_days) for key in keys]
+            stale = [i for i, forecast in enumerate(forecasts) if forecast is None]
+
+            if stale:
+                params_forecast = {
+                    "latitude": [latitudes[i] for i in stale],
+                    "longitude": [longitudes[i] for i in stale],
+                    "daily": DAILY_VARIABLES,
+                    "forecast_days": forecast_days,
+                }
+                for i, frame in zip(stale, self._get_daily_frames(self.forecast_url, params_forecast)):
+                    self.archive.put_forecast(keys[i], frame)
+                    forecasts[i] = frame
+
+            return [forecast.head(forecast_days) for forecast in forecasts]
+
+    def _get_daily_frames(self, url, params):
+        """
+        Sends one request and decodes the daily variables of every location in the response.
+        Returns one DataFrame per requested location.
+        """
+        responses = self.openmeteo.weather_api(url, params=params)
+
+        frames = []
+        for response in responses:
+            daily = response.Daily()
+
+            daily_data = {
+                "date": pd.date_range(
+                    start=pd.to_datetime(daily.Time(), unit="s", utc=True),
+                    end=pd.to_datetime(daily.TimeEnd(), unit="s", utc=True),
+                    freq=pd.Timedelta(seconds=daily.Interval()),
+                    inclusive="left",
+                )
             }
+            for index, variable in enumerate(params["daily"]):
+                daily_data[variable] = daily.Variables(index).ValuesAsNumpy()
+
+            frames.append(pd.DataFrame(daily_data))
 
-            history = get_history_data(params_history)
-            return history
+        return frames
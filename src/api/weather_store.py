@@ -0,0 +1,193 @@
+import json
+import os
+import time
+
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+class WeatherArchive:
+    """
+    A local, size-bounded archive of daily weather data, one set of parquet files per location.
+
+    Caching policy:
+    ------
+        - Past days are stored permanently and topped up incrementally. Days younger than `settle_days` are
+          still revised by Open-Meteo, so they are stored but requested again until they have settled.
+        - Forecast days are kept for `forecast_ttl` seconds.
+        - If the archive grows beyond `max_bytes`, the least recently used locations are evicted.
+        - The index of access times and file sizes is kept in memory. Writes are saved at once, access times at most
+          every `flush_interval` seconds. Within `batch()` the index is saved once at the end.
+
+    Methods:
+    -------
+    history(key, start_date=None, end_date=None):
+        Returns the stored past days of a location.
+    missing(key, start_date, end_date):
+        Returns the date range that has to be requested to complete the history of a location, or None.
+    put_history(key, frame):
+        Merges fetched past days into the history of a location.
+    forecast(key, days):
+        Returns the stored forecast of a location if it is fresh and covers `days` days, otherwise None.
+    put_forecast(key, frame):
+        Stores a fetched forecast of a location.
+    batch():
+        Context manager that saves the index once for all accesses within it, e.g. one bulk request.
+    flush():
+        Saves the index if it changed.
+    """
+
+    def __init__(
+        self,
+        root="data/processed/weather",
+        max_bytes=512 * 1024**2,
+        forecast_ttl=3 * 3600,
+        settle_days=7,
+        flush_interval=30,
+    ):
+        """
+        Initializes the archive in the given directory, creating it if necessary.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.forecast_ttl = forecast_ttl
+        self.settle_days = settle_days
+        self.flush_interval = flush_interval
+        os.makedirs(root, exist_ok=True)
+
+        self._index_file = os.path.join(root, "_index.json")
+        self._index = {}
+        if os.path.exists(self._index_file):
+            with open(self._index_file, "r", encoding="utf-8") as file:
+                self._index = json.load(file)
+        self._batches = 0
+        self._dirty = False
+        self._flushed = time.monotonic()
+
+        # Indexes written before the sizes were tracked are measured once
+        for key, entry in self._index.items():
+            for kind in ("history", "forecast"):
+                if f"{kind}_bytes" not in entry:
+                    entry[f"{kind}_bytes"] = self._size(key, kind)
+                    self._dirty = True
+        self._total = sum(entry["history_bytes"] + entry["forecast_bytes"] for entry in self._index.values())
+
+    @staticmethod
+    def location_key(latitude, longitude):
+        return f"{latitude:.4f}_{longitude:.4f}"
+
+    def history(self, key, start_date=None, end_date=None):
+        path = self._path(key, "history")
+        if not os.path.exists(path):
+            return None
+        self._touch(key)
+        frame = pd.read_parquet(path)
+        return frame.loc[start_date:end_date].reset_index()
+
+    def missing(self, key, start_date, end_date):
+        """
+        Returns (start_date, end_date) of the smallest range that covers all days in [start_date, end_date]
+        which are not stored or have not settled yet, or None if the stored history is complete.
+        """
+        requested = pd.date_range(start_date, end_date, freq="D", tz="UTC")
+        path = self._path(key, "history")
+        if os.path.exists(path):
+            stored = pd.read_parquet(path, columns=[]).index
+            settled = pd.Timestamp.now(tz="UTC").normalize() - pd.Timedelta(days=self.settle_days)
+            requested = requested[~requested.isin(stored[stored <= settled])]
+        if requested.empty:
+            return None
+        return requested.min().strftime("%Y-%m-%d"), requested.max().strftime("%Y-%m-%d")
+
+    def put_history(self, key, frame):
+        path = self._path(key, "history")
+        frame = frame.set_index("date")
+        if os.path.exists(path):
+            frame = pd.concat([pd.read_parquet(path), frame])
+            frame = frame[~frame.index.duplicated(keep="last")]
+        frame.sort_index().to_parquet(path)
+        self._stored(key, "history")
+
+    def forecast(self, key, days):
+        entry = self._index.get(key, {})
+        path = self._path(key, "forecast")
+        fetched = entry.get("forecast_fetched", 0)
+        if (
+            not os.path.exists(path)
+            or time.time() - fetched > self.forecast_ttl
+            or entry.get("forecast_days", 0) < days
+        ):
+            return None
+        self._touch(key)
+        return pd.read_parquet(path)
+
+    def put_forecast(self, key, frame):
+        frame.to_parquet(self._path(key, "forecast"))
+        entry = self._entry(key)
+        entry["forecast_fetched"] = time.time()
+        entry["forecast_days"] = len(frame)
+        self._stored(key, "forecast")
+
+    @contextmanager
+    def batch(self):
+        self._batches += 1
+        try:
+            yield self
+        finally:
+            self._batches -= 1
+            if self._batches == 0:
+                self.flush()
+
+    def flush(self):
+        if self._dirty:
+            tmp_file = f"{self._index_file}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as file:
+                json.dump(self._index, file)
+            os.replace(tmp_file, self._index_file)
+            self._dirty = False
+        self._flushed = time.monotonic()
+
+    def _path(self, key, kind):
+        return os.path.join(self.root, f"{key}.{kind}.parquet")
+
+    def _size(self, key, kind):
+        path = self._path(key, kind)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _entry(self, key):
+        return self._index.setdefault(key, {"history_bytes": 0, "forecast_bytes": 0})
+
+    def _stored(self, key, kind):
+        """Updates the size of a written file, evicts if the archive got too large and saves the index."""
+        entry = self._entry(key)
+        size = self._size(key, kind)
+        self._total += size - entry[f"{kind}_bytes"]
+        entry[f"{kind}_bytes"] = size
+        entry["accessed"] = time.time()
+        self._evict()
+        self._changed(save=True)
+
+    def _touch(self, key):
+        self._entry(key)["accessed"] = time.time()
+        self._changed(save=False)
+
+    def _changed(self, save):
+        """Marks the index as changed and saves it unless within a batch, access times only every flush_interval."""
+        self._dirty = True
+        if self._batches == 0 and (save or time.monotonic() - self._flushed >= self.flush_interval):
+            self.flush()
+
+    def _evict(self):
+        """Deletes the least recently used locations until the archive fits into max_bytes."""
+        if self._total <= self.max_bytes:
+            return
+        for key in sorted(self._index, key=lambda k: self._index[k].get("accessed", 0)):
+            if self._total <= self.max_bytes:
+                break
+            for kind in ("history", "forecast"):
+                if os.path.exists(self._path(key, kind)):
+                    os.remove(self._path(key, kind))
+            entry = self._index.pop(key)
+            self._total -= entry["history_bytes"] + entry["forecast_bytes"]
+        self._dirty = True
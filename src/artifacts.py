@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from typing import Callable
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+ARTIFACTS_PATH = "data/processed/models"
+# Smaller artifacts are read into memory, mapping many small files would exhaust the file descriptors
+MMAP_MIN_BYTES = 1024**2
+
+
+def content_hash(*data) -> str:
+    """Hash of the content of DataFrames, Series and arrays, independent of their memory layout."""
+    digest = hashlib.sha256()
+    for item in data:
+        if isinstance(item, (pd.DataFrame, pd.Series)):
+            digest.update(pd.util.hash_pandas_object(item, index=False).to_numpy().tobytes())
+            labels = item.columns if isinstance(item, pd.DataFrame) else [item.name]
+            digest.update(json.dumps([str(label) for label in labels]).encode())
+        else:
+            array = np.ascontiguousarray(item)
+            digest.update(array.tobytes())
+            digest.update(str((array.dtype, array.shape)).encode())
+    return digest.hexdigest()
+
+
+class ArtifactStore:
+    """
+    Local store of fitted models, one joblib file per artifact.
+
+    An artifact is keyed by the model type, its hyperparameters and the content hash of its training slice,
+    so a model is only refitted if its inputs changed, also across restarts. Large artifacts are loaded
+    memory-mapped, the arrays of a model (e.g. the fleet coefficients or the nodes of its trees) are paged in from
+    the file on access instead of being copied. If the store grows beyond max_bytes, the least recently used
+    artifacts are deleted.
+
+    Methods:
+    -------
+    key(model_type, params, data_hash):
+        Returns the key of an artifact.
+    get(key):
+        Returns a stored artifact or None.
+    get_many(keys):
+        Returns the stored artifacts of the given keys.
+    put(key, artifact):
+        Stores an artifact.
+    put_many(artifacts):
+        Stores several artifacts.
+    get_or_fit(model_type, params, data_hash, fit):
+        Returns the stored artifact or fits, stores and returns it.
+    """
+
+    def __init__(self, root: str = ARTIFACTS_PATH, max_bytes: int = 1024**3):
+        """
+        :param root: str -- Directory of the store, created on the first put
+        :param max_bytes: int -- Size above which least recently used artifacts are deleted
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._index_file = os.path.join(root, "_index.json")
+        self._index = {}
+        if os.path.exists(self._index_file):
+            with open(self._index_file, "r", encoding="utf-8") as file:
+                self._index = json.load(file)
+
+    @staticmethod
+    def key(model_type: str, params: dict, data_hash: str) -> str:
+        params = json.dumps(params, sort_keys=True, default=str)
+        return f"{model_type}-{hashlib.sha256(f'{params}|{data_hash}'.encode()).hexdigest()[:32]}"
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: list) -> dict:
+        """Loads all stored artifacts of keys, the access times are written once."""
+        artifacts = {}
+        for key in keys:
+            path = self._path(key)
+            if not os.path.exists(path):
+                continue
+            try:
+                mmap_mode = "r" if os.path.getsize(path) >= MMAP_MIN_BYTES else None
+                artifacts[key] = joblib.load(path, mmap_mode=mmap_mode)
+            except Exception as e:
+                logger.warning(f"Could not load artifact '{key}', it is refitted: {e}")
+        self._touch(list(artifacts))
+        return artifacts
+
+    def put(self, key: str, artifact) -> None:
+        self.put_many({key: artifact})
+
+    def put_many(self, artifacts: dict) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        for key, artifact in artifacts.items():
+            tmp_path = f"{self._path(key)}.tmp"
+            joblib.dump(artifact, tmp_path)
+            os.replace(tmp_path, self._path(key))
+        self._touch(list(artifacts))
+        self._collect_garbage()
+
+    def get_or_fit(self, model_type: str, params: dict, data_hash: str, fit: Callable):
+        key = self.key(model_type, params, data_hash)
+        artifact = self.get(key)
+        if artifact is None:
+            artifact = fit()
+            self.put(key, artifact)
+        return artifact
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.joblib")
+
+    def _touch(self, keys: list) -> None:
+        if not keys:
+            return
+        with self._lock:
+            now = time.time()
+            for key in keys:
+                self._index[key] = now
+            self._save_index()
+
+    def _collect_garbage(self) -> None:
+        """Deletes the least recently used artifacts until the store fits into max_bytes."""
+        with self._lock:
+            sizes = {key: os.path.getsize(self._path(key)) for key in self._index if os.path.exists(self._path(key))}
+            total = sum(sizes.values())
+            for key in sorted(sizes, key=lambda k: self._index[k]):
+                if total <= self.max_bytes:
+                    break
+                os.remove(self._path(key))
+                total -= sizes[key]
+                del self._index[key]
+            self._index = {key: accessed for key, accessed in self._index.items() if key in sizes}
+            self._save_index()
+
+    def _save_index(self) -> None:
+        tmp_path = f"{self._index_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self._index, file)
+        os.replace(tmp_path, self._index_file)
@@ -0,0 +1,189 @@
+"""
+Rolling-origin backtests of the registered consumption models, run from root via
+"python3 -m src.backtest --models polyReg:degree=1 polyReg:degree=3 gbm --folds 8"
+
+Every fold cuts the readings of all tanks at an origin day, fits the model on the days up to the origin and
+compares its forecast with the actual consumption of the following days. Folds run in parallel on a process pool,
+the workers read the readings from shared memory instead of receiving a copy per fold.
+"""
+
+import argparse
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from src.forcasting import CLEANED_DATA_PATH, get_cleaned_data
+from src.models import get_model
+from src.utils.logger import setup_logger
+from src.utils.shared import array_spec, attach_arrays, share_array
+
+logger = setup_logger(__name__)
+
+HORIZONS = (1, 7, 14, 30)
+
+# Readings shared with the workers of a backtest
+_READINGS = {}
+
+
+def rolling_origins(dates: pd.Series, folds: int, step: int, horizon: int) -> list:
+    """
+    The newest origins step days apart, the last one leaves horizon days of actuals after it.
+
+    :return: list of pd.Timestamp, oldest first
+    """
+    last = pd.to_datetime(dates).max() - pd.Timedelta(days=horizon)
+    return sorted(last - pd.Timedelta(days=step * fold) for fold in range(folds))
+
+
+def parse_model(spec: str) -> tuple:
+    """Parses a model given as "name:key=value,key=value", e.g. "polyReg:degree=2", to (name, params)."""
+    name, _, params = spec.partition(":")
+    params = dict(param.split("=", 1) for param in params.split(",") if param)
+    return name, {key: yaml.safe_load(value) for key, value in params.items()}
+
+
+def backtest(
+    df: pd.DataFrame,
+    models: Iterable,
+    context: int = 90,
+    horizons: Iterable[int] = HORIZONS,
+    folds: int = 8,
+    step: int = 7,
+    origins: Optional[list] = None,
+    workers: Optional[int] = None,
+) -> tuple:
+    """
+    Evaluates consumption models with rolling-origin splits over all tanks.
+
+    :param df: pd.DataFrame -- Cleaned readings with the columns "Tank-ID", "Zeitstempel" and "Verbrauch"
+    :param models: Iterable -- Model names or (name, params) tuples, params default to the config, see get_model
+    :param context: int -- Number of days before the origin the models are fitted on
+    :param horizons: Iterable[int] -- Days after the origin that are scored
+    :param folds: int -- Number of origins, ignored if origins are given
+    :param step: int -- Days between two origins
+    :param origins: list -- Origin days, default rolling_origins
+    :param workers: int -- Number of processes, defaults to all cores
+    :return: summary: pd.DataFrame indexed by (model, horizon) with "MAE", "MAPE" (in percent, days without
+        consumption are left out) and the number of scored tank days "n";
+        folds: pd.DataFrame with the same metrics per (model, origin, horizon)
+    """
+    horizons = sorted(set(horizons))
+    models = [(model, {}) if isinstance(model, str) else tuple(model) for model in models]
+    if origins is None:
+        origins = rolling_origins(df["Zeitstempel"], folds, step, max(horizons))
+    tasks = [(name, params, pd.Timestamp(origin)) for name, params in models for origin in origins]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+
+    df = df.sort_values(["Tank-ID", "Zeitstempel"], kind="stable")
+    columns = {
+        "Tank-ID": df["Tank-ID"].to_numpy(dtype="int64"),
+        "Zeitstempel": pd.to_datetime(df["Zeitstempel"]).to_numpy(dtype="datetime64[ns]"),
+        "Verbrauch": df["Verbrauch"].to_numpy(dtype=float),
+    }
+    shared = {column: share_array(array) for column, array in columns.items()}
+    try:
+        specs = {column: array_spec(memory, array) for column, (memory, array) in shared.items()}
+        args = [(name, params, origin, context, horizons) for name, params, origin in tasks]
+        if workers == 1:
+            _attach(specs)
+            results = [_run_fold(*arg) for arg in args]
+        else:
+            with ProcessPoolExecutor(workers, initializer=_attach, initargs=(specs,)) as executor:
+                results = list(executor.map(_run_fold, *zip(*args)))
+    finally:
+        _detach()
+        for memory, _ in shared.values():
+            memory.close()
+            memory.unlink()
+
+    per_fold = pd.concat(results, ignore_index=True)
+    sums = per_fold.groupby(["model", "horizon"], sort=False)[["abs_error", "n", "ape", "n_ape"]].sum()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        summary = pd.DataFrame(
+            {"MAE": sums["abs_error"] / sums["n"], "MAPE": 100 * sums["ape"] / sums["n_ape"], "n": sums["n"]}
+        )
+        per_fold["MAE"] = per_fold["abs_error"] / per_fold["n"]
+        per_fold["MAPE"] = 100 * per_fold["ape"] / per_fold["n_ape"]
+    logger.info(f"Backtested {len(models)} model(s) on {len(origins)} origin(s) with {workers} process(es).")
+    return summary, per_fold[["model", "origin", "horizon", "MAE", "MAPE", "n"]]
+
+
+def _attach(specs: dict) -> None:
+    _READINGS["memories"], arrays = attach_arrays(list(specs.values()))
+    _READINGS["columns"] = dict(zip(specs, arrays))
+
+
+def _detach() -> None:
+    _READINGS.pop("columns", None)
+    for memory in _READINGS.pop("memories", []):
+        memory.close()
+
+
+def _run_fold(name: str, params: dict, origin: pd.Timestamp, context: int, horizons: list) -> pd.DataFrame:
+    """Fits one model on the readings up to origin and scores its forecast, returns the error sums per horizon."""
+    columns = _READINGS["columns"]
+    dates = columns["Zeitstempel"]
+    train = dates <= origin.to_datetime64()
+    df = pd.DataFrame({column: values[train] for column, values in columns.items()})
+
+    # Artifacts of past folds are of no use later on, the models are always refitted
+    model = get_model(name, **params)
+    model.store = None
+    _, forecast = model.fit_predict(df, context=context, forecast_days=max(horizons), workers=1)
+
+    test = ~train & (dates <= (origin + pd.Timedelta(days=max(horizons))).to_datetime64())
+    actuals = pd.DataFrame({column: values[test] for column, values in columns.items()})
+    scored = forecast.merge(actuals, on=["Tank-ID", "Zeitstempel"], suffixes=("_pred", ""))
+    scored["horizon"] = (pd.to_datetime(scored["Zeitstempel"]) - origin).dt.days
+    scored = scored[scored["horizon"].isin(horizons)]
+
+    error = (scored["Verbrauch_pred"] - scored["Verbrauch"]).abs()
+    consumed = scored["Verbrauch"] > 0
+    sums = (
+        pd.DataFrame(
+            {
+                "horizon": scored["horizon"],
+                "abs_error": error,
+                "n": 1,
+                "ape": (error / scored["Verbrauch"]).where(consumed, 0.0),
+                "n_ape": consumed.astype(int),
+            }
+        )
+        .groupby("horizon", as_index=False)
+        .sum()
+    )
+    label = name + "".join(f" {key}={value}" for key, value in sorted(params.items()))
+    sums.insert(0, "origin", origin)
+    sums.insert(0, "model", label)
+    return sums
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=["polyReg"], help='Models as "name:key=value,key=value"')
+    parser.add_argument("--path", default=CLEANED_DATA_PATH, help="Cleaned readings")
+    parser.add_argument("--context", default=90, type=int, help="Number of days the models are fitted on")
+    parser.add_argument("--horizons", nargs="+", default=list(HORIZONS), type=int, help="Scored days after the origin")
+    parser.add_argument("--folds", default=8, type=int, help="Number of origins")
+    parser.add_argument("--step", default=7, type=int, help="Days between two origins")
+    parser.add_argument("--workers", default=None, type=int, help="Number of processes, defaults to all cores")
+    parser.add_argument("--output", default=None, help="CSV file for the metrics per fold")
+    args = parser.parse_args()
+
+    summary, per_fold = backtest(
+        get_cleaned_data(args.path),
+        [parse_model(spec) for spec in args.models],
+        context=args.context,
+        horizons=args.horizons,
+        folds=args.folds,
+        step=args.step,
+        workers=args.workers,
+    )
+    print(summary.to_string(float_format="{:.3f}".format))
+    if args.output:
+        per_fold.to_csv(args.output, index=False)
@@ -0,0 +1,230 @@
+"""
+Headless batch run of the whole pipeline, run from root via "python3 main.py --horizon 30 --workers 8"
+
+Forecasts the consumption of every tank with the configured model, forecasts the price of every PLZ, plans the
+purchases and writes the results as parquet. Tanks are processed in chunks on a process pool, every finished chunk
+is a checkpoint: an interrupted run started again with the same settings on the same readings only processes the
+chunks that are missing.
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.forcasting import CLEANED_DATA_PATH, _normalize_plz, clean_readings, config, get_price_forecasts
+from src.models import get_model
+from src.recommendation import RESERVE, optimize_purchases
+from src.storage import load_readings, readings_version
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_BATCH_CONFIG = config.get("batch", {})
+
+BATCH_PATH = _BATCH_CONFIG.get("output", "data/processed/batch")
+# Number of tanks a worker processes at once, also the granularity of the checkpoints
+CHUNK_SIZE = _BATCH_CONFIG.get("chunkSize", 500)
+MANIFEST_FILE = "_manifest.json"
+
+
+def run_batch(
+    path: str = CLEANED_DATA_PATH,
+    output: str = BATCH_PATH,
+    tank_ids: Optional[Iterable[int]] = None,
+    horizon: int = 30,
+    context: int = 90,
+    workers: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    resume: bool = True,
+) -> dict:
+    """
+    Runs the pipeline for the given tanks and writes two parquet datasets to output:
+    "recommendations" with one row per tank (latest state, next delivery, plan cost and the date the level falls
+    below the Warnungsfüllstand) and "forecasts" with one row per tank and day (consumption, level and price).
+
+    :param path: str -- Processed pickle whose readings are used, see src.storage.load_readings
+    :param output: str -- Directory of the results and the checkpoint manifest
+    :param tank_ids: Iterable[int] -- Tanks to process, all tanks if None
+    :param horizon: int -- Number of forecast days
+    :param context: int -- Number of newest days the consumption model is fitted on
+    :param workers: int -- Number of processes, defaults to all cores
+    :param chunk_size: int -- Number of tanks per chunk
+    :param resume: bool -- Keep the finished chunks of an earlier run with the same settings
+    :return: dict -- The manifest of the run
+    """
+    # One scan for the tank list and the PLZs the prices are forecasted for
+    plz = _latest(load_readings(path, tank_ids=tank_ids, columns=["PLZ"]))["PLZ"]
+    tank_ids = plz.index.to_numpy(dtype="int64")
+    chunks = np.array_split(tank_ids, max(1, -(-len(tank_ids) // chunk_size)))
+
+    name = config["models"]["oilConsumption"]
+    run = {
+        "path": path,
+        "version": list(readings_version(path)),
+        "model": name,
+        "params": config["models"].get("params", {}).get(name, {}),
+        "horizon": horizon,
+        "context": context,
+        "chunk_size": chunk_size,
+        "tanks": hashlib.sha1(tank_ids.tobytes()).hexdigest(),
+        "n_tanks": len(tank_ids),
+        # Price forecasts change from day to day
+        "day": pd.Timestamp.now().strftime("%Y-%m-%d"),
+    }
+    # Round trip, so tuples and numpy scalars compare equal to the loaded manifest
+    run = json.loads(json.dumps(run))
+    manifest = _load_manifest(output)
+    if resume and manifest.get("run") == run:
+        done = set(manifest["done"])
+        logger.info(f"Resuming batch run, {len(done)} of {len(chunks)} chunk(s) already done.")
+    else:
+        _clear(output)
+        done = set()
+        manifest = {"run": run, "done": [], "complete": False}
+        _save_manifest(output, manifest)
+
+    pending = [index for index in range(len(chunks)) if index not in done]
+    if pending:
+        # Prices only depend on the PLZ, they are forecasted once here and shared by all chunks
+        pending_ids = np.concatenate([chunks[index] for index in pending])
+        prices = get_price_forecasts(_normalize_plz(plz.loc[pending_ids]).unique(), forecast_days=horizon)
+        args = [
+            (path, output, index, chunks[index], prices, name, run["params"], horizon, context) for index in pending
+        ]
+
+        workers = min(workers or os.cpu_count() or 1, len(pending))
+        if workers == 1:
+            results = (_run_chunk(*arg) for arg in args)
+            _collect(output, manifest, results, len(chunks))
+        else:
+            with ProcessPoolExecutor(workers) as executor:
+                futures = [executor.submit(_run_chunk, *arg) for arg in args]
+                _collect(output, manifest, (future.result() for future in as_completed(futures)), len(chunks))
+
+    manifest["complete"] = True
+    _save_manifest(output, manifest)
+    logger.info(f"Batch run of {len(tank_ids)} tank(s) written to '{output}'.")
+    return manifest
+
+
+def _collect(output: str, manifest: dict, results: Iterable[tuple], n_chunks: int) -> None:
+    """Checkpoints every chunk as soon as it is written."""
+    for index, n_tanks in results:
+        manifest["done"] = sorted(set(manifest["done"]) | {index})
+        _save_manifest(output, manifest)
+        logger.info(f"Chunk {index} with {n_tanks} tank(s) done ({len(manifest['done'])}/{n_chunks}).")
+
+
+def _latest(readings: pd.DataFrame) -> pd.DataFrame:
+    """Newest reading of every tank, indexed by Tank-ID."""
+    return readings.sort_values(["Tank-ID", "Zeitstempel"]).groupby("Tank-ID").tail(1).set_index("Tank-ID")
+
+
+def _run_chunk(
+    path: str,
+    output: str,
+    index: int,
+    tank_ids: np.ndarray,
+    prices: pd.DataFrame,
+    name: str,
+    params: dict,
+    horizon: int,
+    context: int,
+) -> tuple:
+    """Forecasts and plans the tanks of one chunk and writes its parts, returns (index, number of tanks)."""
+    # One read per chunk, most of the time of a chunk is spent opening its partitions
+    readings = load_readings(path, tank_ids=tank_ids)
+    clean_data = clean_readings(readings)
+    states = _latest(readings)
+    last_dates = pd.to_datetime(states["Zeitstempel"])
+
+    # Cleaning drops the newest days without a known consumption, the models forecast from the last clean day on.
+    # The horizon starts on the day after the last reading, the forecast days up to it are dropped.
+    last_clean = pd.to_datetime(clean_data.groupby("Tank-ID")["Zeitstempel"].max())
+    lag = (last_dates.reindex(last_clean.index) - last_clean).dt.days.max() if len(last_clean) else 0
+    # The artifact index is not shared between processes, the batch run is checkpointed by chunk instead
+    model = get_model(name, **params)
+    model.store = None
+    _, forecast = model.fit_predict(clean_data, context=context, forecast_days=horizon + max(int(lag), 0), workers=1)
+    forecast["day"] = (pd.to_datetime(forecast["Zeitstempel"]) - forecast["Tank-ID"].map(last_dates)).dt.days - 1
+    forecast = forecast[forecast["day"] >= 0]
+    consumption = forecast.pivot(index="Tank-ID", columns="day", values="Verbrauch")
+    consumption = consumption.reindex(columns=range(horizon)).clip(lower=0).fillna(0.0)
+    states = states.reindex(consumption.index)
+
+    levels = states["Füllstand"].to_numpy(dtype=float)
+    capacities = states["Maximale Füllgrenze"].to_numpy(dtype=float)
+    plz = _normalize_plz(states["PLZ"])
+    tank_prices = prices.reindex(plz).to_numpy(dtype=float)[:, :horizon]
+    plan = optimize_purchases(levels, capacities, consumption.to_numpy(), tank_prices)
+
+    # First forecast day the level without deliveries is at or below the Warnungsfüllstand
+    projected = levels[:, None] - np.cumsum(consumption.to_numpy(), axis=1)
+    below = projected <= (RESERVE * capacities)[:, None]
+    warning_day = np.where(below.any(axis=1), below.argmax(axis=1), np.nan)
+
+    start = (pd.to_datetime(states["Zeitstempel"]) + pd.Timedelta(days=1)).to_numpy()
+    recommendations = pd.DataFrame(
+        {
+            "Tank-ID": consumption.index.to_numpy(dtype="int64"),
+            "PLZ": plz.to_numpy(),
+            "last_date": pd.to_datetime(states["Zeitstempel"]).to_numpy(),
+            "Füllstand": levels,
+            "Maximale Füllgrenze": capacities,
+            "warning_date": start + pd.to_timedelta(warning_day, unit="D"),
+            "date": start + pd.to_timedelta(plan["day"], unit="D"),
+            "quantity": plan["quantity"],
+            "price": plan["price"],
+            "cost": plan["cost"],
+            "deliveries": plan["deliveries"],
+        }
+    )
+    forecasts = pd.DataFrame(
+        {
+            "Tank-ID": np.repeat(consumption.index.to_numpy(dtype="int64"), horizon),
+            "Zeitstempel": (start[:, None] + np.arange(horizon).astype("timedelta64[D]")).ravel(),
+            "Verbrauch": consumption.to_numpy().ravel(),
+            "Füllstand": projected.ravel(),
+            "Price": tank_prices.ravel(),
+        }
+    )
+    _write_part(output, "recommendations", index, recommendations)
+    _write_part(output, "forecasts", index, forecasts)
+    return index, len(recommendations)
+
+
+def _write_part(output: str, dataset: str, index: int, df: pd.DataFrame) -> None:
+    """Writes one part of a dataset, renamed into place so an interrupted write never leaves a partial part."""
+    directory = os.path.join(output, dataset)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"part-{index:05d}.parquet")
+    df.to_parquet(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def _clear(output: str) -> None:
+    for path in glob.glob(os.path.join(output, "*", "part-*.parquet*")):
+        os.remove(path)
+
+
+def _load_manifest(output: str) -> dict:
+    path = os.path.join(output, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _save_manifest(output: str, manifest: dict) -> None:
+    os.makedirs(output, exist_ok=True)
+    tmp_path = os.path.join(output, f"{MANIFEST_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(output, MANIFEST_FILE))
@@ -0,0 +1,265 @@
+from math import comb
+
+import numpy as np
+import pandas as pd
+
+from src.forcasting import (
+    CLEANED_DATA_PATH,
+    _FORECAST_CACHE,
+    _evaluate_polynomial,
+    _polynomial_projection,
+    _stack_context,
+    clean_readings,
+    data_version,
+)
+from src.storage import load_readings
+
+# Upper bound of the search, same horizon the Individual Dash page used to extrapolate
+MAX_DAYS = 10000
+# Number of bootstrap residuals drawn at once, bounds the memory of bootstrap_depletion_dates
+BOOTSTRAP_CHUNK = 2**22
+
+
+def _never_consumes_again(coefs: np.ndarray, days: np.ndarray, context: np.ndarray) -> np.ndarray:
+    """Whether the predicted consumption stays <= 0 for every day from ``days`` on.
+
+    If all Taylor coefficients of the polynomial at x are <= 0, then p(x + h) <= 0 for every h >= 0, i.e. the
+    predicted level never decreases again and the tank can be retired from the search.
+    """
+    x = (days / np.maximum(np.asarray(context, dtype=float) - 1, 1))[:, None]
+    degree = coefs.shape[1] - 1
+    never = np.ones(len(coefs), dtype=bool)
+    for k in range(degree + 1):
+        taylor = sum(comb(j, k) * coefs[:, j : j + 1] * x ** (j - k) for j in range(k, degree + 1))
+        never &= taylor[:, 0] <= 0
+    return never
+
+
+def depletion_days(
+    coefs: np.ndarray, context: np.ndarray, levels: np.ndarray, thresholds: np.ndarray, max_days: int = MAX_DAYS
+) -> np.ndarray:
+    """Finds the first forecast day on which the predicted level of each tank falls below its threshold.
+
+    The predicted level on day k is ``level - sum(consumption[0..k])`` with the consumption taken from the
+    fitted polynomial, starting at the last day of the context window (same convention as fit_linear_model).
+    The search runs over all tanks at once in blocks of growing size. Tanks are retired as soon as they cross
+    or as soon as the polynomial shows they never consume again, so most tanks cost a handful of evaluations.
+
+    :param coefs: array (n_tanks, degree + 1) -- Polynomial coefficients as returned by fit_linear_models
+    :param context: array (n_tanks,) -- Length of the context window of each fit
+    :param levels: array (n_tanks,) -- Current level in liters
+    :param thresholds: array (n_tanks,) -- Level in liters that counts as depleted
+    :param max_days: int -- Number of forecast days to search
+    :return: array (n_tanks,) -- Day offset of the first crossing, NaN if the tank is not depleted within max_days
+    """
+    coefs = np.asarray(coefs, dtype=float)
+    context = np.asarray(context)
+    remaining = np.asarray(levels, dtype=float) - np.asarray(thresholds, dtype=float)
+    if coefs.shape[1] <= 2:
+        return _linear_depletion_days(coefs, context, remaining, max_days)
+
+    result = np.full(len(coefs), np.nan)
+    active = np.arange(len(coefs))
+    consumed = np.zeros(len(coefs))
+
+    start, block = 0, 64
+    while len(active) and start < max_days:
+        stop = min(start + block, max_days)
+        days = np.arange(start, stop)
+        consumption = _evaluate_polynomial(coefs[active], context[active, None] - 1 + days, context[active])
+        cumulative = consumed[active, None] + np.cumsum(consumption, axis=1)
+        crossed = remaining[active, None] - cumulative < 0
+
+        hit = crossed.any(axis=1)
+        result[active[hit]] = start + crossed[hit].argmax(axis=1)
+        consumed[active] = cumulative[:, -1]
+        active = active[~hit]
+        active = active[~_never_consumes_again(coefs[active], context[active] - 1 + stop, context[active])]
+
+        start, block = stop, block * 2
+
+    return result
+
+
+def _linear_depletion_days(coefs: np.ndarray, context: np.ndarray, remaining: np.ndarray, max_days: int) -> np.ndarray:
+    """Closed form of depletion_days for constant and linear consumption.
+
+    With the daily consumption a + b * k on forecast day k, the consumption up to day K is the quadratic
+    q(K) = b / 2 * K^2 + (a + b / 2) * K + a, and the tank is depleted on the first integer K with q(K) > remaining.
+    """
+    scale = np.maximum(context - 1, 1).astype(float)
+    slope = coefs[:, 1] / scale if coefs.shape[1] == 2 else np.zeros(len(coefs))
+    intercept = coefs[:, 0] + slope * (context - 1)
+
+    def crossed(K):
+        return slope / 2 * K**2 + (intercept + slope / 2) * K + intercept - remaining > 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        A, B, C = slope / 2, intercept + slope / 2, intercept - remaining
+        root = np.sqrt(B**2 - 4 * A * C)
+        # Upper root if convex (A > 0), q rises above 0 after it; lower root if concave, q is positive between the roots
+        quadratic = (-B + root) / (2 * A)
+        linear = np.where(B > 0, -C / B, np.inf)
+        first = np.where(A == 0, linear, quadratic)
+    first = np.where(np.isfinite(first) & (first >= 0), np.floor(first) + 1, np.inf)
+    first = np.where(crossed(0), 0, first)
+
+    # Snap to the exact integer in case of rounding at the root
+    days = np.where(np.isfinite(first), first, 0)
+    earlier = np.isfinite(first) & (days > 0) & crossed(days - 1)
+    days = np.where(earlier, days - 1, days)
+    later = np.isfinite(first) & ~crossed(days)
+    days = np.where(later, days + 1, days)
+    valid = np.isfinite(first) & crossed(days) & (days < max_days)
+    return np.where(valid, days, np.nan)
+
+
+def get_depletion_dates(
+    coefs: pd.DataFrame, levels: pd.Series, thresholds: pd.Series, max_days: int = MAX_DAYS
+) -> pd.DataFrame:
+    """Depletion dates for every tank of a fit_linear_models result.
+
+    :param coefs: pd.DataFrame -- First return value of fit_linear_models, indexed by Tank-ID
+    :param levels: pd.Series -- Current level per Tank-ID
+    :param thresholds: pd.Series -- Threshold per Tank-ID, e.g. the Warnungsfüllstand or 0 for "empty"
+    :param max_days: int -- Number of forecast days to search
+    :return: pd.DataFrame indexed by Tank-ID with the day offset "days" and the "date" of the first crossing,
+        both missing (NaN/NaT) if the tank never depletes within max_days
+    """
+    coef_columns = [c for c in coefs.columns if c.startswith("coef_")]
+    days = depletion_days(
+        coefs[coef_columns].to_numpy(),
+        coefs["n"].to_numpy(),
+        levels.reindex(coefs.index).to_numpy(),
+        thresholds.reindex(coefs.index).to_numpy(),
+        max_days=max_days,
+    )
+    dates = pd.to_datetime(coefs["last_date"]) + pd.to_timedelta(days, unit="D")
+    return pd.DataFrame({"days": days, "date": dates}, index=coefs.index)
+
+
+def bootstrap_depletion_dates(
+    df: pd.DataFrame,
+    levels: pd.Series,
+    thresholds: pd.Series,
+    context: int = 90,
+    degree: int = 1,
+    n_boot: int = 1000,
+    quantiles=(0.1, 0.5, 0.9),
+    seed: int = 0,
+    max_days: int = MAX_DAYS,
+) -> pd.DataFrame:
+    """Prediction intervals of the depletion dates from a residual bootstrap of the fit_linear_models fit.
+
+    Every replicate refits the polynomial on the fitted values plus resampled residuals of its tank. The fit is
+    linear in y, so a replicate only costs the projection of its residuals, ``beta* = beta + P e*``, computed for
+    many tanks and replicates at once as one batched matrix product. All replicates then go through the same
+    depletion search as the point forecast. The intervals cover the uncertainty of the fitted trend, not the noise
+    of single days.
+
+    :param df: pd.DataFrame -- Cleaned readings with the columns "Tank-ID", "Zeitstempel" and "Verbrauch"
+    :param levels: pd.Series -- Current level per Tank-ID
+    :param thresholds: pd.Series -- Threshold per Tank-ID, e.g. the Warnungsfüllstand or 0 for "empty"
+    :param context: int -- Number of newest days per tank used for fitting
+    :param degree: int -- Degree of the polynomial
+    :param n_boot: int -- Number of bootstrap replicates per tank
+    :param quantiles: Iterable[float] -- Quantiles of the depletion day
+    :param seed: int -- Seed of the resampling
+    :param max_days: int -- Number of forecast days to search
+    :return: pd.DataFrame indexed by Tank-ID with the columns "days_P10" ... and "date_P10" ... per quantile,
+        missing (NaN/NaT) if the tank does not deplete within max_days at that quantile
+    """
+    rng = np.random.default_rng(seed)
+    tank_ids, last_dates, windows = _stack_context(df, context)
+    remaining = levels.reindex(tank_ids).to_numpy(dtype=float) - thresholds.reindex(tank_ids).to_numpy(dtype=float)
+    result = np.full((len(tank_ids), len(quantiles)), np.nan)
+
+    for length, (positions, y) in windows.items():
+        X_poly, projection = _polynomial_projection(length, degree)
+        beta = y @ projection.T
+        residuals = y - beta @ X_poly.T
+        # Residuals underestimate the noise by the degrees of freedom spent on the fit
+        residuals *= np.sqrt(length / max(length - degree - 1, 1))
+        weights = _bootstrap_weights(projection, n_boot, rng)
+
+        chunk = max(1, BOOTSTRAP_CHUNK // (n_boot * (degree + 1)))
+        for start in range(0, len(positions), chunk):
+            rows = slice(start, start + chunk)
+            tanks = positions[rows]
+            # P e* of every replicate and tank at once: (tanks, length) @ (length, n_boot * (degree + 1))
+            shifts = (residuals[rows] @ weights).reshape(len(tanks), n_boot, degree + 1)
+            beta_star = (beta[rows, None, :] + shifts).reshape(-1, degree + 1)
+
+            days = depletion_days(
+                beta_star,
+                np.full(len(beta_star), length),
+                np.repeat(remaining[tanks], n_boot),
+                np.zeros(len(beta_star)),
+                max_days=max_days,
+            ).reshape(len(tanks), n_boot)
+            # Replicates that never deplete are later than every date, the quantiles are actual replicates
+            days = np.where(np.isnan(days), np.inf, days)
+            quantile_days = np.quantile(days, quantiles, axis=1, method="inverted_cdf").T
+            result[tanks] = np.where(np.isinf(quantile_days), np.nan, quantile_days)
+
+    intervals = pd.DataFrame(index=pd.Index(tank_ids, name="Tank-ID"))
+    for position, quantile in enumerate(quantiles):
+        intervals[f"days_P{round(quantile * 100)}"] = result[:, position]
+    for position, quantile in enumerate(quantiles):
+        intervals[f"date_P{round(quantile * 100)}"] = pd.to_datetime(last_dates) + pd.to_timedelta(
+            result[:, position], unit="D"
+        )
+    return intervals
+
+
+def get_depletion_intervals(
+    tank_id: int, reserve: float = 0.0, context: int = 90, degree: int = 3, path: str = CLEANED_DATA_PATH
+) -> pd.Series:
+    """Memoized bootstrap_depletion_dates of a single tank at its newest level.
+
+    Results are kept in the forecast LRU cache keyed by (tank, context, degree, reserve, data version), the same
+    cache and version as get_forecast, so a page render only bootstraps once per tank and setting.
+
+    :param reserve: float -- Share of the Maximale Füllgrenze that counts as depleted, 0 for "empty"
+    :return: pd.Series -- Row of bootstrap_depletion_dates
+    """
+    version = data_version(path)
+    key = ("bootstrap", tank_id, context, degree, reserve, version)
+
+    def _bootstrap():
+        readings = load_readings(path, tank_ids=[tank_id])
+        latest = readings.sort_values("Zeitstempel").tail(1).set_index("Tank-ID")
+        return bootstrap_depletion_dates(
+            clean_readings(readings),
+            latest["Füllstand"],
+            reserve * latest["Maximale Füllgrenze"],
+            context=context,
+            degree=degree,
+        ).loc[tank_id]
+
+    return _FORECAST_CACHE.get_or_compute(key, _bootstrap).copy()
+
+
+def _bootstrap_weights(projection: np.ndarray, n_boot: int, rng: np.random.Generator) -> np.ndarray:
+    """Resampling of n_boot replicates as a matrix, ``residuals @ weights`` gives P e* of every replicate.
+
+    Replicate b draws residual m for position i, so P e* = sum_i P[:, i] r[draw[b, i]] = r @ W[b] with W[b, m] the
+    sum of the columns of P at the positions that drew m. The draws are shared by all tanks of a window length,
+    every tank still gets n_boot independent replicates of its own residuals.
+
+    :return: array (length, n_boot * (degree + 1))
+    """
+    n_coefs, length = projection.shape
+    draws = rng.integers(0, length, (n_boot, length))
+    flat = (np.arange(n_boot)[:, None] * length + draws).ravel()
+    weights = np.empty((n_boot, length, n_coefs))
+    for k in range(n_coefs):
+        weights[:, :, k] = np.bincount(flat, weights=np.tile(projection[k], n_boot), minlength=n_boot * length).reshape(
+            n_boot, length
+        )
+    return weights.transpose(1, 0, 2).reshape(length, n_boot * n_coefs)
+
+
+def format_depletion_date(date) -> str:
+    """Formats a depletion date for display, "never" if the tank does not deplete."""
+    return "never" if pd.isna(date) else pd.Timestamp(date).strftime("%Y-%m-%d")
@@ -0,0 +1,374 @@
+"""
+Aligned tank x day features shared by the models and pages, refreshed from root via
+"python3 -m src.feature_store"
+"""
+
+import argparse
+import json
+import os
+
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+FEATURES_PATH = "data/processed/features"
+# The outdoor temperature is not the "Temperatur" column of the readings, which is measured at the tank
+FEATURES = ["Füllstand", "Verbrauch", "Price", "Außentemperatur", "HDD", "Außentemperatur 15d"]
+# Names of features in stores saved before the rename
+_RENAMED_FEATURES = {"Temperatur": "Außentemperatur", "Temperatur 15d": "Außentemperatur 15d"}
+TANK_COLUMNS = ["PLZ", "Breitengrad", "Längengrad", "Maximale Füllgrenze"]
+# Heating threshold of the heating degree days, days with a mean temperature above it need no heating
+HDD_BASE = 15.0
+# Days of the trailing mean temperature
+TEMPERATURE_WINDOW = 15
+
+VALUES_FILE = "values.npy"
+TANKS_FILE = "tanks.pickle"
+META_FILE = "meta.json"
+
+
+class FeatureStore:
+    """
+    Features of every tank and day in one float32 array of shape (n_tanks, n_days, n_features): the readings, the
+    oil price of the tank's PLZ and the weather at the tank with the derived heating degree days (HDD) and the
+    trailing 15-day mean temperature. Missing values are NaN. The store remembers the version of the readings it was
+    last refreshed from, see is_current.
+
+    Readings, prices and weather are written into their cells as they arrive, derived features are recomputed for
+    the touched tanks only. Features are served as slices of the array (views, no copies), so models and pages read
+    the same precomputed values instead of joining readings, prices and weather on every call. The array is stored
+    as .npy and memory-mapped on load.
+
+    Methods:
+    -------
+    update_readings(df):
+        Writes daily readings, new tanks and days are added.
+    update_prices(prices):
+        Writes the prices per PLZ and day, days without a quote keep the last quote.
+    update_weather(weather):
+        Writes the daily mean temperature per tank and recomputes the derived weather features.
+    matrix(features=None, tank_ids=None, start=None, end=None):
+        Returns the (tanks, days, features) block, a view for contiguous tanks and features.
+    feature(name):
+        Returns the (tanks, days) array of one feature as a view.
+    frame(features=None, tank_ids=None, start=None, end=None):
+        Returns the block in long format, one row per tank and day.
+    refresh(path, weather_days=15):
+        Brings the store up to date with the readings, the price API and the weather API.
+    is_current(path):
+        Whether the store was refreshed from the current readings.
+    load(path) / save(path):
+        Reads (memory-mapped) / writes the store.
+    """
+
+    def __init__(self, features: Iterable[str] = FEATURES):
+        self.features = list(features)
+        self.tanks = pd.DataFrame(columns=TANK_COLUMNS, index=pd.Index([], name="Tank-ID"))
+        self.start = None
+        self._n_days = 0
+        self._values = np.full((0, 0, len(self.features)), np.nan, dtype=np.float32)
+        # Price per PLZ and day, broadcast to the tanks of the PLZ
+        self._prices = pd.DataFrame(dtype=np.float32)
+        # Fingerprint of the readings of the last refresh, see src.storage.readings_version
+        self.readings_version = None
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        if self.start is None:
+            return pd.DatetimeIndex([])
+        return pd.date_range(self.start, periods=self._n_days, freq="D")
+
+    @property
+    def values(self) -> np.ndarray:
+        """All features, a view without the spare capacity of the array."""
+        return self._values[: len(self.tanks), : self._n_days]
+
+    @property
+    def watermark(self) -> Optional[pd.Timestamp]:
+        """Oldest last reading over all tanks, readings from this day on bring the store up to date."""
+        levels = self.feature("Füllstand")
+        if not levels.size:
+            return None
+        has_reading = ~np.isnan(levels)
+        last = np.where(has_reading.any(axis=1), levels.shape[1] - 1 - np.argmax(has_reading[:, ::-1], axis=1), 0)
+        return self.start + pd.Timedelta(days=int(last.min()))
+
+    @classmethod
+    def load(cls, path: str = FEATURES_PATH, mmap_mode: Optional[str] = "r") -> "FeatureStore":
+        """Loads a stored feature store, an empty one if nothing is stored. Updates copy a memory-mapped array."""
+        store = cls()
+        if not os.path.exists(os.path.join(path, META_FILE)):
+            return store
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        store.features = [_RENAMED_FEATURES.get(name, name) for name in meta["features"]]
+        store.start = pd.Timestamp(meta["start"]) if meta["start"] else None
+        store.readings_version = meta.get("readings_version")
+        store._values = np.load(os.path.join(path, VALUES_FILE), mmap_mode=mmap_mode)
+        store._n_days = store._values.shape[1]
+        store.tanks, store._prices = pd.read_pickle(os.path.join(path, TANKS_FILE))
+        return store
+
+    def save(self, path: str = FEATURES_PATH) -> None:
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, f"{VALUES_FILE}.tmp.npy"), self.values)
+        os.replace(os.path.join(path, f"{VALUES_FILE}.tmp.npy"), os.path.join(path, VALUES_FILE))
+        pd.to_pickle((self.tanks, self._prices), os.path.join(path, TANKS_FILE))
+        meta = {
+            "features": self.features,
+            "start": None if self.start is None else str(self.start.date()),
+            "readings_version": self.readings_version,
+        }
+        with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as file:
+            json.dump(meta, file, ensure_ascii=False, indent=2)
+
+    def update_readings(self, df: pd.DataFrame) -> "FeatureStore":
+        """
+        :param df: pd.DataFrame -- Daily readings with the columns "Tank-ID", "Zeitstempel", "Füllstand",
+            "Verbrauch" and optionally the tank columns "PLZ", "Breitengrad", "Längengrad", "Maximale Füllgrenze"
+        """
+        if df.empty:
+            return self
+        dates = pd.to_datetime(df["Zeitstempel"]).dt.normalize()
+        self._ensure_days(dates.min(), dates.max())
+
+        latest = df.assign(Zeitstempel=dates).sort_values("Zeitstempel").groupby("Tank-ID").tail(1)
+        latest = latest.set_index("Tank-ID").reindex(columns=TANK_COLUMNS)
+        if "PLZ" in df:
+            latest["PLZ"] = latest["PLZ"].astype(str).str.replace(".0", "", regex=False)
+        self._ensure_tanks(latest)
+
+        tanks = self.tanks.index.get_indexer(df["Tank-ID"])
+        days = self._day_index(dates)
+        for name in ["Füllstand", "Verbrauch"]:
+            if name in df:
+                self._values[tanks, days, self.features.index(name)] = df[name].to_numpy(dtype=np.float32)
+
+        # Prices of the new days or tanks are known already if their PLZ was fetched before
+        if not self._prices.empty:
+            self._broadcast_prices(np.unique(tanks))
+        return self
+
+    def update_prices(self, prices: pd.DataFrame) -> "FeatureStore":
+        """
+        :param prices: pd.DataFrame -- Columns "PLZ", "Price" and the day as "Date" or "Zeitstempel", as returned by
+            OilPriceAPI.get_heizoel_bulk
+        """
+        if prices.empty:
+            return self
+        prices = prices.rename(columns={"Date": "Zeitstempel"})
+        prices = prices.assign(
+            PLZ=prices["PLZ"].astype(str).str.replace(".0", "", regex=False),
+            Zeitstempel=pd.to_datetime(prices["Zeitstempel"]).dt.tz_localize(None).dt.normalize(),
+        )
+        table = prices.pivot_table(index="Zeitstempel", columns="PLZ", values="Price", aggfunc="last")
+        self._prices = (table.combine_first(self._prices) if not self._prices.empty else table).astype(np.float32)
+
+        tanks = np.flatnonzero(self.tanks["PLZ"].isin(table.columns).to_numpy())
+        self._broadcast_prices(tanks)
+        return self
+
+    def update_weather(self, weather: pd.DataFrame) -> "FeatureStore":
+        """
+        :param weather: pd.DataFrame -- Columns "Tank-ID", "date" and "temperature_2m_mean", e.g. the frame of
+            WeatherAPI.get_data_bulk with its "location" mapped to the Tank-ID
+        """
+        if weather.empty:
+            return self
+        dates = pd.to_datetime(weather["date"]).dt.tz_localize(None).dt.normalize()
+        self._ensure_days(dates.min(), dates.max())
+        weather = weather[weather["Tank-ID"].isin(self.tanks.index)]
+        dates = dates[weather.index]
+
+        tanks = self.tanks.index.get_indexer(weather["Tank-ID"])
+        temperature = self.features.index("Außentemperatur")
+        self._values[tanks, self._day_index(dates), temperature] = weather["temperature_2m_mean"].to_numpy(np.float32)
+        self._derive_weather(np.unique(tanks))
+        return self
+
+    def feature(self, name: str) -> np.ndarray:
+        """(tanks, days) array of one feature, a view into the store."""
+        return self.values[:, :, self.features.index(name)]
+
+    def matrix(
+        self,
+        features: Optional[Iterable[str]] = None,
+        tank_ids: Optional[Iterable] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ) -> np.ndarray:
+        """
+        Model-ready (tanks, days, features) block. Day ranges are always views, tanks and features are views as
+        long as they are contiguous in the store (e.g. all tanks, or features in store order without gaps).
+
+        :param features: Iterable[str] -- Feature names, all by default
+        :param tank_ids: Iterable -- Tank-IDs, all by default. Raises a KeyError for tanks that are not in the store.
+        :param start, end: str -- First and last day (inclusive), all days by default
+        """
+        block = self.values[:, self._days(start, end)]
+        if tank_ids is not None:
+            tank_ids = list(tank_ids)
+            positions = self.tanks.index.get_indexer(tank_ids)
+            if (positions < 0).any():
+                unknown = [tank_id for tank_id, position in zip(tank_ids, positions) if position < 0]
+                raise KeyError(f"Tank-ID(s) {unknown} are not in the feature store")
+            block = block[_as_slice(positions)]
+        if features is not None:
+            block = block[:, :, _as_slice([self.features.index(name) for name in features])]
+        return block
+
+    def frame(
+        self,
+        features: Optional[Iterable[str]] = None,
+        tank_ids: Optional[Iterable] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """matrix in long format with the columns "Tank-ID", "Zeitstempel", the tank columns and the features."""
+        features = list(features or self.features)
+        tank_ids = self.tanks.index if tank_ids is None else pd.Index(list(tank_ids))
+        block = self.matrix(features, tank_ids, start, end)
+        dates = self.dates[self._days(start, end)]
+
+        df = pd.DataFrame(block.reshape(-1, len(features)), columns=features)
+        df.insert(0, "Zeitstempel", np.tile(dates.to_numpy(), len(tank_ids)))
+        df.insert(0, "Tank-ID", np.repeat(tank_ids.to_numpy(), len(dates)))
+        tank_columns = self.tanks.loc[tank_ids].reset_index(drop=True)
+        for column in TANK_COLUMNS:
+            df[column] = np.repeat(tank_columns[column].to_numpy(), len(dates))
+        return df
+
+    def refresh(self, path: str, weather_days: int = 15, transport=None) -> "FeatureStore":
+        """
+        Adds the readings from the watermark on, fetches the prices of all PLZs for the days of the store and the
+        weather of all tanks from the store's first day to weather_days days ahead. Both APIs only request what
+        their local stores are missing.
+
+        :param path: str -- Readings, see src.storage.load_readings
+        :param weather_days: int -- Days of weather forecast after today
+        :param transport: requests adapter of both APIs, e.g. StandInServer.adapter(), HTTPS if None
+        """
+        from src.api import OilPriceAPI, PriceHistoryStore, WeatherAPI, WeatherArchive
+        from src.storage import load_readings, readings_version
+
+        watermark = self.watermark
+        # Taken before reading, readings written meanwhile make the store stale instead of being missed
+        version = list(readings_version(path))
+        readings = load_readings(path, start=watermark)
+        self.update_readings(readings)
+        logger.info(f"Added {len(readings)} readings from {watermark} on.")
+
+        start_date = self.start.strftime("%Y-%m-%d")
+        end_date = (datetime.now() + timedelta(days=weather_days)).strftime("%Y-%m-%d")
+        if self._prices.empty:
+            price_start = start_date
+        else:
+            price_start = self._prices.index.max().strftime("%Y-%m-%d")
+        prices = OilPriceAPI(store=PriceHistoryStore(), transport=transport).get_heizoel_bulk(
+            self.tanks["PLZ"].dropna().unique(), price_start
+        )
+        self.update_prices(prices)
+
+        weather = WeatherAPI(archive=WeatherArchive(), transport=transport).get_data_bulk(
+            self.tanks["Breitengrad"], self.tanks["Längengrad"], start_date, end_date
+        )
+        weather["Tank-ID"] = self.tanks.index.to_numpy()[weather["location"].to_numpy()]
+        self.update_weather(weather)
+        self.readings_version = version
+        return self
+
+    def is_current(self, path: str) -> bool:
+        """Whether the store was refreshed from the readings behind path as they are now."""
+        from src.storage import readings_version
+
+        return self.readings_version is not None and self.readings_version == list(readings_version(path))
+
+    def _ensure_days(self, first: pd.Timestamp, last: pd.Timestamp) -> None:
+        """Extends the day axis to cover first ... last, growing the capacity geometrically to the future."""
+        if self.start is None:
+            self.start = first
+        offset = max((self.start - first).days, 0)
+        n_days = max(self._n_days + offset, (last - self.start).days + 1 + offset)
+        if offset or n_days > self._values.shape[1] or not self._values.flags.writeable:
+            capacity = max(n_days, int(self._values.shape[1] * 1.5) if not offset else n_days)
+            self._resize(self._values.shape[0], capacity, day_offset=offset)
+            self.start = self.start - pd.Timedelta(days=offset)
+        self._n_days = n_days
+
+    def _ensure_tanks(self, tanks: pd.DataFrame) -> None:
+        """Adds unknown tanks and updates the tank columns of known ones."""
+        unknown = tanks.index.difference(self.tanks.index)
+        if len(unknown):
+            if len(self.tanks):
+                self.tanks = pd.concat([self.tanks, tanks.loc[unknown]])
+            else:
+                self.tanks = tanks.loc[unknown].copy()
+            self.tanks.index.name = "Tank-ID"
+            if len(self.tanks) > self._values.shape[0] or not self._values.flags.writeable:
+                self._resize(max(len(self.tanks), int(self._values.shape[0] * 1.5)), self._values.shape[1])
+        known = tanks.index.intersection(self.tanks.index)
+        self.tanks.loc[known] = tanks.loc[known].combine_first(self.tanks.loc[known])
+
+    def _resize(self, tank_capacity: int, day_capacity: int, day_offset: int = 0) -> None:
+        values = np.full((tank_capacity, day_capacity, len(self.features)), np.nan, dtype=np.float32)
+        n_tanks, n_days = len(self.tanks), self._n_days
+        old = self._values[: min(n_tanks, self._values.shape[0]), :n_days]
+        values[: old.shape[0], day_offset : day_offset + n_days] = old
+        self._values = values
+
+    def _days(self, start: Optional[str], end: Optional[str]) -> slice:
+        first, last = self._day_index(pd.to_datetime([start or self.start, end or self.dates[-1]]))
+        return slice(max(int(first), 0), int(last) + 1)
+
+    def _day_index(self, dates) -> np.ndarray:
+        return ((pd.DatetimeIndex(dates) - self.start) // pd.Timedelta(days=1)).to_numpy()
+
+    def _broadcast_prices(self, tanks: np.ndarray) -> None:
+        """Writes the PLZ prices into the price feature of the given tanks, forward-filled over days without quotes."""
+        if not len(tanks) or self._prices.empty:
+            return
+        table = self._prices.reindex(self.dates.union(self._prices.index)).ffill().reindex(self.dates)
+        plz = self.tanks["PLZ"].to_numpy()[tanks]
+        columns = table.columns.get_indexer(plz)
+        known = columns >= 0
+        prices = table.to_numpy(dtype=np.float32).T
+        self._values[tanks[known], : self._n_days, self.features.index("Price")] = prices[columns[known]]
+
+    def _derive_weather(self, tanks: np.ndarray) -> None:
+        """Heating degree days and the trailing mean temperature of the given tanks, vectorized over days."""
+        temperature = self._values[tanks, : self._n_days, self.features.index("Außentemperatur")]
+        self._values[tanks, : self._n_days, self.features.index("HDD")] = np.maximum(HDD_BASE - temperature, 0)
+
+        known = ~np.isnan(temperature)
+        sums = np.cumsum(np.where(known, temperature, 0), axis=1, dtype=np.float64)
+        counts = np.cumsum(known, axis=1)
+        shifted_sums = np.pad(sums, ((0, 0), (TEMPERATURE_WINDOW, 0)))[:, : self._n_days]
+        shifted_counts = np.pad(counts, ((0, 0), (TEMPERATURE_WINDOW, 0)))[:, : self._n_days]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = (sums - shifted_sums) / (counts - shifted_counts)
+        self._values[tanks, : self._n_days, self.features.index("Außentemperatur 15d")] = np.where(known, mean, np.nan)
+
+
+def _as_slice(positions: list):
+    """Positions as a slice if they are contiguous and ascending, so indexing returns a view."""
+    positions = np.asarray(positions)
+    if len(positions) and (positions >= 0).all() and (np.diff(positions) == 1).all():
+        return slice(int(positions[0]), int(positions[-1]) + 1)
+    return positions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readings", default="data/processed/data_one_day_clean.pickle", help="Readings to add")
+    parser.add_argument("--path", default=FEATURES_PATH, help="Directory of the feature store")
+    args = parser.parse_args()
+
+    store = FeatureStore.load(args.path, mmap_mode=None)
+    store.refresh(args.readings)
+    store.save(args.path)
@@ -0,0 +1,151 @@
+import os
+
+from typing import Iterable, Optional
+
+import pandas as pd
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+STATE_COLUMNS = [
+    "Tank-ID",
+    "Füllstand",
+    "Prozentualer Füllstand",
+    "Maximale Füllgrenze",
+    "PLZ",
+    "Oil Price",
+    "Avg. Temperatur (+15 Tage)",
+    "Längengrad",
+    "Breitengrad",
+]
+
+
+class FleetState:
+    """
+    Materialized latest state of every tank: the newest ("today") and second newest ("yesterday") daily reading,
+    joined with the oil price of the tank's PLZ on that day and the tank's mean temperature forecast.
+
+    Updates only touch the tanks, PLZs and days that arrive, so the cost of keeping the dashboard KPIs current
+    does not grow with the length of the history.
+    """
+
+    def __init__(self, rows: Optional[pd.DataFrame] = None):
+        """
+        :param rows: pd.DataFrame -- At most two rows per tank, see update_readings
+        """
+        if rows is None:
+            rows = pd.DataFrame(columns=["Zeitstempel"] + STATE_COLUMNS)
+        self._rows = rows.reset_index(drop=True)
+
+    @property
+    def watermark(self) -> Optional[pd.Timestamp]:
+        """
+        Newest day applied to the state, None if the state is empty. Readings from this day on are all that is needed
+        to bring the state up to date. Tanks without new readings keep their rows and do not hold the watermark back,
+        so a tank that stopped reporting does not make every update reload its history.
+        """
+        if self._rows.empty:
+            return None
+        return pd.to_datetime(self._rows["Zeitstempel"]).max()
+
+    @property
+    def dates(self) -> tuple:
+        """(first, last) day of the readings in the state."""
+        dates = pd.to_datetime(self._rows["Zeitstempel"])
+        return dates.min(), dates.max()
+
+    @classmethod
+    def load(cls, path: str) -> "FleetState":
+        return cls(pd.read_pickle(path)) if os.path.exists(path) else cls()
+
+    def copy(self) -> "FleetState":
+        return FleetState(self._rows.copy())
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._rows.to_pickle(path)
+
+    def update_readings(self, readings: pd.DataFrame) -> None:
+        """
+        Merges new daily readings (one row per tank and day) into the state. Readings of a day that is already
+        in the state replace it, so re-applying overlapping data is harmless.
+        """
+        if readings.empty:
+            return
+        readings = readings.copy()
+        readings["Zeitstempel"] = pd.to_datetime(readings["Zeitstempel"])
+        touched = self._rows["Tank-ID"].isin(readings["Tank-ID"].unique())
+
+        rows = _concat([self._rows[touched], readings])
+        rows = rows.drop_duplicates(["Tank-ID", "Zeitstempel"], keep="last")
+        rows = rows.sort_values(["Tank-ID", "Zeitstempel"]).groupby("Tank-ID").tail(2)
+
+        rows = _concat([self._rows[~touched], rows])
+        self._rows = rows.reindex(columns=["Zeitstempel"] + STATE_COLUMNS)
+        logger.info(f"Updated the state of {readings['Tank-ID'].nunique()} tank(s).")
+
+    def update_prices(self, prices: pd.DataFrame) -> None:
+        """
+        Sets the oil price of all state rows whose (PLZ, day) occurs in prices.
+
+        :param prices: pd.DataFrame -- Columns "PLZ", "Zeitstempel" and "Price"
+        """
+        prices = prices.assign(Zeitstempel=pd.to_datetime(prices["Zeitstempel"]))
+        prices = prices.drop_duplicates(["PLZ", "Zeitstempel"], keep="last").set_index(["PLZ", "Zeitstempel"])
+        keys = pd.MultiIndex.from_frame(self._rows[["PLZ", "Zeitstempel"]])
+        new_prices = prices["Price"].reindex(keys).to_numpy()
+        self._rows["Oil Price"] = self._rows["Oil Price"].where(pd.isna(new_prices), new_prices)
+
+    def update_weather(self, mean_temperatures: pd.Series) -> None:
+        """
+        Sets the mean temperature forecast of the tanks in mean_temperatures (indexed by Tank-ID).
+        """
+        new_temperatures = self._rows["Tank-ID"].map(mean_temperatures.round(2))
+        self._rows["Avg. Temperatur (+15 Tage)"] = new_temperatures.fillna(self._rows["Avg. Temperatur (+15 Tage)"])
+
+    def locations(self) -> pd.DataFrame:
+        """Tank-ID, Längengrad and Breitengrad of every tank."""
+        return self.today()[["Tank-ID", "Längengrad", "Breitengrad"]]
+
+    def today(self) -> pd.DataFrame:
+        """Newest reading of every tank, in the column layout of the dashboard."""
+        return self._nth(-1)
+
+    def yesterday(self) -> pd.DataFrame:
+        """Second newest reading of every tank that has at least two readings."""
+        return self._nth(-2)
+
+    def metrics(self, tank_ids: Optional[Iterable[int]] = None, max_percentage: float = 100) -> dict:
+        """
+        Values and deltas to yesterday of the dashboard KPIs, restricted to the given tanks and to tanks whose
+        Prozentualer Füllstand is at most max_percentage.
+
+        :return: dict -- KPI name -> (value, delta)
+        """
+        today, yesterday = self.today(), self.yesterday()
+        if tank_ids is not None:
+            tank_ids = list(tank_ids)
+            today, yesterday = today[today["Tank-ID"].isin(tank_ids)], yesterday[yesterday["Tank-ID"].isin(tank_ids)]
+        today = today[today["Prozentualer Füllstand"] <= max_percentage]
+        yesterday = yesterday[yesterday["Prozentualer Füllstand"] <= max_percentage]
+
+        def _metric(aggregate) -> tuple:
+            value = aggregate(today)
+            return value, value - aggregate(yesterday)
+
+        return {
+            "Total Sensors": _metric(lambda df: df["Tank-ID"].nunique()),
+            "Total Liter": _metric(lambda df: df["Füllstand"].sum()),
+            "Avg. Utilization in percent": _metric(lambda df: df["Prozentualer Füllstand"].mean()),
+            "Avg. Heating Oil Price": _metric(lambda df: df["Oil Price"].mean()),
+        }
+
+    def _nth(self, n: int) -> pd.DataFrame:
+        rows = self._rows.sort_values(["Tank-ID", "Zeitstempel"])
+        return rows.groupby("Tank-ID").nth(n)[STATE_COLUMNS].reset_index(drop=True)
+
+
+def _concat(frames: list) -> pd.DataFrame:
+    # Empty frames carry object dtypes, leaving them out keeps the dtypes of the readings
+    return pd.concat([frame for frame in frames if len(frame)], ignore_index=True)
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import pandas as pd
 import numpy as np
 
@@ -5,19 +7,45 @@ from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import PolynomialFeatures
 from sklearn.metrics import r2_score
 
-from src.api import OilPriceAPI
+from src.api import OilPriceAPI, PriceHistoryStore
+from src.artifacts import ARTIFACTS_PATH, ArtifactStore, content_hash
+from src.feature_store import FeatureStore
+from src.storage import load_readings, readings_version
 
+from src.utils.cache import LRUCache
 from src.utils.config_manager import ConfigManager
+from src.utils.logger import setup_logger
 
 # Load the config file
 config_manager = ConfigManager("configs/config.yaml")
 config = config_manager.config
 
+logger = setup_logger(__name__)
+
+CLEANED_DATA_PATH = "data/processed/data_one_day_clean.pickle"
+
+# Shared by all pages and sessions of the process
+_FORECAST_CACHE = LRUCache(config.get("cache", {}).get("forecastMaxSize", 256), name="forecast cache")
+_CLEANED_DATA_CACHE = LRUCache(2, name="cleaned data cache")
+# Fitted models on disk, reused across restarts while their training data is unchanged
+ARTIFACTS = ArtifactStore(
+    config.get("artifacts", {}).get("root", ARTIFACTS_PATH), config.get("artifacts", {}).get("maxBytes", 1024**3)
+)
+_PRICE_FORECAST_CACHE = LRUCache(config.get("cache", {}).get("priceForecastMaxSize", 4096), name="price forecast cache")
 
-def get_data(tank_id: int) -> tuple:
-    """Get the data corresponding to the tank_id."""
-    data = pd.read_pickle("data/processed/final_data.pickle")
-    data = data[data["Tank-ID"] == tank_id]
+
+def get_data(tank_id: int, path: str = CLEANED_DATA_PATH) -> tuple:
+    """
+    Get the features of the tank_id from the feature store, see src/feature_store.py. Falls back to the readings
+    at path, without price and weather features, while the store is missing or behind the readings.
+    """
+    features = FeatureStore.load()
+    if features.is_current(path) and tank_id in features.tanks.index:
+        data = features.frame(tank_ids=[tank_id])
+    else:
+        logger.warning(f"Feature store is missing or stale, reading tank {tank_id} from '{path}'")
+        data = load_readings(path, tank_ids=[tank_id])
+    data = data.dropna(subset=["Verbrauch"])
     y_train = data["Verbrauch"]
     X_train = data.drop("Verbrauch", axis=1)
     return X_train, y_train
@@ -26,28 +54,22 @@ def get_data(tank_id: int) -> tuple:
 def run_oil_consumption_forecasting(context_num, forcast_num, tank_id, degree=3):
     """Run the oil consumption forecasting. Return the dataframe with historical and forecasted data. Note for this concept the current date can only be the last available in the dataset since we do not have a database connection to access current data."""
     # Get necessary data as df
-    X_train, y_train = get_data(tank_id)
-    # Trim to the context_num and reshape
-    X_train = X_train.iloc[-context_num:]
-    y_train = y_train.iloc[-context_num:]
-    y_index = y_train.index
-    X_index = X_train.index
-
-    # Train and predict
-    print(config["models"]["oilConsumption"])
-    if config["models"]["oilConsumption"] == "polyReg":
-        pass
-    elif config["models"]["oilConsumption"] == "rf":
-        pass
-    else:
-        raise ValueError("Invalid model for oil consumption forecasting")
+    clean_data = get_cleaned_data(tank_ids=[tank_id])
+    # Trim to the context_num
+    y_train = clean_data.set_index(pd.to_datetime(clean_data["Zeitstempel"]))["Verbrauch"].iloc[-context_num:]
+
+    # Train and predict with the configured model, src.models builds on this module
+    from src.models import get_model
+
+    name = config["models"]["oilConsumption"]
+    params = {"degree": degree} if name == "polyReg" else {}
+    _, y_pred_future = get_model(name, **params).fit_predict(clean_data, context_num, forcast_num, workers=1)
 
     # Concat y_train with forcasting data
-    tmp_y_train = pd.DataFrame(y_train)
+    tmp_y_train = pd.DataFrame({"value": y_train})
     tmp_y_train["flag"] = "train"
 
-    new_dates = pd.date_range(start=y_index.index[-1] + pd.Timedelta(days=1), periods=10, freq="D")
-    tmp_y_forcast = pd.DataFrame({"value": 1}, index=new_dates)
+    tmp_y_forcast = pd.DataFrame({"value": y_pred_future["Verbrauch"].to_numpy()}, index=y_pred_future["Zeitstempel"])
     tmp_y_forcast["flag"] = "forcast"
 
     df = pd.concat([tmp_y_train, tmp_y_forcast])
@@ -55,25 +77,34 @@ def run_oil_consumption_forecasting(context_num, forcast_num, tank_id, degree=3)
     return df
 
 
+def run_fleet_consumption_forecasting(context_num, forcast_num, path=CLEANED_DATA_PATH):
+    """Fits the configured model for every tank, tree models train on all cores within the model's CPU budget.
+
+    :return: fitted models and the forecast as returned by ConsumptionModel.fit_predict
+    """
+    from src.models import get_model
+
+    return get_model().fit_predict(get_cleaned_data(path), context_num, forcast_num)
+
+
 def run_oil_price_forecasting(context_num, forcast_num, tank_id):
     """Run the oil price forecasting. Return the dataframe with historical and forecasted data."""
     # Get PLZ
-    X_train, y_train = get_data(tank_id)
-    y_index = y_train.index
-    plz = X_train["plz"].iloc[-1]
+    X_train, _ = get_data(tank_id)
+    plz = _normalize_plz(X_train["PLZ"]).iloc[-1]
     # Get historical data
-    end_date = pd.Timestamp.now().strftime("%Y-%m-%d")
-    start_date = (pd.Timestamp.now() - pd.DateOffset(days=context_num)).strftime("%Y-%m-%d")
-    oilP_api = OilPriceAPI()
-    oilP_df = oilP_api.get_heizoel(plz, start_date, end_date)
-    # Train and predict
-    # implement y_forcast
+    history = get_price_histories([plz], context_num).set_index("Date")["Price"]
+    # Train and predict, the model is shared by all tanks of the PLZ. PLZs without quotes have no forecast.
+    forecast = get_price_forecasts([plz], context=context_num, forecast_days=forcast_num).reindex([plz]).iloc[0]
+    forecast = forecast.dropna()
     # Concat y_train with forcasting data
-    tmp_y_train = pd.DataFrame(y_train)
+    tmp_y_train = pd.DataFrame({"value": history})
     tmp_y_train["flag"] = "train"
+    if history.empty or forecast.empty:
+        return tmp_y_train
 
-    new_dates = pd.date_range(start=y_index.index[-1] + pd.Timedelta(days=1), periods=10, freq="D")
-    tmp_y_forcast = pd.DataFrame({"value": 1}, index=new_dates)
+    new_dates = pd.date_range(start=history.index.max(), periods=len(forecast), freq="D")
+    tmp_y_forcast = pd.DataFrame({"value": forecast.to_numpy()}, index=new_dates)
     tmp_y_forcast["flag"] = "forcast"
 
     df = pd.concat([tmp_y_train, tmp_y_forcast])
@@ -81,15 +112,20 @@ def run_oil_price_forecasting(context_num, forcast_num, tank_id):
     return df
 
 
-def get_cleaned_data(path="data/processed/data_one_day_clean.pickle") -> pd.DataFrame:
-    df = pd.read_pickle(path)
+def get_cleaned_data(path=CLEANED_DATA_PATH, tank_ids=None) -> pd.DataFrame:
+    return clean_readings(load_readings(path, tank_ids=tank_ids))
+
+
+def clean_readings(df: pd.DataFrame) -> pd.DataFrame:
+    """Consumption of already loaded readings as returned by get_cleaned_data."""
+    df = df.copy()
     # correct outliers
     df.loc[df["Verbrauch"] > 0, "Verbrauch"] = 0.0
     # take absolute values
     df["Verbrauch"] = df["Verbrauch"].abs()
     # drop NaN values
     df = df.dropna()
-    df = df[["Zeitstempel", "Verbrauch"]]
+    df = df[["Tank-ID", "Zeitstempel", "Verbrauch"]]
 
     return df
 
@@ -126,3 +162,257 @@ def fit_linear_model(df: pd.DataFrame, context: int = 90, degree: int = 3, forec
     )
 
     return y_train, y_pred, y_pred_future
+
+
+@lru_cache(maxsize=64)
+def _polynomial_projection(context: int, degree: int) -> tuple:
+    """Return the design matrix of ``np.arange(context)`` and its least-squares projection.
+
+    X only depends on (context, degree), so the pseudo-inverse is computed once and shared by all tanks.
+    The day index is scaled to [0, 1] to keep the Vandermonde matrix well conditioned for long contexts.
+    """
+    x = np.arange(context, dtype=float) / _polynomial_scale(context)
+    X_poly = np.vander(x, degree + 1, increasing=True)
+    projection = np.linalg.pinv(X_poly)
+    X_poly.setflags(write=False)
+    projection.setflags(write=False)
+    return X_poly, projection
+
+
+def _polynomial_scale(context: int) -> float:
+    """Scale applied to the day index of a context window of the given length."""
+    return float(max(context - 1, 1))
+
+
+def _evaluate_polynomial(coefs: np.ndarray, days: np.ndarray, context: np.ndarray) -> np.ndarray:
+    """Evaluate fitted polynomials (one row of coefficients per tank) at the given day indices.
+
+    :param coefs: array (n_tanks, degree + 1) -- Coefficients in increasing order as returned by fit_linear_models
+    :param days: array (n_days,) or (n_tanks, n_days) -- Day indices relative to the start of the context window
+    :param context: array (n_tanks,) -- Length of the context window each tank was fitted on
+    :return: array (n_tanks, n_days) -- Predicted consumption
+    """
+    scale = np.maximum(np.asarray(context, dtype=float) - 1, 1)[:, None]
+    x = np.broadcast_to(days, (len(coefs), np.shape(days)[-1])) / scale
+    # Horner scheme, vectorized over tanks and days
+    y = np.zeros_like(x)
+    for k in range(coefs.shape[1] - 1, -1, -1):
+        y = y * x + coefs[:, k : k + 1]
+    return y
+
+
+def _stack_context(df: pd.DataFrame, context: int) -> tuple:
+    """Take the newest ``context`` rows of every tank and group the tanks by the resulting window length.
+
+    :return: tank_ids, last_dates, {window length: (positions of the tanks, consumption matrix)}
+    """
+    df = df.sort_values(["Tank-ID", "Zeitstempel"], kind="stable")
+    df = df.groupby("Tank-ID", sort=False).tail(context)
+
+    tank_ids, starts, counts = np.unique(df["Tank-ID"].to_numpy(), return_index=True, return_counts=True)
+    values = df["Verbrauch"].to_numpy(dtype=float)
+    last_dates = pd.to_datetime(df["Zeitstempel"]).to_numpy()[starts + counts - 1]
+
+    windows = {}
+    for length in np.unique(counts):
+        positions = np.flatnonzero(counts == length)
+        rows = starts[positions, None] + np.arange(length)
+        windows[int(length)] = (positions, values[rows])
+
+    return tank_ids, last_dates, windows
+
+
+def fit_linear_models(
+    df: pd.DataFrame, context: int = 90, degree: int = 3, forecast_days: int = 7, forecast_start: int = 0
+) -> tuple:
+    """Batched version of fit_linear_model for the whole fleet.
+
+    Every Tank-ID is fitted on its newest ``context`` days with one shared projection per (context, degree),
+    so the fleet is fitted and extrapolated with a single matrix product instead of one sklearn model per tank.
+    Tanks with fewer than ``context`` days are fitted on all of their days.
+
+    :param df: pd.DataFrame -- Fleet frame with the columns "Tank-ID", "Zeitstempel" and "Verbrauch"
+    :param context: int -- Number of newest days used for fitting
+    :param degree: int -- Degree of the polynomial
+    :param forecast_days: int -- Number of days to forecast
+    :param forecast_start: int -- First forecast day relative to the last day of the context window. 0 starts at
+        the last day like fit_linear_model, 1 on the day after like the models of src.models.
+    :return: coefs: pd.DataFrame indexed by Tank-ID with the window length "n", the in-sample "r2", the
+        "last_date" and the polynomial coefficients "coef_0" ... "coef_<degree>";
+        y_pred_future: pd.DataFrame with the columns "Tank-ID", "Zeitstempel" and "Verbrauch"
+    """
+    tank_ids, last_dates, windows = _stack_context(df, context)
+
+    n_tanks = len(tank_ids)
+    n = np.zeros(n_tanks, dtype=int)
+    r2 = np.zeros(n_tanks)
+    coefs = np.zeros((n_tanks, degree + 1))
+    future = np.zeros((n_tanks, forecast_days))
+
+    for length, (positions, y) in windows.items():
+        X_poly, projection = _polynomial_projection(length, degree)
+        beta = y @ projection.T
+        y_pred = beta @ X_poly.T
+
+        # Same definition as sklearn's r2_score, which returns 1.0 for perfectly fitted constant series
+        ss_res = ((y - y_pred) ** 2).sum(axis=1)
+        ss_tot = ((y - y.mean(axis=1, keepdims=True)) ** 2).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r2[positions] = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.where(ss_res > 0, 0.0, 1.0))
+
+        n[positions] = length
+        coefs[positions] = beta
+        future_days = np.arange(length - 1 + forecast_start, length - 1 + forecast_start + forecast_days)
+        future[positions] = _evaluate_polynomial(beta, future_days, np.full(len(positions), length))
+
+    coef_columns = [f"coef_{k}" for k in range(degree + 1)]
+    coefs = pd.DataFrame(coefs, columns=coef_columns, index=pd.Index(tank_ids, name="Tank-ID"))
+    coefs.insert(0, "last_date", last_dates)
+    coefs.insert(0, "r2", r2)
+    coefs.insert(0, "n", n)
+
+    day_offsets = np.arange(forecast_start, forecast_start + forecast_days)
+    y_pred_future = pd.DataFrame(
+        {
+            "Tank-ID": np.repeat(tank_ids, forecast_days),
+            "Zeitstempel": (last_dates[:, None] + day_offsets.astype("timedelta64[D]")).ravel(),
+            "Verbrauch": future.ravel(),
+        },
+        index=(n[:, None] - 1 + day_offsets).ravel(),
+    )
+
+    return coefs, y_pred_future
+
+
+def data_version(path: str) -> tuple:
+    """Cheap fingerprint of the readings behind path, changes whenever they are rewritten."""
+    return readings_version(path)
+
+
+def get_forecast(
+    tank_id: int, context: int = 90, degree: int = 3, forecast_days: int = 7, path: str = CLEANED_DATA_PATH
+) -> tuple:
+    """Memoized fit_linear_model for a single tank.
+
+    Results are kept in a process-wide LRU cache keyed by (tank, context, degree, horizon, data version), so
+    repeated renders with the same settings cost a dictionary lookup. Copies are returned because callers
+    add columns to the frames.
+
+    :return: y_train, y_pred, y_pred_future as returned by fit_linear_model
+    """
+    version = data_version(path)
+    key = (tank_id, context, degree, forecast_days, version)
+
+    def _fit():
+        clean_data = _CLEANED_DATA_CACHE.get_or_compute((path, version), lambda: get_cleaned_data(path))
+        clean_data = clean_data[clean_data["Tank-ID"] == tank_id].iloc[-context:]
+        return ARTIFACTS.get_or_fit(
+            "polyReg-tank",
+            {"context": context, "degree": degree, "forecast_days": forecast_days},
+            content_hash(clean_data),
+            lambda: fit_linear_model(df=clean_data, context=context, degree=degree, forecast_days=forecast_days),
+        )
+
+    return tuple(frame.copy() for frame in _FORECAST_CACHE.get_or_compute(key, _fit))
+
+
+def get_fleet_coefs(context: int = 90, degree: int = 3, path: str = CLEANED_DATA_PATH) -> pd.DataFrame:
+    """Memoized fit_linear_models coefficients of the whole fleet, see get_forecast for the cache key."""
+    version = data_version(path)
+    key = ("fleet", context, degree, version)
+
+    def _fit():
+        clean_data = _CLEANED_DATA_CACHE.get_or_compute((path, version), lambda: get_cleaned_data(path))
+        clean_data = clean_data.sort_values(["Tank-ID", "Zeitstempel"]).groupby("Tank-ID").tail(context)
+        return ARTIFACTS.get_or_fit(
+            "polyReg-fleet",
+            {"context": context, "degree": degree},
+            content_hash(clean_data),
+            lambda: fit_linear_models(clean_data, context=context, degree=degree, forecast_days=0)[0],
+        )
+
+    return _FORECAST_CACHE.get_or_compute(key, _fit)
+
+
+def _normalize_plz(plz: pd.Series) -> pd.Series:
+    """PLZ as stored in the readings (float) to the string the price API expects."""
+    return plz.astype(str).str.replace(".0", "", regex=False)
+
+
+def get_price_histories(plzs, days: int, api: OilPriceAPI = None) -> pd.DataFrame:
+    """Daily price histories of the newest ``days`` days per PLZ, fetched concurrently from the local store.
+
+    Prices are only quoted on business days, missing days are filled with the last quote.
+
+    :param api: OilPriceAPI -- Client to fetch with, defaults to one on the local PriceHistoryStore
+    :return: pd.DataFrame with the columns "PLZ", "Date" and "Price"
+    """
+    end_date = pd.Timestamp.now().normalize()
+    start_date = end_date - pd.Timedelta(days=days + 7)
+    prices = (api or OilPriceAPI(store=PriceHistoryStore())).get_heizoel_bulk(
+        plzs, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+    )
+    prices["Date"] = pd.to_datetime(prices["Date"])
+    prices = prices.pivot_table(index="Date", columns="PLZ", values="Price", aggfunc="last")
+    prices = prices.asfreq("D").ffill().tail(days)
+    return prices.melt(ignore_index=False, value_name="Price").dropna().reset_index()[["PLZ", "Date", "Price"]]
+
+
+def fit_price_models(histories: pd.DataFrame, context: int = 60, degree: int = 1, forecast_days: int = 30):
+    """Fits one polynomial trend per PLZ, all PLZs at once.
+
+    Price only depends on the PLZ, so this is fit_linear_models with the PLZ in place of the Tank-ID.
+
+    :param histories: pd.DataFrame -- Daily prices with the columns "PLZ", "Date" and "Price"
+    :return: pd.DataFrame indexed by PLZ with one column per forecast day, day 0 is the last day of the history
+    """
+    df = histories.rename(columns={"PLZ": "Tank-ID", "Date": "Zeitstempel", "Price": "Verbrauch"})
+    coefs, y_pred_future = fit_linear_models(df, context=context, degree=degree, forecast_days=forecast_days)
+    forecasts = y_pred_future["Verbrauch"].to_numpy().reshape(len(coefs), forecast_days)
+    return pd.DataFrame(forecasts, index=pd.Index(coefs.index, name="PLZ"))
+
+
+def get_price_forecasts(plzs, context: int = 60, degree: int = 1, forecast_days: int = 30) -> pd.DataFrame:
+    """Memoized price forecasts for the given PLZs.
+
+    Forecasts are cached per (PLZ, day, settings), so the cost scales with the number of distinct PLZs that were
+    not forecasted yet today, independent of the number of tanks. Missing PLZs are fetched concurrently and fitted
+    together. PLZs without any known price are left out.
+
+    :return: pd.DataFrame indexed by PLZ with one column per forecast day, see fit_price_models
+    """
+    plzs = list(dict.fromkeys(str(plz) for plz in plzs))
+    today = pd.Timestamp.now().strftime("%Y-%m-%d")
+
+    def key(plz):
+        return (plz, context, degree, forecast_days, today)
+
+    cached = {plz: _PRICE_FORECAST_CACHE.get(key(plz)) for plz in plzs}
+    missing = [plz for plz, forecast in cached.items() if forecast is None]
+    if missing:
+        histories = get_price_histories(missing, context)
+        forecasts = ARTIFACTS.get_or_fit(
+            "price",
+            {"context": context, "degree": degree, "forecast_days": forecast_days},
+            content_hash(histories),
+            lambda: fit_price_models(histories, context, degree, forecast_days),
+        )
+        for plz, forecast in forecasts.iterrows():
+            _PRICE_FORECAST_CACHE.put(key(plz), forecast)
+            cached[plz] = forecast
+
+    forecasts = [forecast for forecast in cached.values() if forecast is not None]
+    if not forecasts:
+        return pd.DataFrame(columns=range(forecast_days), index=pd.Index([], name="PLZ"), dtype=float)
+    return pd.DataFrame(forecasts).rename_axis("PLZ")
+
+
+def get_tank_price_forecasts(tank_plz: pd.Series, **kwargs) -> pd.DataFrame:
+    """Fans the PLZ price forecasts out to tanks.
+
+    :param tank_plz: pd.Series -- PLZ per Tank-ID, as float (readings) or string
+    :return: pd.DataFrame indexed by Tank-ID with one column per forecast day, NaN for PLZs without prices
+    """
+    plz = _normalize_plz(tank_plz)
+    forecasts = get_price_forecasts(plz.unique(), **kwargs)
+    return pd.DataFrame(forecasts.reindex(plz).to_numpy(), index=tank_plz.index, columns=forecasts.columns)
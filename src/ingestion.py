@@ -0,0 +1,243 @@
+"""
+Streaming ingestion of the raw DataExport CSVs into the processed readings store.
+Production version of the first steps of notebooks/preprocessing.ipynb, run from root via
+"python3 -m src.ingestion data/raw/*_DataExport.csv"
+"""
+
+import argparse
+import json
+import os
+
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.storage import TankStore, load_readings, store_path
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+READINGS_PATH = "data/processed/data_one_day.pickle"
+CHUNKSIZE = 200_000
+
+# Columns dropped in the preprocessing notebook. PLZ is kept because the dashboard joins the oil prices on it.
+DROP_COLUMNS = [
+    "Anlage",
+    "Messstellen-TAG",
+    "Produkt",
+    "Kunde",
+    "Straße",
+    "Ort",
+    "Region",
+    "Gerätename",
+    "Geräte-TAG",
+    "Gerätenetz S/N",
+]
+# Columns exported as "<value> <unit>" strings, e.g. "1,234 l" or "-3 °C"
+UNIT_COLUMNS = [
+    "Füllstand",
+    "Linear Prozentwert",
+    "Sensorwert",
+    "Leerstand",
+    "Maximale Füllgrenze",
+    "Temperatur",
+    "Sensorlage",
+]
+# Columns that identify a stored tank whose Tankname is not known yet, e.g. in a store written by the notebook
+LOCATION_COLUMNS = ["PLZ", "Breitengrad", "Längengrad"]
+MANIFEST_FILE = "_ingested.json"
+TANK_IDS_FILE = "_tank_ids.json"
+
+
+def parse_units(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Strips units and thousands separators from all unit columns in one vectorized pass per column."""
+    for column in UNIT_COLUMNS:
+        if column in chunk.columns and chunk[column].dtype == object:
+            chunk[column] = parse_numbers(chunk[column])
+    return chunk
+
+
+def parse_numbers(values: pd.Series) -> pd.Series:
+    """
+    Parses numbers with units in English ("1,234.5 l") or German ("1.234,5 l") format.
+
+    The last separator is the decimal separator if both occur. A lone comma is a thousands separator if it is
+    followed by a group of three digits ("1,234 l", as in the preprocessing notebook), otherwise a decimal comma
+    ("-3,5 °C"). Several dots without a comma are German thousands separators ("1.234.567 l").
+    """
+    values = values.str.replace(r"[^0-9.,\-]", "", regex=True)
+    last_comma = values.str.rfind(",")
+    last_dot = values.str.rfind(".")
+    decimal_comma = (last_comma > last_dot) & ((last_dot >= 0) | ~values.str.contains(r",\d{3}(?:,|$)", na=False))
+    german = decimal_comma | (values.str.count(r"\.") > 1)
+    english = values.str.replace(",", "", regex=False)
+    german_values = values.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    return pd.to_numeric(english.where(~german, german_values), errors="coerce").astype(float)
+
+
+class Ingestion:
+    """
+    Incremental ingestion of raw DataExport CSVs.
+
+    Exports are streamed in chunks and aggregated to one row per tank and day (minimum of every column, as in the
+    preprocessing notebook). Days that are already in the store are skipped, exports that were ingested before are
+    not read again, and the Tank-ID assigned to a Tankname stays stable across runs. Tanks that are in the store
+    without a known Tankname (e.g. written by the preprocessing notebook) are matched by their location, new tanks
+    get Tank-IDs after the stored ones. Outlier correction and gap filling of data_one_day_clean remain in the
+    preprocessing notebook.
+    """
+
+    def __init__(self, path: str = READINGS_PATH, chunksize: int = CHUNKSIZE):
+        """
+        :param path: str -- Processed pickle whose store is updated, see src.storage.load_readings
+        :param chunksize: int -- Number of raw rows parsed at once
+        """
+        self._path = path
+        self._store = TankStore(store_path(path))
+        self._chunksize = chunksize
+        self._manifest: dict = self._load_json(MANIFEST_FILE)
+        self._tank_ids: dict = self._load_json(TANK_IDS_FILE)
+        # Tank-ID by location of the stored tanks that no Tankname is mapped to yet, loaded on the first new name
+        self._unclaimed: Optional[dict] = None
+
+    @property
+    def store(self) -> TankStore:
+        return self._store
+
+    def run(self, files: Iterable[str]) -> pd.DataFrame:
+        """
+        Ingests all new exports and appends the new days to the store.
+
+        :param files: Iterable[str] -- Raw DataExport CSVs, already ingested files are skipped
+        :return: pd.DataFrame -- The daily rows that were appended
+        """
+        files = [f for f in files if self._is_new(f)]
+        if not files:
+            logger.info("No new exports to ingest.")
+            return pd.DataFrame()
+
+        watermarks = self._store.last_dates()
+        daily = []
+        for file in files:
+            for chunk in pd.read_csv(file, delimiter=";", chunksize=self._chunksize):
+                daily.append(self._aggregate_chunk(chunk, watermarks))
+            logger.info(f"Parsed '{file}'")
+
+        # A day can span two chunks, min is associative so the partial aggregates can be combined again
+        new_days = pd.concat(daily, ignore_index=True)
+        new_days = new_days.groupby(["Tank-ID", "Zeitstempel"], as_index=False).min()
+        new_days = self._with_consumption(new_days, watermarks)
+
+        self._store.append(new_days)
+        for file in files:
+            self._manifest[os.path.basename(file)] = _file_signature(file)
+        self._save_json(MANIFEST_FILE, self._manifest)
+        self._save_json(TANK_IDS_FILE, self._tank_ids)
+        logger.info(f"Appended {len(new_days)} daily rows of {new_days['Tank-ID'].nunique()} tank(s).")
+        return new_days
+
+    def _aggregate_chunk(self, chunk: pd.DataFrame, watermarks: pd.Series) -> pd.DataFrame:
+        chunk = chunk.drop(columns=[c for c in DROP_COLUMNS if c in chunk.columns])
+        chunk["Tank-ID"] = self._assign_tank_ids(chunk)
+        chunk = chunk.drop(columns="Tankname")
+        chunk["Zeitstempel"] = pd.to_datetime(chunk["Zeitstempel"]).dt.normalize()
+
+        # Only keep days newer than what the store already holds for the tank
+        watermark = chunk["Tank-ID"].map(watermarks).to_numpy(dtype="datetime64[ns]")
+        chunk = chunk[np.isnat(watermark) | (chunk["Zeitstempel"].to_numpy() > watermark)]
+
+        chunk = parse_units(chunk.copy())
+        return chunk.groupby(["Tank-ID", "Zeitstempel"], as_index=False).min()
+
+    def _assign_tank_ids(self, chunk: pd.DataFrame) -> pd.Series:
+        names = chunk["Tankname"]
+        new = [name for name in names.unique() if name not in self._tank_ids]
+        if new:
+            unclaimed = self._unclaimed_tanks()
+            if set(LOCATION_COLUMNS) <= set(chunk.columns):
+                locations = chunk.drop_duplicates("Tankname").set_index("Tankname").loc[new, LOCATION_COLUMNS]
+                keys = _location_keys(locations)
+            else:
+                keys = [None] * len(new)
+            for name, key in zip(new, keys):
+                if key in unclaimed:
+                    self._tank_ids[name] = unclaimed.pop(key)
+                else:
+                    self._tank_ids[name] = self._next_tank_id
+                    self._next_tank_id += 1
+        return names.map(self._tank_ids).astype("int64")
+
+    def _unclaimed_tanks(self) -> dict:
+        """Location key -> Tank-ID of the stored tanks without a Tankname, tanks sharing a location are left out."""
+        if self._unclaimed is not None:
+            return self._unclaimed
+        stored = pd.DataFrame(columns=["Tank-ID"] + LOCATION_COLUMNS)
+        if self._store.exists() or os.path.exists(self._path):
+            stored = load_readings(self._path, columns=LOCATION_COLUMNS).groupby("Tank-ID").tail(1)
+        stored_ids = stored["Tank-ID"].astype("int64")
+        self._next_tank_id = int(max(stored_ids.max() if len(stored_ids) else -1, *self._tank_ids.values(), -1)) + 1
+
+        claimed = set(self._tank_ids.values())
+        stored = stored[~stored_ids.isin(claimed).to_numpy()]
+        keys = pd.Series(_location_keys(stored[LOCATION_COLUMNS]), index=stored["Tank-ID"].to_numpy(), dtype=object)
+        unique = keys[~keys.duplicated(keep=False).to_numpy()]
+        self._unclaimed = {key: int(tank_id) for tank_id, key in unique.items() if key is not None}
+        return self._unclaimed
+
+    def _with_consumption(self, new_days: pd.DataFrame, watermarks: pd.Series) -> pd.DataFrame:
+        """Computes Verbrauch (level of the next day minus level of the day) for the new days.
+
+        The newest stored day of each tank is re-emitted because its consumption only becomes known now.
+        """
+        new_days["Zeitstempel"] = new_days["Zeitstempel"].dt.date
+        tanks = new_days["Tank-ID"].unique()
+        known = watermarks[watermarks.index.isin(tanks)]
+        if len(known):
+            previous = self._store.read(tank_ids=known.index, start=known.min())
+            previous = previous[pd.to_datetime(previous["Zeitstempel"]).to_numpy() == previous["Tank-ID"].map(known)]
+            new_days = pd.concat([previous.drop(columns="Verbrauch", errors="ignore"), new_days], ignore_index=True)
+
+        new_days = new_days.sort_values(["Tank-ID", "Zeitstempel"], ignore_index=True)
+        new_days["Verbrauch"] = new_days.groupby("Tank-ID")["Füllstand"].diff().shift(-1)
+        # The shift crosses tank boundaries, the last day of every tank has no successor yet
+        new_days.loc[new_days["Tank-ID"] != new_days["Tank-ID"].shift(-1), "Verbrauch"] = np.nan
+        return new_days
+
+    def _is_new(self, file: str) -> bool:
+        return self._manifest.get(os.path.basename(file)) != _file_signature(file)
+
+    def _load_json(self, name: str) -> dict:
+        path = os.path.join(self._store.root, name)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _save_json(self, name: str, content: dict) -> None:
+        os.makedirs(self._store.root, exist_ok=True)
+        with open(os.path.join(self._store.root, name), "w", encoding="utf-8") as file:
+            json.dump(content, file, ensure_ascii=False, indent=2)
+
+
+def _location_keys(locations: pd.DataFrame) -> list:
+    """Comparable (PLZ, latitude, longitude) tuples of raw or stored rows, None where one of them is missing."""
+    values = locations.apply(
+        lambda column: parse_numbers(column.astype(str)) if column.dtype == object else column.astype(float)
+    ).round(4)
+    return [None if np.isnan(row).any() else tuple(row) for row in values.to_numpy(dtype=float)]
+
+
+def _file_signature(file: str) -> list:
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+", help="Raw DataExport CSVs")
+    parser.add_argument("--path", default=READINGS_PATH, help="Processed pickle whose store is updated")
+    parser.add_argument("--chunksize", default=CHUNKSIZE, type=int, help="Number of raw rows parsed at once")
+    args = parser.parse_args()
+
+    Ingestion(args.path, args.chunksize).run(args.files)
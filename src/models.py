@@ -0,0 +1,273 @@
+"""
+Registry of the oil consumption models selectable via config["models"]["oilConsumption"].
+
+Every model fits the whole fleet at once and returns its fitted state together with a forecast in the format of
+fit_linear_models. All forecasts start on the day after the last training day of each tank. Per-tank tree models are
+trained on a process pool whose workers read one shared feature matrix, the number of processes per model is limited
+by config["models"]["cpuBudget"]. Fitted models are kept in the artifact store, so unchanged tanks are not refitted.
+"""
+
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+
+from src.artifacts import ArtifactStore, content_hash
+from src.forcasting import ARTIFACTS, config, fit_linear_models
+from src.utils.logger import setup_logger
+from src.utils.shared import array_spec, attach_arrays, share_array
+
+logger = setup_logger(__name__)
+
+MODELS = {}
+
+# Number of previous days used as features by the tree models
+LAGS = 7
+
+
+def register_model(name: str):
+    """Class decorator that makes a ConsumptionModel selectable under the given name."""
+
+    def _register(cls):
+        cls.name = name
+        MODELS[name] = cls
+        return cls
+
+    return _register
+
+
+def get_model(name: Optional[str] = None, **params) -> "ConsumptionModel":
+    """
+    Creates the configured consumption model.
+
+    :param name: str -- Registered name, defaults to config["models"]["oilConsumption"]
+    :param params: Hyperparameters, default to config["models"]["params"][name]
+    """
+    name = name or config["models"]["oilConsumption"]
+    if name not in MODELS:
+        raise ValueError(f"Invalid model for oil consumption forecasting: '{name}', choose from {sorted(MODELS)}")
+    params = params or config["models"].get("params", {}).get(name, {})
+    return MODELS[name](**params)
+
+
+def cpu_budget(name: str) -> int:
+    """Number of processes a model may use, 0 or missing in the config means all cores."""
+    budget = config["models"].get("cpuBudget", {}).get(name, 0)
+    return budget if budget > 0 else os.cpu_count() or 1
+
+
+class ConsumptionModel:
+    """
+    Base class of the registered models.
+
+    Methods:
+    -------
+    fit_predict(df, context, forecast_days, workers=None):
+        Fits one model per tank on the newest context days and forecasts the forecast_days days after the last
+        training day of every tank. Returns the fitted state and a pd.DataFrame with the columns "Tank-ID",
+        "Zeitstempel" and "Verbrauch".
+    """
+
+    name = None
+
+    def __init__(self, store: Optional[ArtifactStore] = ARTIFACTS, **params):
+        """
+        :param store: ArtifactStore -- Store of the fitted models, None to always refit
+        :param params: Hyperparameters of the model
+        """
+        self.store = store
+        self.params = params
+
+    def fit_predict(self, df: pd.DataFrame, context: int = 90, forecast_days: int = 7, workers: Optional[int] = None):
+        raise NotImplementedError
+
+
+@register_model("polyReg")
+class PolynomialModel(ConsumptionModel):
+    """Polynomial trend per tank, fitted for the whole fleet with one matrix product (see fit_linear_models)."""
+
+    def fit_predict(self, df: pd.DataFrame, context: int = 90, forecast_days: int = 7, workers: Optional[int] = None):
+        degree = self.params.get("degree", 3)
+        df = df.sort_values(["Tank-ID", "Zeitstempel"]).groupby("Tank-ID").tail(context)
+
+        def fit():
+            return fit_linear_models(df, context=context, degree=degree, forecast_days=forecast_days, forecast_start=1)
+
+        if self.store is None:
+            return fit()
+        return self.store.get_or_fit(
+            self.name,
+            {"context": context, "degree": degree, "forecast_days": forecast_days, "forecast_start": 1},
+            content_hash(df),
+            fit,
+        )
+
+
+class TreeModel(ConsumptionModel):
+    """
+    Autoregressive tree ensemble per tank on the consumption of the previous LAGS days and the season.
+    Forecasts are recursive, each predicted day becomes a lag of the next one.
+    """
+
+    def make_estimator(self):
+        raise NotImplementedError
+
+    def fit_predict(self, df: pd.DataFrame, context: int = 90, forecast_days: int = 7, workers: Optional[int] = None):
+        features, target, tanks = build_features(df, context)
+
+        # One artifact per tank, only tanks whose training slice changed are refitted
+        params = {**self.params, "lags": LAGS, "forecast_days": forecast_days}
+        keys = pd.Series(
+            [
+                ArtifactStore.key(
+                    self.name, params, content_hash(features[start:stop], target[start:stop], str(last_date))
+                )
+                for start, stop, last_date in tanks[["start", "stop", "last_date"]].itertuples(index=False)
+            ],
+            index=tanks.index,
+            dtype=object,
+        )
+        artifacts = self.store.get_many(keys.tolist()) if self.store is not None else {}
+        missing = tanks[~keys.isin(artifacts).to_numpy()]
+        if len(missing):
+            fitted = self._fit_tanks(features, target, missing, forecast_days, workers)
+            fitted = {keys[tank_id]: artifact for tank_id, artifact in fitted.items()}
+            if self.store is not None:
+                self.store.put_many(fitted)
+            artifacts.update(fitted)
+
+        models = {tank_id: artifacts[key][0] for tank_id, key in keys.items()}
+        forecasts = np.vstack([artifacts[key][1] for key in keys]) if len(keys) else np.empty((0, forecast_days))
+        last_dates = tanks["last_date"].to_numpy()
+        day_offsets = np.arange(1, forecast_days + 1).astype("timedelta64[D]")
+        y_pred_future = pd.DataFrame(
+            {
+                "Tank-ID": np.repeat(tanks.index.to_numpy(), forecast_days),
+                "Zeitstempel": (last_dates[:, None] + day_offsets).ravel(),
+                "Verbrauch": forecasts.ravel(),
+            }
+        )
+        logger.info(f"Fitted {len(missing)} of {len(tanks)} '{self.name}' models, the others were stored.")
+        return models, y_pred_future
+
+    def _fit_tanks(self, features, target, tanks, forecast_days, workers) -> dict:
+        """Fits the given tanks on a process pool, returns Tank-ID -> (estimator, forecast)."""
+        workers = min(workers or cpu_budget(self.name), len(tanks))
+
+        # Few large tasks keep the pickling overhead low, a few per worker balance uneven tanks
+        chunks = np.array_split(np.arange(len(tanks)), min(len(tanks), workers * 4))
+        tasks = [(type(self), self.params, tanks.iloc[chunk], forecast_days) for chunk in chunks if len(chunk)]
+
+        shared = [share_array(features), share_array(target)]
+        try:
+            specs = [array_spec(memory, array) for memory, array in shared]
+            if workers == 1:
+                _attach(specs)
+                results = [_fit_chunk(*task) for task in tasks]
+            else:
+                with ProcessPoolExecutor(workers, initializer=_attach, initargs=(specs,)) as executor:
+                    results = list(executor.map(_fit_chunk, *zip(*tasks)))
+        finally:
+            _detach()
+            for memory, _ in shared:
+                memory.close()
+                memory.unlink()
+
+        logger.info(f"Trained {len(tanks)} '{self.name}' models on {workers} process(es).")
+        return {tank_id: (estimator, forecast) for chunk in results for tank_id, estimator, forecast in chunk}
+
+
+@register_model("rf")
+class RandomForestModel(TreeModel):
+    def make_estimator(self):
+        params = {"n_estimators": 50, "max_depth": 8, "random_state": 0, **self.params}
+        # Parallelism comes from the process pool, one core per estimator avoids oversubscription
+        return RandomForestRegressor(n_jobs=1, **params)
+
+
+@register_model("gbm")
+class GradientBoostingModel(TreeModel):
+    def make_estimator(self):
+        return HistGradientBoostingRegressor(**{"max_iter": 100, "random_state": 0, **self.params})
+
+
+def build_features(df: pd.DataFrame, context: int) -> tuple:
+    """
+    Builds the feature matrix of all tanks at once: the consumption of the previous LAGS days and the day of the
+    year as sine and cosine, for the newest context days of every tank.
+
+    :return: features: float32 array (n_rows, LAGS + 2), target: float32 array (n_rows,),
+        tanks: pd.DataFrame indexed by Tank-ID with the row range "start", "stop" and the "last_date"
+    """
+    df = df.sort_values(["Tank-ID", "Zeitstempel"], kind="stable")
+    df = df.groupby("Tank-ID", sort=False).tail(context + LAGS)
+
+    values = df["Verbrauch"].to_numpy(dtype=np.float32)
+    tank_ids = df["Tank-ID"].to_numpy()
+    dates = pd.to_datetime(df["Zeitstempel"])
+
+    lags = np.full((len(values), LAGS), np.nan, dtype=np.float32)
+    for lag in range(1, LAGS + 1):
+        same_tank = np.r_[np.zeros(lag, dtype=bool), tank_ids[lag:] == tank_ids[:-lag]]
+        lags[lag:, lag - 1] = values[:-lag]
+        lags[~same_tank, lag - 1] = np.nan
+    features = np.column_stack([lags, _season(dates.dt.dayofyear.to_numpy())]).astype(np.float32)
+
+    valid = ~np.isnan(lags).any(axis=1)
+    features, target, tank_ids = features[valid], values[valid], tank_ids[valid]
+    last_dates = dates.groupby(df["Tank-ID"].to_numpy()).max()
+
+    ids, starts, counts = np.unique(tank_ids, return_index=True, return_counts=True)
+    # The recursive forecast starts from the last LAGS days
+    enough = counts >= LAGS
+    ids, starts, counts = ids[enough], starts[enough], counts[enough]
+    tanks = pd.DataFrame(
+        {"start": starts, "stop": starts + counts, "last_date": last_dates.reindex(ids).to_numpy()},
+        index=pd.Index(ids, name="Tank-ID"),
+    )
+    return np.ascontiguousarray(features), target, tanks
+
+
+def _season(day_of_year: np.ndarray) -> np.ndarray:
+    angle = 2 * np.pi * day_of_year / 365.25
+    return np.column_stack([np.sin(angle), np.cos(angle)])
+
+
+# Views of the shared feature matrix and target in a worker process
+_SHARED = {}
+
+
+def _attach(specs: list) -> None:
+    _SHARED["memories"], (_SHARED["features"], _SHARED["target"]) = attach_arrays(specs)
+
+
+def _detach() -> None:
+    _SHARED.pop("features", None)
+    _SHARED.pop("target", None)
+    for memory in _SHARED.pop("memories", []):
+        memory.close()
+
+
+def _fit_chunk(model_class: type, params: dict, tanks: pd.DataFrame, forecast_days: int) -> list:
+    """Fits and forecasts the tanks of one task, reading their rows from the shared matrices."""
+    features, target = _SHARED["features"], _SHARED["target"]
+    model = model_class(store=None, **params)
+    results = []
+    for tank_id, (start, stop, last_date) in tanks[["start", "stop", "last_date"]].iterrows():
+        estimator = model.make_estimator().fit(features[start:stop], target[start:stop])
+
+        history = list(target[stop - LAGS : stop])
+        day_of_year = (pd.Timestamp(last_date) + pd.to_timedelta(np.arange(1, forecast_days + 1), "D")).dayofyear
+        season = _season(day_of_year.to_numpy())
+        forecast = np.empty(forecast_days)
+        for day in range(forecast_days):
+            row = np.r_[history[::-1][:LAGS], season[day]].astype(np.float32)[None, :]
+            forecast[day] = max(estimator.predict(row)[0], 0.0)
+            history.append(forecast[day])
+        results.append((tank_id, estimator, forecast))
+    return results
@@ -0,0 +1,214 @@
+import os
+
+from functools import lru_cache
+from math import comb
+
+import numpy as np
+import pandas as pd
+
+from src.forcasting import _evaluate_polynomial, _polynomial_scale, _stack_context
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class OnlinePolynomialFit:
+    """
+    Incremental version of fit_linear_models: the polynomial consumption fit of every tank over its newest context
+    days, kept current one day at a time instead of refitting the window.
+
+    Per tank the sufficient statistics Xᵀy (in raw day indices 0 ... n-1), Σy² and the window itself (a ring buffer,
+    needed to know which value leaves the window) are kept. A new day adds one term to Xᵀy, the oldest day of a full
+    window is removed and the day indices are shifted by one with a binomial matrix. XᵀX only depends on the window
+    length, so its inverses are computed once and shared by all tanks. Every update is O(degree²) per tank and
+    vectorized over the tanks of a day, the coefficients match a full refit up to floating point error.
+
+    Methods:
+    -------
+    fit(df):
+        Initializes the statistics of the tanks in df from their newest context days.
+    update(df):
+        Adds the readings of df that are newer than the last day of their tank.
+    coefs():
+        Returns the coefficients in the format of fit_linear_models.
+    forecast(forecast_days):
+        Returns the forecast in the format of fit_linear_models.
+    load(path) / save(path):
+        Reads / writes the statistics as pickle.
+    """
+
+    def __init__(self, context: int = 90, degree: int = 3):
+        """
+        :param context: int -- Number of newest days per tank the polynomial is fitted on
+        :param degree: int -- Degree of the polynomial
+        """
+        self.context = context
+        self.degree = degree
+
+        self._tank_ids = pd.Index([], name="Tank-ID")
+        self._n = np.zeros(0, dtype=int)
+        # Position of the oldest day of the window in the ring buffer
+        self._head = np.zeros(0, dtype=int)
+        self._window = np.zeros((0, context))
+        self._xty = np.zeros((0, degree + 1))
+        self._yy = np.zeros(0)
+        self._last_date = np.zeros(0, dtype="datetime64[ns]")
+
+    @property
+    def tank_ids(self) -> pd.Index:
+        return self._tank_ids
+
+    @classmethod
+    def load(cls, path: str) -> "OnlinePolynomialFit":
+        return pd.read_pickle(path)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        pd.to_pickle(self, path)
+
+    def fit(self, df: pd.DataFrame) -> "OnlinePolynomialFit":
+        """
+        (Re-)initializes the tanks in df from their newest context days, other tanks keep their statistics.
+
+        :param df: pd.DataFrame -- Cleaned readings with the columns "Tank-ID", "Zeitstempel" and "Verbrauch"
+        """
+        tank_ids, last_dates, windows = _stack_context(df, self.context)
+        rows = self._rows(tank_ids)
+
+        powers = np.arange(self.degree + 1)
+        for length, (positions, y) in windows.items():
+            tanks = rows[positions]
+            x = np.arange(length, dtype=float)
+            self._window[tanks] = 0.0
+            self._window[tanks, :length] = y
+            self._head[tanks] = 0
+            self._n[tanks] = length
+            self._xty[tanks] = y @ x[:, None] ** powers
+            self._yy[tanks] = (y**2).sum(axis=1)
+        self._last_date[rows] = last_dates
+        return self
+
+    def update(self, df: pd.DataFrame) -> "OnlinePolynomialFit":
+        """
+        Adds new readings. Days are applied in order, all tanks with a reading on the same step at once. Readings
+        that are not newer than the last day of their tank are skipped.
+
+        :param df: pd.DataFrame -- Cleaned readings with the columns "Tank-ID", "Zeitstempel" and "Verbrauch"
+        """
+        df = df.sort_values(["Tank-ID", "Zeitstempel"], kind="stable")
+        rows = self._rows(df["Tank-ID"].to_numpy())
+        dates = pd.to_datetime(df["Zeitstempel"]).to_numpy()
+        known = ~np.isnat(self._last_date[rows])
+        new = ~known | (dates > self._last_date[rows])
+        if (~new).any():
+            logger.debug(f"Skipped {(~new).sum()} readings that are not newer than the fitted days.")
+        rows, dates, values = rows[new], dates[new], df["Verbrauch"].to_numpy(dtype=float)[new]
+
+        # The k-th new reading of every tank is applied in step k
+        step = pd.Series(rows).groupby(rows).cumcount().to_numpy()
+        for k in range(step.max() + 1 if len(step) else 0):
+            at = step == k
+            self._add(rows[at], values[at])
+            self._last_date[rows[at]] = dates[at]
+        return self
+
+    def coefs(self) -> pd.DataFrame:
+        """
+        :return: pd.DataFrame indexed by Tank-ID with the window length "n", the in-sample "r2", the "last_date" and
+            the coefficients "coef_0" ... "coef_<degree>" on the day index scaled to [0, 1], as in fit_linear_models
+        """
+        n = self._n
+        scale = np.maximum(n - 1, 1).astype(float)
+        xty = self._xty / scale[:, None] ** np.arange(self.degree + 1)
+        gram, gram_inverse = _scaled_gram(self.context, self.degree)
+        beta = np.einsum("tij,tj->ti", gram_inverse[n], xty)
+
+        # ss_res = yᵀy - 2 βᵀXᵀy + βᵀXᵀXβ, as in sklearn's r2_score perfectly fitted constant series get 1.0
+        ss_res = np.maximum(self._yy - 2 * (beta * xty).sum(axis=1) + np.einsum("ti,tij,tj->t", beta, gram[n], beta), 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ss_tot = np.maximum(self._yy - self._xty[:, 0] ** 2 / n, 0)
+            r2 = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.where(ss_res > 1e-9 * np.maximum(self._yy, 1), 0.0, 1.0))
+
+        coefs = pd.DataFrame(beta, columns=[f"coef_{k}" for k in range(self.degree + 1)], index=self._tank_ids)
+        coefs.insert(0, "last_date", self._last_date)
+        coefs.insert(0, "r2", r2)
+        coefs.insert(0, "n", n)
+        return coefs
+
+    def forecast(self, forecast_days: int = 7) -> pd.DataFrame:
+        """
+        :return: pd.DataFrame with the columns "Tank-ID", "Zeitstempel" and "Verbrauch", starting at the last day of
+            the window and indexed by the day index, as y_pred_future of fit_linear_models
+        """
+        coefs = self.coefs()
+        beta = coefs.filter(like="coef_").to_numpy()
+        n = coefs["n"].to_numpy()
+        day_offsets = np.arange(forecast_days)
+        future = _evaluate_polynomial(beta, n[:, None] - 1 + day_offsets, n)
+        return pd.DataFrame(
+            {
+                "Tank-ID": np.repeat(coefs.index.to_numpy(), forecast_days),
+                "Zeitstempel": (coefs["last_date"].to_numpy()[:, None] + day_offsets.astype("timedelta64[D]")).ravel(),
+                "Verbrauch": future.ravel(),
+            },
+            index=(n[:, None] - 1 + day_offsets).ravel(),
+        )
+
+    def _add(self, rows: np.ndarray, values: np.ndarray) -> None:
+        """Appends one day to each of the given (distinct) tanks, dropping the oldest day of full windows."""
+        powers = np.arange(self.degree + 1)
+        full = self._n[rows] == self.context
+
+        # Remove the oldest day (index 0), then shift the remaining days to 0 ... n-2
+        dropping = rows[full]
+        oldest = self._window[dropping, self._head[dropping]]
+        self._xty[dropping, 0] -= oldest
+        self._yy[dropping] -= oldest**2
+        self._xty[dropping] = self._xty[dropping] @ _shift_matrix(self.degree).T
+        self._head[dropping] = (self._head[dropping] + 1) % self.context
+        self._n[dropping] -= 1
+
+        n = self._n[rows]
+        self._window[rows, (self._head[rows] + n) % self.context] = values
+        self._xty[rows] += values[:, None] * n[:, None].astype(float) ** powers
+        self._yy[rows] += values**2
+        self._n[rows] = n + 1
+
+    def _rows(self, tank_ids) -> np.ndarray:
+        """Rows of the given tanks in the statistics, unknown tanks are appended with empty windows."""
+        unknown = pd.Index(pd.unique(np.asarray(tank_ids))).difference(self._tank_ids)
+        if len(unknown):
+            count = len(unknown)
+            self._tank_ids = (self._tank_ids.append(unknown) if len(self._tank_ids) else unknown).rename("Tank-ID")
+            self._n = np.r_[self._n, np.zeros(count, dtype=int)]
+            self._head = np.r_[self._head, np.zeros(count, dtype=int)]
+            self._window = np.vstack([self._window, np.zeros((count, self.context))])
+            self._xty = np.vstack([self._xty, np.zeros((count, self.degree + 1))])
+            self._yy = np.r_[self._yy, np.zeros(count)]
+            self._last_date = np.r_[self._last_date, np.full(count, np.datetime64("NaT"), dtype="datetime64[ns]")]
+        return self._tank_ids.get_indexer(tank_ids)
+
+
+@lru_cache(maxsize=16)
+def _shift_matrix(degree: int) -> np.ndarray:
+    """S with S @ [Σ x^j y]_j = [Σ (x - 1)^k y]_k, the binomial expansion of (x - 1)^k."""
+    shift = np.zeros((degree + 1, degree + 1))
+    for k in range(degree + 1):
+        for j in range(k + 1):
+            shift[k, j] = comb(k, j) * (-1) ** (k - j)
+    shift.setflags(write=False)
+    return shift
+
+
+@lru_cache(maxsize=16)
+def _scaled_gram(context: int, degree: int) -> tuple:
+    """XᵀX and its pseudo-inverse for every window length 0 ... context, on the day index scaled to [0, 1]."""
+    gram = np.zeros((context + 1, degree + 1, degree + 1))
+    gram_inverse = np.zeros_like(gram)
+    for n in range(1, context + 1):
+        X = np.vander(np.arange(n, dtype=float) / _polynomial_scale(n), degree + 1, increasing=True)
+        gram[n] = X.T @ X
+        gram_inverse[n] = np.linalg.pinv(gram[n])
+    gram.setflags(write=False)
+    gram_inverse.setflags(write=False)
+    return gram, gram_inverse
@@ -1,13 +1,244 @@
+import numpy as np
 import pandas as pd
 
+from src.forcasting import (
+    CLEANED_DATA_PATH,
+    _evaluate_polynomial,
+    _normalize_plz,
+    config,
+    get_fleet_coefs,
+    get_price_forecasts,
+)
+from src.storage import load_readings
+
+_RECOMMENDATION_CONFIG = config.get("recommendation", {})
+
+# Share of the Maximale Füllgrenze that must stay in the tank at all times
+RESERVE = _RECOMMENDATION_CONFIG.get("reserve", 0.2)
+# Fixed cost of one delivery in EUR, makes the optimizer bundle purchases instead of buying every day
+DELIVERY_FEE = _RECOMMENDATION_CONFIG.get("deliveryFee", 50.0)
+# Heizöl24 quotes prices in EUR/100L
+PRICE_UNIT = 100.0
+
+
+def optimize_purchases(
+    levels: np.ndarray,
+    capacities: np.ndarray,
+    consumption: np.ndarray,
+    prices: np.ndarray,
+    reserve: float = RESERVE,
+    delivery_fee: float = DELIVERY_FEE,
+) -> dict:
+    """Cost-minimal purchase plan over the forecast horizon for every tank at once.
+
+    For a fixed set of delivery days the cost is linear in the quantities, so some optimal plan lets every delivery
+    either fill the tank up or buy exactly what lasts until the next delivery (or the end of the horizon). The
+    dynamic program runs over the delivery days t and the origin of the level a delivery arrives at: the previous
+    delivery covered exactly until t (the level is the reserve), the tank was filled up on an earlier day u (the
+    level is the capacity minus the consumption since u), or nothing was bought yet. Filling up on a cheap day
+    before a large need therefore wins over buying the whole need later when the tank cannot hold it. A delivery
+    may not fill the tank above its capacity and the level never falls below ``reserve * capacity``. All tanks are
+    solved together, one delivery day costs a handful of (n_tanks, horizon, horizon) array operations.
+
+    :param levels: array (n_tanks,) -- Current level in liters
+    :param capacities: array (n_tanks,) -- Maximale Füllgrenze in liters
+    :param consumption: array (n_tanks, horizon) -- Forecasted consumption in liters per day, >= 0
+    :param prices: array (n_tanks, horizon) -- Forecasted price in EUR/100L per day, NaN where unknown
+    :param reserve: float -- Share of the capacity that has to stay in the tank
+    :param delivery_fee: float -- Fixed cost of one delivery in EUR
+    :return: dict with arrays (n_tanks,) "day" (first delivery, NaN if no purchase is needed within the horizon),
+        "quantity" (liters of the first delivery), "price" (EUR/100L of the first delivery), "cost" (EUR of the
+        whole plan) and "deliveries" (number of deliveries in the plan). If the consumption cannot be covered at
+        all, cost is NaN and the tank is to be filled up on day 0 with one delivery. Tanks without a price for every
+        day of the horizon (e.g. a PLZ without quotes) cannot be planned, their day, quantity, price and cost are
+        NaN and their deliveries 0.
+    """
+    levels = np.asarray(levels, dtype=float)
+    capacities = np.asarray(capacities, dtype=float)
+    consumption = np.clip(np.asarray(consumption, dtype=float), 0, None)
+    prices = np.asarray(prices, dtype=float)
+    priced = np.isfinite(prices).all(axis=1)
+    # Unpriced rows are planned at a price of 0 to keep NaN out of the comparisons, their results are dropped below
+    prices = np.where(priced[:, None], prices, 0.0)
+    n_tanks, horizon = consumption.shape
+    reserves = reserve * capacities
+    rows = np.arange(n_tanks)
+
+    # between[:, t, s]: consumption of the days t ... s-1
+    consumed = np.zeros((n_tanks, horizon + 1))
+    np.cumsum(consumption, axis=1, out=consumed[:, 1:])
+    between = consumed[:, None, :] - consumed[:, :, None]
+
+    # Origins of the level a delivery on day t starts with: filled up on day u < t (0 ... t-1), covered exactly by
+    # the previous delivery (EXACT) or nothing bought yet (INITIAL). A filled up tank costs the same whenever its
+    # next delivery comes, so the cost of the plans is kept per fill up day and per end of an exact delivery.
+    EXACT, INITIAL = horizon, horizon + 1
+    fill_cost = np.full((n_tanks, horizon), np.inf)
+    exact_cost = np.full((n_tanks, horizon + 1), np.inf)
+    # Delivery day and origin an EXACT state comes from, a filled up state u comes from its origin on day u
+    exact_day = np.zeros((n_tanks, horizon + 1), dtype=int)
+    exact_origin = np.zeros((n_tanks, horizon + 1), dtype=int)
+    fill_origin = np.zeros((n_tanks, horizon), dtype=int)
+
+    def arrive(t):
+        """Origins of day t with the level and the cost of the cheapest plan that arrives at day t from each."""
+        origins = np.r_[np.arange(t), EXACT, INITIAL]
+        level = np.column_stack([capacities[:, None] - between[:, :t, t], reserves, levels - consumed[:, t]])
+        # A level that falls below the reserve before day t is not reachable, day 0 may start with a shortfall
+        reachable = (level >= reserves[:, None] - 1e-9) | ((origins == INITIAL) & (t == 0))
+        arrived = np.column_stack([fill_cost[:, :t], exact_cost[:, t], np.zeros(n_tanks)])
+        return origins, level, np.where(reachable, arrived, np.inf)
+
+    for t in range(horizon):
+        origins, level, arrived = arrive(t)
+        price = prices[:, t, None] / PRICE_UNIT
+
+        # Buy exactly what lasts until day s > t: the level has to reach the reserve plus that consumption, which
+        # has to fit into the tank. The cost is arrived + fee + price * (target - level) over the origins below the
+        # target, a running minimum over the origins sorted by level.
+        target = reserves[:, None] + between[:, t, t + 1 :]
+        order = level.argsort(axis=1)
+        below = (np.take_along_axis(level, order, axis=1)[:, :, None] < target[:, None, :] - 1e-9).sum(axis=1)
+        key = np.take_along_axis(arrived - price * level, order, axis=1)
+        running = np.minimum.accumulate(key, axis=1)
+        position = np.maximum.accumulate(np.where(key == running, np.arange(len(origins)), 0), axis=1)
+        last = np.maximum(below - 1, 0)
+        best = np.take_along_axis(running, last, axis=1) + delivery_fee + price * target
+        best = np.where((below > 0) & (target <= capacities[:, None] + 1e-9), best, np.inf)
+        origin = origins[np.take_along_axis(order, np.take_along_axis(position, last, axis=1), axis=1)]
+        better = best < exact_cost[:, t + 1 :]
+        exact_cost[:, t + 1 :] = np.where(better, best, exact_cost[:, t + 1 :])
+        exact_day[:, t + 1 :] = np.where(better, t, exact_day[:, t + 1 :])
+        exact_origin[:, t + 1 :] = np.where(better, origin, exact_origin[:, t + 1 :])
+
+        # Fill the tank up, the following days are reachable as long as the level stays above the reserve
+        candidates = np.where(
+            level < capacities[:, None] - 1e-9, arrived + delivery_fee + price * (capacities[:, None] - level), np.inf
+        )
+        chosen = candidates.argmin(axis=1)
+        fill_origin[:, t] = origins[chosen]
+        fill_cost[:, t] = candidates[rows, chosen]
+
+    # Walk the plans backwards from the cheapest origin at the end of the horizon, the first delivery is found last
+    origins, _, arrived = arrive(horizon)
+    chosen = arrived.argmin(axis=1)
+    origin, total = origins[chosen], arrived[rows, chosen]
+    day = np.full(n_tanks, np.nan)
+    quantity = np.zeros(n_tanks)
+    deliveries = np.zeros(n_tanks, dtype=int)
+    s = np.full(n_tanks, horizon)
+    active = np.isfinite(total) & (origin != INITIAL)
+    while active.any():
+        exact = origin == EXACT
+        # Rows that are done keep a valid index, their results are masked
+        filled_on = np.minimum(origin, horizon - 1)
+        t = np.where(exact, exact_day[rows, s], filled_on)
+        previous = np.where(exact, exact_origin[rows, s], fill_origin[rows, filled_on])
+        level = np.select(
+            [previous == EXACT, previous == INITIAL],
+            [reserves, levels - consumed[rows, t]],
+            capacities - between[rows, np.minimum(previous, horizon - 1), t],
+        )
+        q = np.where(exact, reserves + between[rows, t, s] - level, capacities - level)
+        day[active] = t[active]
+        quantity[active] = q[active]
+        deliveries += active
+        s = np.where(active, t, s)
+        origin = np.where(active, previous, origin)
+        active &= origin != INITIAL
+
+    # Consumption that no plan can cover, e.g. a single day larger than the usable volume: fill up right away
+    feasible = np.isfinite(total)
+    day[~feasible] = 0
+    quantity[~feasible] = np.maximum(capacities[~feasible] - levels[~feasible], 0)
+    deliveries[~feasible] = quantity[~feasible] > 0
+    first = np.nan_to_num(day, nan=0).astype(int)
+    return {
+        "day": np.where(priced, day, np.nan),
+        "quantity": np.where(priced, quantity, np.nan),
+        "price": np.where(priced & ~np.isnan(day), prices[rows, first], np.nan),
+        "cost": np.where(priced & feasible, total, np.nan),
+        "deliveries": np.where(priced, deliveries, 0),
+    }
 
-def get_recommendation(context_num, forcast_num, tank_id):
-    """Get the recommendation for the oil consumption and price forecasting."""
-    oil_consumption_df = run_oil_consumption_forecasting(context_num, forcast_num, tank_id)
-    oil_price_df = run_oil_price_forecasting(context_num, forcast_num, tank_id)
 
-    # Get today values
-    today = oil_consumption_df.index
-    today_oil_tank_level = oil_consumption_df.loc[today, "Füllstand"]  # In Liters
+def forecast_consumption(coefs: pd.DataFrame, horizon: int, last_readings=None) -> np.ndarray:
+    """Daily consumption of a fit_linear_models result over the ``horizon`` days after each tank's last reading,
+    clipped at 0.
 
-    return recommendation
+    The fit ends on the last clean day, which lies before the last reading: the consumption of the last reading
+    day is not known until the next reading, and gaps in the readings add to the lag. The days up to the last
+    reading have already happened and are skipped, as in the batch run.
+
+    :param last_readings: array-like (n_tanks,) -- Day of each tank's last reading in the row order of coefs,
+        defaults to the last fitted day
+    :return: array (n_tanks, horizon) in the row order of coefs, column 0 is the day after the last reading
+    """
+    coef_columns = [c for c in coefs.columns if c.startswith("coef_")]
+    context = coefs["n"].to_numpy()
+    # Days between the last fitted day and the last reading
+    lag = np.zeros(len(coefs), dtype=int)
+    if last_readings is not None:
+        lag = pd.to_datetime(np.asarray(last_readings)) - pd.DatetimeIndex(pd.to_datetime(coefs["last_date"]))
+        lag = np.maximum(lag.days.to_numpy(), 0)
+    days = context[:, None] + lag[:, None] + np.arange(horizon)
+    consumption = _evaluate_polynomial(coefs[coef_columns].to_numpy(), days, context)
+    return np.clip(consumption, 0, None)
+
+
+def forecast_start(last_readings) -> np.ndarray:
+    """First day of the forecast horizon, the day after each tank's last reading."""
+    return (pd.to_datetime(np.asarray(last_readings)) + pd.Timedelta(days=1)).to_numpy()
+
+
+def latest_readings(path: str = CLEANED_DATA_PATH, tank_ids=None, columns=None) -> pd.DataFrame:
+    """Newest reading of every tank indexed by Tank-ID, see src.storage.load_readings for the arguments."""
+    latest = load_readings(path, tank_ids=tank_ids, columns=columns)
+    return latest.sort_values("Zeitstempel").groupby("Tank-ID").tail(1).set_index("Tank-ID")
+
+
+def get_recommendations(
+    context_num: int = 90,
+    forcast_num: int = 30,
+    tank_ids=None,
+    prices: pd.DataFrame = None,
+    path: str = CLEANED_DATA_PATH,
+) -> pd.DataFrame:
+    """Purchase recommendation for every tank of the fleet.
+
+    :param context_num: int -- Number of newest days the consumption model is fitted on
+    :param forcast_num: int -- Planning horizon in days
+    :param tank_ids: list -- Restrict the result to these tanks, all tanks if None
+    :param prices: pd.DataFrame -- Forecasted prices in EUR/100L indexed by PLZ with one column per horizon day.
+        If None, the PLZ price forecasts of get_price_forecasts are used.
+    :param path: str -- Processed pickle whose readings are used, see src.storage.load_readings
+    :return: pd.DataFrame indexed by Tank-ID with the "date", "quantity" and "price" of the next delivery, the
+        "cost" of the whole plan and the number of "deliveries"
+    """
+    coefs = get_fleet_coefs(context=context_num, degree=3, path=path)
+    if tank_ids is not None:
+        coefs = coefs.loc[coefs.index.intersection(tank_ids)]
+
+    latest = latest_readings(path, tank_ids=list(coefs.index)).reindex(coefs.index)
+    plz = _normalize_plz(latest["PLZ"])
+
+    # One forecast per PLZ, fanned out to its tanks
+    if prices is None:
+        prices = get_price_forecasts(plz.unique(), forecast_days=forcast_num)
+    tank_prices = prices.reindex(plz).to_numpy(dtype=float)[:, :forcast_num]
+
+    plan = optimize_purchases(
+        latest["Füllstand"].to_numpy(),
+        latest["Maximale Füllgrenze"].to_numpy(),
+        forecast_consumption(coefs, forcast_num, latest["Zeitstempel"]),
+        tank_prices,
+    )
+    recommendations = pd.DataFrame(plan, index=coefs.index)
+    start = forecast_start(latest["Zeitstempel"])
+    recommendations.insert(0, "date", start + pd.to_timedelta(plan["day"], unit="D").to_numpy())
+    return recommendations.drop(columns="day")
+
+
+def get_recommendation(context_num, forcast_num, tank_id):
+    """Get the recommendation for the oil consumption and price forecasting."""
+    return get_recommendations(context_num, forcast_num, tank_ids=[tank_id]).loc[tank_id]
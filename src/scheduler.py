@@ -0,0 +1,458 @@
+"""
+Incremental nightly refresh of the whole pipeline, run from root via
+"python3 -m src.scheduler --files data/raw/DataExport_*.csv --workers 4"
+
+The stages (ingestion, readings, price and weather fetch, features, consumption models, price models and
+recommendations) form a DAG that is run by a Scheduler. Every keyed stage only recomputes the tanks or PLZs whose
+inputs changed since its last successful run, judged by content hashes kept in a state file. Results are kept as
+parquet tables indexed by Tank-ID or PLZ and only the recomputed rows are replaced, so a day with 50 new readings
+refits and replans 50 tanks.
+"""
+
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.api import OilPriceAPI, PriceHistoryStore, WeatherAPI, WeatherArchive
+from src.feature_store import FEATURES_PATH, META_FILE, FeatureStore
+from src.forcasting import (
+    CLEANED_DATA_PATH,
+    _normalize_plz,
+    clean_readings,
+    config,
+    fit_linear_models,
+    fit_price_models,
+    get_price_histories,
+)
+from src.ingestion import Ingestion
+from src.recommendation import RESERVE, forecast_consumption, forecast_start, optimize_purchases
+from src.storage import load_readings, tank_versions
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_SCHEDULER_CONFIG = config.get("scheduler", {})
+
+REFRESH_PATH = _SCHEDULER_CONFIG.get("root", "data/processed/refresh")
+# Number of tanks fitted or planned at once, every chunk is checkpointed
+CHUNK_SIZE = _SCHEDULER_CONFIG.get("chunkSize", 1000)
+STATE_FILE = "_state.json"
+# Days the recent consumption of a tank is averaged over to rank it by its days to the Warnungsfüllstand
+PRIORITY_DAYS = 7
+
+
+class Stage:
+    """
+    A node of the DAG run by a Scheduler.
+
+    An unkeyed stage runs every time. A keyed stage has a keys function returning the content hash of the inputs
+    of every candidate key (e.g. Tank-ID or PLZ), it only runs on the keys whose hash differs from the one of its
+    last successful run, in the order of the keys.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable,
+        depends: Iterable[str] = (),
+        keys: Optional[Callable] = None,
+    ):
+        """
+        :param name: str -- Unique name, also the key of the stage's output and state
+        :param run: Callable -- run(outputs, stale, commit) with the outputs of all finished stages by name, the
+            stale keys (None for unkeyed stages) and commit(keys) to checkpoint the keys done so far. Returns the
+            output of the stage.
+        :param depends: Iterable[str] -- Names of the stages that have to finish first
+        :param keys: Callable -- keys(outputs) returning a pd.Series of content hashes indexed by key, in the order
+            the keys should be processed. None for unkeyed stages.
+        """
+        self.name = name
+        self.run = run
+        self.depends = list(depends)
+        self.keys = keys
+
+
+class Scheduler:
+    """
+    Runs a DAG of stages, independent stages concurrently on a thread pool.
+
+    The hashes of a keyed stage are committed to the state file once the stage and all stages depending on it
+    succeeded, so keys that are stale upstream stay stale until everything downstream consumed them. Downstream
+    stages with their own content hashes then skip what they already did. Stages can checkpoint the keys they
+    finished in between via commit. A failed stage skips its dependents, the others still run.
+
+    Methods:
+    -------
+    run(force=False):
+        Runs all stages and returns a report per stage.
+    """
+
+    def __init__(self, stages: Iterable[Stage], state_path: str, workers: int = 4):
+        """
+        :param stages: Iterable[Stage] -- The stages, dependencies have to be among them
+        :param state_path: str -- JSON file of the hashes of the last successful runs
+        :param workers: int -- Number of stages that run at once
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_path = state_path
+        self.workers = workers
+        for stage in self.stages.values():
+            unknown = set(stage.depends) - set(self.stages)
+            if unknown:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage(s) {sorted(unknown)}")
+        self._order()
+
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.exists(state_path):
+            with open(state_path, "r", encoding="utf-8") as file:
+                self._state = json.load(file)
+
+    def run(self, force: bool = False) -> dict:
+        """
+        :param force: bool -- Treat all keys as stale
+        :return: dict -- Per stage "status" ("done", "up to date", "failed" or "skipped"), the number of "stale"
+            keys and the "seconds" it ran
+        """
+        outputs, report, hashes = {}, {}, {}
+        remaining = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(self.workers) as executor:
+            while remaining or running:
+                for name, stage in list(remaining.items()):
+                    statuses = [report.get(dependency, {}).get("status") for dependency in stage.depends]
+                    if any(status in ("failed", "skipped") for status in statuses):
+                        report[name] = {"status": "skipped", "stale": 0, "seconds": 0.0}
+                        del remaining[name]
+                    elif all(status in ("done", "up to date") for status in statuses):
+                        running[executor.submit(self._run_stage, stage, dict(outputs), force)] = name
+                        del remaining[name]
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        outputs[name], hashes[name], report[name] = future.result()
+                    except Exception:
+                        logger.exception(f"Stage '{name}' failed")
+                        report[name] = {"status": "failed", "stale": 0, "seconds": 0.0}
+
+        for name, stage_hashes in hashes.items():
+            if stage_hashes is not None and all(
+                report[descendant]["status"] in ("done", "up to date") for descendant in self._descendants(name)
+            ):
+                self._commit(name, stage_hashes)
+        return report
+
+    def _run_stage(self, stage: Stage, outputs: dict, force: bool) -> tuple:
+        started = time.perf_counter()
+        hashes, stale = None, None
+        if stage.keys is not None:
+            hashes = stage.keys(outputs).astype(str)
+            hashes.index = hashes.index.astype(str)
+            known = pd.Series(self._state.get(stage.name, {}), dtype=object).reindex(hashes.index)
+            stale = hashes.index[force | (known != hashes).to_numpy()]
+            hashes = hashes.loc[stale]
+            if stale.empty:
+                logger.info(f"Stage '{stage.name}' is up to date.")
+                return None, hashes, {"status": "up to date", "stale": 0, "seconds": time.perf_counter() - started}
+            logger.info(f"Stage '{stage.name}': {len(stale)} of {len(known)} key(s) stale.")
+
+        def commit(keys) -> None:
+            keys = pd.Index(keys).astype(str)
+            self._commit(stage.name, hashes.loc[keys])
+
+        output = stage.run(outputs, None if stale is None else list(stale), commit)
+        seconds = time.perf_counter() - started
+        logger.info(f"Stage '{stage.name}' done in {seconds:.1f}s.")
+        return output, hashes, {"status": "done", "stale": 0 if stale is None else len(stale), "seconds": seconds}
+
+    def _commit(self, name: str, hashes: pd.Series) -> None:
+        with self._lock:
+            self._state.setdefault(name, {}).update(hashes.to_dict())
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self._state, file)
+            os.replace(tmp_path, self.state_path)
+
+    def _descendants(self, name: str) -> set:
+        children = {stage.name for stage in self.stages.values() if name in stage.depends}
+        return children.union(*(self._descendants(child) for child in children))
+
+    def _order(self) -> list:
+        """Topological order of the stages, raises ValueError on cycles."""
+        order, visiting = [], set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage '{name}' is part of a cycle")
+            visiting.add(name)
+            for dependency in self.stages[name].depends:
+                visit(dependency)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+
+def refresh_stages(
+    path: str = CLEANED_DATA_PATH,
+    root: str = REFRESH_PATH,
+    files: Iterable[str] = (),
+    context: int = 90,
+    degree: int = 3,
+    horizon: int = 30,
+    price_context: int = 60,
+    weather_days: int = 15,
+    features_path: Optional[str] = FEATURES_PATH,
+    transport=None,
+    chunk_size: int = CHUNK_SIZE,
+) -> list:
+    """
+    The stages of the nightly refresh. Results are written to root as parquet tables: "tanks" (latest state and
+    days to the Warnungsfüllstand), "coefs" (fit_linear_models), "prices" (fit_price_models) and "recommendations"
+    (get_recommendations).
+
+    :param path: str -- Processed pickle whose store is refreshed, see src.storage.load_readings
+    :param root: str -- Directory of the result tables
+    :param files: Iterable[str] -- Raw DataExport CSVs that are ingested into the store first
+    :param context: int -- Number of newest days the consumption models are fitted on
+    :param degree: int -- Degree of the consumption models
+    :param horizon: int -- Number of days that are forecasted and planned
+    :param price_context: int -- Number of newest days the price models are fitted on
+    :param weather_days: int -- Days of weather forecast after today
+    :param features_path: str -- Feature store that is refreshed, None to leave it out
+    :param transport: requests adapter of the APIs, e.g. StandInServer.adapter(), HTTPS if None
+    :param chunk_size: int -- Number of tanks fitted or planned at once
+    """
+    files = list(files)
+    today = pd.Timestamp.now().strftime("%Y-%m-%d")
+
+    def ingest(outputs, stale, commit):
+        return Ingestion(path).run(files) if files else None
+
+    def readings_keys(outputs):
+        versions = tank_versions(path)
+        if versions is None:
+            # Only a pickle, the tanks have to be hashed from their content
+            df = load_readings(path)
+            versions = _group_hashes(df, "Tank-ID")
+        return versions
+
+    def readings(outputs, stale, commit):
+        """Cleaned context windows of the changed tanks, their latest state is written to the tanks table."""
+        df = load_readings(path, tank_ids=[int(tank_id) for tank_id in stale])
+        windows = clean_readings(df).sort_values(["Tank-ID", "Zeitstempel"]).groupby("Tank-ID").tail(context)
+        latest = df.sort_values(["Tank-ID", "Zeitstempel"]).groupby("Tank-ID").tail(1).set_index("Tank-ID")
+        tanks = pd.DataFrame(
+            {
+                "PLZ": _normalize_plz(latest["PLZ"]),
+                "Breitengrad": latest["Breitengrad"],
+                "Längengrad": latest["Längengrad"],
+                "Füllstand": latest["Füllstand"],
+                "Maximale Füllgrenze": latest["Maximale Füllgrenze"],
+                "last_date": pd.to_datetime(latest["Zeitstempel"]),
+            }
+        )
+        recent = windows.groupby("Tank-ID").tail(PRIORITY_DAYS).groupby("Tank-ID")["Verbrauch"].mean()
+        tanks["days_to_warning"] = _days_to_warning(tanks, recent.reindex(tanks.index))
+        _upsert(root, "tanks", tanks)
+        return windows
+
+    def models_keys(outputs):
+        windows = outputs["readings"]
+        if windows is None:
+            return pd.Series(dtype=object)
+        return _group_hashes(windows, "Tank-ID").reindex(_by_priority(root, windows["Tank-ID"].unique()))
+
+    def models(outputs, stale, commit):
+        windows = outputs["readings"]
+        for chunk in _chunks([int(tank_id) for tank_id in stale], chunk_size):
+            coefs, _ = fit_linear_models(
+                windows[windows["Tank-ID"].isin(chunk)], context=context, degree=degree, forecast_days=0
+            )
+            _upsert(root, "coefs", coefs)
+            commit(chunk)
+
+    def fetch_prices(outputs, stale, commit):
+        plzs = _read_table(root, "tanks")["PLZ"].dropna().unique()
+        api = OilPriceAPI(store=PriceHistoryStore(), transport=transport)
+        return get_price_histories(plzs, price_context, api=api)
+
+    def fetch_weather(outputs, stale, commit):
+        """Tops up the weather archive for the stale locations, the feature store then reads from it."""
+        locations = pd.DataFrame([key.split("_") for key in stale], columns=["lat", "lon"]).astype(float)
+        start_date = (pd.Timestamp.now() - pd.Timedelta(days=weather_days)).strftime("%Y-%m-%d")
+        end_date = (pd.Timestamp.now() + pd.Timedelta(days=weather_days)).strftime("%Y-%m-%d")
+        WeatherAPI(archive=WeatherArchive(), transport=transport).get_data_bulk(
+            locations["lat"], locations["lon"], start_date, end_date
+        )
+
+    def weather_keys(outputs):
+        tanks = _read_table(root, "tanks").dropna(subset=["Breitengrad", "Längengrad"])
+        keys = tanks["Breitengrad"].round(1).astype(str) + "_" + tanks["Längengrad"].round(1).astype(str)
+        # Forecasts and settling days change daily, every location is fetched once a day
+        return pd.Series(today, index=pd.unique(keys))
+
+    def features(outputs, stale, commit):
+        if os.path.exists(os.path.join(features_path, META_FILE)):
+            store = FeatureStore.load(features_path, mmap_mode=None)
+        else:
+            store = FeatureStore()
+        store.refresh(path, weather_days=weather_days, transport=transport).save(features_path)
+
+    def price_models_keys(outputs):
+        histories = outputs["prices"]
+        return _group_hashes(histories[["PLZ", "Date", "Price"]], "PLZ") if len(histories) else pd.Series(dtype=object)
+
+    def price_models(outputs, stale, commit):
+        histories = outputs["prices"]
+        forecasts = fit_price_models(
+            histories[histories["PLZ"].isin(stale)], context=price_context, degree=1, forecast_days=horizon
+        )
+        forecasts.columns = forecasts.columns.astype(str)
+        _upsert(root, "prices", forecasts)
+
+    def recommendations_keys(outputs):
+        """Hash of everything a tank's plan depends on: its coefficients, state and the prices of its PLZ."""
+        tanks, coefs, prices = _read_table(root, "tanks"), _read_table(root, "coefs"), _read_table(root, "prices")
+        tanks = tanks.loc[tanks.index.intersection(coefs.index)]
+        inputs = pd.concat(
+            [
+                tanks[["Füllstand", "Maximale Füllgrenze", "PLZ"]],
+                coefs.filter(regex="^(n|coef_.*)$").reindex(tanks.index),
+                pd.Series(pd.util.hash_pandas_object(prices, index=True).to_numpy(), index=prices.index, name="price")
+                .reindex(tanks["PLZ"])
+                .set_axis(tanks.index),
+            ],
+            axis=1,
+        )
+        hashes = pd.Series(pd.util.hash_pandas_object(inputs, index=False).to_numpy(), index=inputs.index)
+        return hashes.map("{:016x}".format).reindex(_by_priority(root, hashes.index))
+
+    def recommendations(outputs, stale, commit):
+        tanks, coefs, prices = _read_table(root, "tanks"), _read_table(root, "coefs"), _read_table(root, "prices")
+        prices.columns = prices.columns.astype(int)
+        for chunk in _chunks([int(tank_id) for tank_id in stale], chunk_size):
+            chunk_tanks, chunk_coefs = tanks.loc[chunk], coefs.loc[chunk]
+            consumption = forecast_consumption(chunk_coefs, horizon, chunk_tanks["last_date"])
+            plan = optimize_purchases(
+                chunk_tanks["Füllstand"].to_numpy(),
+                chunk_tanks["Maximale Füllgrenze"].to_numpy(),
+                consumption,
+                prices.reindex(chunk_tanks["PLZ"]).to_numpy(dtype=float)[:, :horizon],
+            )
+            plan = pd.DataFrame(plan, index=pd.Index(chunk, name="Tank-ID"))
+            start = forecast_start(chunk_tanks["last_date"])
+            plan.insert(0, "date", start + pd.to_timedelta(plan.pop("day"), "D").to_numpy())
+            plan["days_to_warning"] = _days_to_warning(chunk_tanks, consumption[:, 0])
+            _upsert(root, "recommendations", plan)
+            commit(chunk)
+
+    stages = [
+        Stage("ingest", ingest),
+        Stage("readings", readings, ["ingest"], keys=readings_keys),
+        Stage("models", models, ["readings"], keys=models_keys),
+        Stage("prices", fetch_prices, ["readings"]),
+        Stage("weather", fetch_weather, ["readings"], keys=weather_keys),
+        Stage("price_models", price_models, ["prices"], keys=price_models_keys),
+        Stage("recommendations", recommendations, ["models", "price_models"], keys=recommendations_keys),
+    ]
+    if features_path is not None:
+        stages.append(Stage("features", features, ["ingest", "prices", "weather"]))
+    return stages
+
+
+def run_refresh(root: str = REFRESH_PATH, workers: int = 4, force: bool = False, **kwargs) -> dict:
+    """Runs the nightly refresh, see refresh_stages for the arguments. Returns the report of Scheduler.run."""
+    scheduler = Scheduler(refresh_stages(root=root, **kwargs), os.path.join(root, STATE_FILE), workers=workers)
+    return scheduler.run(force=force)
+
+
+def _days_to_warning(tanks: pd.DataFrame, consumption) -> np.ndarray:
+    """Days until the level reaches the Warnungsfüllstand at the given daily consumption, negative if below."""
+    headroom = tanks["Füllstand"].to_numpy(dtype=float) - RESERVE * tanks["Maximale Füllgrenze"].to_numpy(dtype=float)
+    consumption = np.asarray(consumption, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days = np.where(consumption > 0, headroom / consumption, np.inf)
+    return np.where(headroom <= 0, headroom, days)
+
+
+def _by_priority(root: str, tank_ids) -> pd.Index:
+    """The tanks ordered by their days to the Warnungsfüllstand, closest first."""
+    tanks = _read_table(root, "tanks")
+    if tanks.empty:
+        return pd.Index(tank_ids)
+    return tanks["days_to_warning"].reindex(pd.Index(tank_ids)).sort_values(kind="stable", na_position="last").index
+
+
+def _group_hashes(df: pd.DataFrame, by: str) -> pd.Series:
+    """Content hash per group of the rows of df, depends on the values and the order of the rows in a group."""
+    rows = pd.util.hash_pandas_object(df.drop(columns=by), index=False).to_numpy()
+    positions = df.groupby(by, sort=False).cumcount().to_numpy().astype(np.uint64)
+    mixed = rows ^ pd.util.hash_array(positions)
+    with np.errstate(over="ignore"):
+        hashes = pd.Series(mixed * np.uint64(0x9E3779B97F4A7C15), index=df[by].to_numpy()).groupby(level=0).sum()
+    return hashes.map("{:016x}".format)
+
+
+def _chunks(items: list, size: int) -> Iterable[list]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def _read_table(root: str, name: str) -> pd.DataFrame:
+    path = os.path.join(root, f"{name}.parquet")
+    return pd.read_parquet(path) if os.path.exists(path) else pd.DataFrame()
+
+
+def _upsert(root: str, name: str, df: pd.DataFrame) -> None:
+    """Replaces the rows of df in a table, renamed into place so an interrupted write keeps the old table."""
+    existing = _read_table(root, name)
+    if len(existing):
+        df = pd.concat([existing.loc[existing.index.difference(df.index)], df]).sort_index()
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f"{name}.parquet")
+    df.to_parquet(f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", nargs="*", default=[], help="Raw DataExport CSVs to ingest, globs are expanded")
+    parser.add_argument("--path", default=CLEANED_DATA_PATH, help="Readings that are refreshed")
+    parser.add_argument("--root", default=REFRESH_PATH, help="Directory of the result tables")
+    parser.add_argument("--context", default=90, type=int, help="Number of days the consumption models are fitted on")
+    parser.add_argument("--horizon", default=30, type=int, help="Number of days that are forecasted and planned")
+    parser.add_argument("--workers", default=4, type=int, help="Number of stages that run at once")
+    parser.add_argument("--no-features", action="store_true", help="Leave out the feature store")
+    parser.add_argument("--force", action="store_true", help="Recompute all tanks and PLZs")
+    args = parser.parse_args()
+
+    report = run_refresh(
+        root=args.root,
+        workers=args.workers,
+        force=args.force,
+        path=args.path,
+        files=[file for pattern in args.files for file in sorted(glob.glob(pattern))],
+        context=args.context,
+        horizon=args.horizon,
+        features_path=None if args.no_features else FEATURES_PATH,
+    )
+    print(pd.DataFrame(report).T.to_string())
+    if any(stage["status"] == "failed" for stage in report.values()):
+        raise SystemExit(1)
@@ -0,0 +1,337 @@
+"""
+Local HTTP service for forecasts and purchase recommendations, run from root via
+"python3 -m src.service --port 8502"
+
+Endpoints (JSON, tank lists as "?tanks=1,2,3" or as POST body {"tanks": [1, 2, 3]}):
+    GET  /tanks/<id>/forecast           Consumption forecast of one tank
+    GET  /tanks/<id>/recommendation     Next delivery of one tank
+    GET  /forecasts                     Consumption forecasts of many tanks, all tanks if none are given
+    GET  /recommendations               Next deliveries of many tanks, all tanks if none are given
+    GET  /prices?plz=79098,10115        Price forecasts per PLZ
+    GET  /stats                         Latency per endpoint and cache statistics
+    GET  /health
+Query parameters "context" and "horizon" (and "degree" for forecasts) select the model settings.
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from src.forcasting import CLEANED_DATA_PATH, config, data_version, get_fleet_coefs, get_price_forecasts
+from src.recommendation import forecast_consumption, forecast_start, get_recommendations, latest_readings
+from src.utils.cache import LRUCache
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_SERVICE_CONFIG = config.get("service", {})
+
+# Fleet-wide results, a tank lookup only indexes into them
+_RESULT_CACHE = LRUCache(_SERVICE_CONFIG.get("cacheMaxSize", 64), name="service cache")
+# Seconds between two checks whether the readings changed, the check walks the whole store
+VERSION_INTERVAL = _SERVICE_CONFIG.get("versionInterval", 30.0)
+# Number of latencies kept per endpoint
+LATENCY_WINDOW = 10000
+
+ROUTES = [
+    ("tank_forecast", re.compile(r"^/tanks/(?P<tank_id>-?\d+)/forecast/?$")),
+    ("tank_recommendation", re.compile(r"^/tanks/(?P<tank_id>-?\d+)/recommendation/?$")),
+    ("forecasts", re.compile(r"^/forecasts/?$")),
+    ("recommendations", re.compile(r"^/recommendations/?$")),
+    ("prices", re.compile(r"^/prices/?$")),
+    ("stats", re.compile(r"^/stats/?$")),
+    ("health", re.compile(r"^/health/?$")),
+]
+
+
+class ServiceError(Exception):
+    """Error answered with its HTTP status."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ForecastService:
+    """
+    HTTP service over src.forcasting and src.recommendation, running a ThreadingHTTPServer.
+
+    Results are computed for the whole fleet once per (settings, readings version, day) and kept in an in-memory
+    LRU cache, a single tank is a row lookup in the cached result. Concurrent requests that miss the cache with the
+    same settings are coalesced into one computation (see LRUCache.get_or_compute). The readings version is checked
+    in a background thread every version_interval seconds instead of on every request, new readings invalidate the
+    cached results on the next request after the check.
+
+    Methods:
+    -------
+    start() / stop():
+        Starts / stops the server in a daemon thread, also done by using the service as a context manager.
+    serve_forever():
+        Runs the server in the calling thread until interrupted.
+    warm(context=90, horizon=30):
+        Computes the fleet forecasts and recommendations ahead of the first request.
+    stats:
+        Count and latency percentiles in milliseconds per endpoint, and the cache statistics.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        path: str = CLEANED_DATA_PATH,
+        version_interval: float = VERSION_INTERVAL,
+    ):
+        """
+        :param host: str -- Interface to listen on
+        :param port: int -- Port to listen on, 0 picks a free port
+        :param path: str -- Processed pickle whose readings are used, see src.storage.load_readings
+        :param version_interval: float -- Seconds between two checks whether the readings changed
+        """
+        self.host = host
+        self.port = port
+        self.path = path
+        self.version_interval = version_interval
+
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self._version = data_version(path)
+        self._stopped = threading.Event()
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = {endpoint: np.array(values) * 1000 for endpoint, values in self._latencies.items()}
+        endpoints = {
+            endpoint: {
+                "count": len(values),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p90_ms": float(np.percentile(values, 90)),
+                "p99_ms": float(np.percentile(values, 99)),
+                "max_ms": float(values.max()),
+            }
+            for endpoint, values in latencies.items()
+            if len(values)
+        }
+        return {"endpoints": endpoints, "cache": _RESULT_CACHE.stats}
+
+    def start(self) -> "ForecastService":
+        self._server = self._make_server()
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._watch_version, daemon=True).start()
+        logger.info(f"Serving forecasts on {self.url}")
+        return self
+
+    def serve_forever(self) -> None:
+        self._server = self._make_server()
+        threading.Thread(target=self._watch_version, daemon=True).start()
+        logger.info(f"Serving forecasts on {self.url}")
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stopped.set()
+            self._server.server_close()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def warm(self, context: int = 90, horizon: int = 30) -> None:
+        self._forecasts(context, horizon, 3)
+        self._recommendations(context, horizon)
+
+    def _make_server(self) -> ThreadingHTTPServer:
+        service = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes, with Nagle every keep-alive response waits for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                service._handle(self)
+
+            def do_POST(self):
+                service._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        server.daemon_threads = True
+        return server
+
+    def _watch_version(self) -> None:
+        while not self._stopped.wait(self.version_interval):
+            try:
+                version = data_version(self.path)
+            except OSError as error:
+                logger.warning(f"Could not check the readings version: {error}")
+                continue
+            if version != self._version:
+                logger.info("Readings changed, cached results are recomputed on the next request.")
+                self._version = version
+
+    def _handle(self, request: BaseHTTPRequestHandler) -> None:
+        started = time.perf_counter()
+        url = urlsplit(request.path)
+        endpoint, match = next(((name, p.match(url.path)) for name, p in ROUTES if p.match(url.path)), (None, None))
+        try:
+            if endpoint is None:
+                raise ServiceError(404, f"No endpoint {url.path}")
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            if request.command == "POST":
+                length = int(request.headers.get("Content-Length") or 0)
+                body = json.loads(request.rfile.read(length) or b"{}")
+                query.update({key: value for key, value in body.items() if value is not None})
+            status, payload = 200, getattr(self, f"_get_{endpoint}")(query, **match.groupdict())
+        except ServiceError as error:
+            status, payload = error.status, {"error": str(error)}
+        except (ValueError, TypeError, json.JSONDecodeError) as error:
+            status, payload = 400, {"error": str(error)}
+        except Exception as error:
+            logger.exception(f"Failed to answer {request.path}")
+            status, payload = 500, {"error": str(error)}
+
+        body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+        with self._lock:
+            self._latencies[endpoint or "unknown"].append(time.perf_counter() - started)
+
+    def _get_health(self, query: dict) -> dict:
+        return {"status": "ok"}
+
+    def _get_stats(self, query: dict) -> dict:
+        return self.stats
+
+    def _get_tank_forecast(self, query: dict, tank_id: str) -> dict:
+        return _row(self._forecasts(*_settings(query, degree=True)), int(tank_id))
+
+    def _get_tank_recommendation(self, query: dict, tank_id: str) -> dict:
+        return _row(self._recommendations(*_settings(query)), int(tank_id))
+
+    def _get_forecasts(self, query: dict) -> list:
+        return _rows(self._forecasts(*_settings(query, degree=True)), _tank_ids(query))
+
+    def _get_recommendations(self, query: dict) -> list:
+        return _rows(self._recommendations(*_settings(query)), _tank_ids(query))
+
+    def _get_prices(self, query: dict) -> bytes:
+        if not query.get("plz"):
+            raise ServiceError(400, "Missing parameter plz")
+        context, horizon = int(query.get("context", 60)), int(query.get("horizon", 30))
+        plzs = _split(query["plz"])
+        prices = get_price_forecasts(plzs, context=context, forecast_days=horizon)
+        return prices.to_json(orient="index").encode("utf-8")
+
+    def _forecasts(self, context: int, horizon: int, degree: int) -> dict:
+        """Consumption forecast of every tank, see _records."""
+
+        def _compute():
+            coefs = get_fleet_coefs(context=context, degree=degree, path=self.path)
+            last_readings = latest_readings(self.path, columns=[])["Zeitstempel"].reindex(coefs.index)
+            consumption = forecast_consumption(coefs, horizon, last_readings)
+            # "date" is the day of the first forecasted consumption, the day after the last reading
+            start = pd.DatetimeIndex(forecast_start(last_readings))
+            forecasts = pd.DataFrame(
+                {"date": start.strftime("%Y-%m-%d"), "Verbrauch": list(consumption)},
+                index=coefs.index,
+            )
+            return _records(forecasts)
+
+        return _RESULT_CACHE.get_or_compute(self._key("forecasts", context, horizon, degree), _compute)
+
+    def _recommendations(self, context: int, horizon: int) -> dict:
+        """Recommendation of every tank as returned by get_recommendations, see _records."""
+
+        def _compute():
+            recommendations = get_recommendations(context_num=context, forcast_num=horizon, path=self.path)
+            recommendations["date"] = recommendations["date"].dt.strftime("%Y-%m-%d")
+            return _records(recommendations)
+
+        return _RESULT_CACHE.get_or_compute(self._key("recommendations", context, horizon), _compute)
+
+    def _key(self, *settings) -> tuple:
+        # Price forecasts change from day to day
+        return settings + (self.path, self._version, pd.Timestamp.now().strftime("%Y-%m-%d"))
+
+
+def _settings(query: dict, degree: bool = False) -> tuple:
+    context, horizon = int(query.get("context", 90)), int(query.get("horizon", 30))
+    if context < 1 or horizon < 1:
+        raise ServiceError(400, "context and horizon have to be positive")
+    return (context, horizon, int(query.get("degree", 3))) if degree else (context, horizon)
+
+
+def _split(values) -> list:
+    return [str(v).strip() for v in (values.split(",") if isinstance(values, str) else values) if str(v).strip()]
+
+
+def _tank_ids(query: dict) -> Optional[list]:
+    return [int(tank_id) for tank_id in _split(query["tanks"])] if query.get("tanks") else None
+
+
+def _records(df: pd.DataFrame) -> dict:
+    """
+    Tank-ID -> JSON-ready row. Requests only read plain dicts, pandas lookups are not thread-safe on the first
+    access of an index and cost more than the 20 ms a cached tank lookup may take.
+    """
+    records = json.loads(df.reset_index().to_json(orient="records", force_ascii=False))
+    return {record["Tank-ID"]: record for record in records}
+
+
+def _row(records: dict, tank_id: int) -> dict:
+    if tank_id not in records:
+        raise ServiceError(404, f"Unknown tank {tank_id}")
+    return records[tank_id]
+
+
+def _rows(records: dict, tank_ids: Optional[list]) -> list:
+    if tank_ids is None:
+        return list(records.values())
+    return [records[tank_id] for tank_id in dict.fromkeys(tank_ids) if tank_id in records]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=_SERVICE_CONFIG.get("host", "127.0.0.1"), help="Interface to listen on")
+    parser.add_argument("--port", default=_SERVICE_CONFIG.get("port", 8502), type=int, help="Port to listen on")
+    parser.add_argument("--path", default=CLEANED_DATA_PATH, help="Cleaned readings")
+    parser.add_argument("--warm", action="store_true", help="Compute the default results before serving")
+    args = parser.parse_args()
+
+    service = ForecastService(args.host, args.port, args.path)
+    if args.warm:
+        service.warm()
+    service.serve_forever()
@@ -0,0 +1,236 @@
+import os
+
+from typing import Iterable, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from pyarrow import fs
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+PARTITION_COLUMN = "Jahr"
+MAX_PARTITIONS = 10_000_000
+
+
+class TankStore:
+    """
+    Columnar store for daily tank readings.
+
+    The readings are written as a parquet dataset that is hive-partitioned by Tank-ID and year
+    (``Tank-ID=3/Jahr=2024/part-0.parquet``). Reads only open the partitions matching the requested tanks and
+    date range, decode only the requested columns and memory-map the files, so loading one tank's last 90 days
+    does not deserialize the history of the whole fleet.
+    """
+
+    def __init__(self, root: str):
+        """
+        :param root: str -- Directory of the dataset
+        """
+        self._root = root
+        self._filesystem = fs.LocalFileSystem(use_mmap=True)
+        self._partitioning = ds.partitioning(
+            pa.schema([("Tank-ID", pa.int64()), (PARTITION_COLUMN, pa.string())]), flavor="hive"
+        )
+
+    @property
+    def root(self) -> str:
+        return self._root
+
+    def exists(self) -> bool:
+        return os.path.isdir(self._root) and any(True for _ in self._files())
+
+    def version(self) -> tuple:
+        """Cheap fingerprint of the store, changes whenever a partition is (re)written."""
+        stats = [os.stat(path) for path in self._files()]
+        return max((s.st_mtime_ns for s in stats), default=0), len(stats), sum(s.st_size for s in stats)
+
+    def tank_versions(self) -> pd.Series:
+        """Fingerprint of every tank's partitions, changes whenever one of them is (re)written. Only stats files."""
+        rows = []
+        for path in self._files():
+            stat = os.stat(path)
+            tank = next(part for part in path.split(os.sep) if part.startswith("Tank-ID="))
+            rows.append((int(tank.split("=", 1)[1]), stat.st_mtime_ns, stat.st_size))
+        stats = pd.DataFrame(rows, columns=["Tank-ID", "mtime", "size"])
+        versions = stats.groupby("Tank-ID").agg(mtime=("mtime", "max"), size=("size", "sum"), files=("size", "size"))
+        return versions.astype(str).agg(":".join, axis=1).rename("version")
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Writes the readings, replacing all partitions that occur in df and keeping all others."""
+        if df.empty:
+            return
+        df = df.copy()
+        df[PARTITION_COLUMN] = pd.to_datetime(df["Zeitstempel"]).dt.strftime("%Y")
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        ds.write_dataset(
+            table,
+            self._root,
+            format="parquet",
+            partitioning=self._partitioning,
+            basename_template="part-{i}.parquet",
+            existing_data_behavior="delete_matching",
+            # One partition per tank and year, a fleet-wide rewrite easily exceeds the default of 1024
+            max_partitions=MAX_PARTITIONS,
+        )
+        logger.info(f"Wrote {len(df)} readings of {df['Tank-ID'].nunique()} tank(s) to '{self._root}'")
+
+    def append(self, df: pd.DataFrame) -> None:
+        """Adds or updates readings. Only the (tank, year) partitions touched by df are read and rewritten."""
+        if df.empty:
+            return
+        years = pd.to_datetime(df["Zeitstempel"]).dt.strftime("%Y")
+        touched = pd.MultiIndex.from_arrays([df["Tank-ID"].astype("int64").to_numpy(), years.to_numpy()]).unique()
+        existing = []
+        if self.exists():
+            # One scan over the touched tanks and years, the pairs that were not touched are dropped in memory
+            tank_ids = [int(t) for t in touched.get_level_values(0).unique()]
+            expression = ds.field("Tank-ID").isin(tank_ids)
+            expression &= ds.field(PARTITION_COLUMN).isin(list(touched.get_level_values(1).unique()))
+            table = self._dataset().to_table(filter=expression)
+            keys = table.select(["Tank-ID", PARTITION_COLUMN]).to_pandas()
+            mask = pd.MultiIndex.from_frame(keys).isin(touched)
+            existing.append(self._to_pandas(table.filter(pa.array(mask))))
+
+        combined = pd.concat(existing + [df], ignore_index=True)
+        combined = combined.drop_duplicates(["Tank-ID", "Zeitstempel"], keep="last")
+        self.write(combined.sort_values(["Tank-ID", "Zeitstempel"]))
+
+    def read(
+        self,
+        tank_ids: Optional[Iterable[int]] = None,
+        start=None,
+        end=None,
+        columns: Optional[list] = None,
+    ) -> pd.DataFrame:
+        """
+        Reads readings with partition pruning and column projection.
+
+        :param tank_ids: Iterable[int] -- Tanks to load, all tanks if None
+        :param start: date-like -- First day to load (inclusive), no lower bound if None
+        :param end: date-like -- Last day to load (inclusive), no upper bound if None
+        :param columns: list -- Columns to load, all columns if None
+        :return: pd.DataFrame sorted by Tank-ID and Zeitstempel
+        """
+        dataset = self._dataset()
+        expression = None
+        if tank_ids is not None:
+            expression = _and(expression, ds.field("Tank-ID").isin([int(t) for t in tank_ids]))
+        for bound, op in ((start, "ge"), (end, "le")):
+            if bound is None:
+                continue
+            timestamp = pd.Timestamp(bound)
+            year = ds.field(PARTITION_COLUMN)
+            value = _scalar(timestamp, dataset.schema.field("Zeitstempel").type)
+            if op == "ge":
+                expression = _and(expression, year >= timestamp.strftime("%Y"))
+                expression = _and(expression, ds.field("Zeitstempel") >= value)
+            else:
+                expression = _and(expression, year <= timestamp.strftime("%Y"))
+                expression = _and(expression, ds.field("Zeitstempel") <= value)
+
+        if columns is not None:
+            columns = list(dict.fromkeys(["Tank-ID", "Zeitstempel"] + list(columns)))
+        table = dataset.to_table(columns=columns, filter=expression)
+        df = self._to_pandas(table).sort_values(["Tank-ID", "Zeitstempel"], kind="stable")
+        return df.reset_index(drop=True)
+
+    def last_dates(self) -> pd.Series:
+        """Newest day stored per Tank-ID."""
+        if not self.exists():
+            return pd.Series(dtype="datetime64[ns]", name="Zeitstempel")
+        df = self._to_pandas(self._dataset().to_table(columns=["Tank-ID", "Zeitstempel"]))
+        return pd.to_datetime(df["Zeitstempel"]).groupby(df["Tank-ID"]).max()
+
+    def _dataset(self) -> ds.Dataset:
+        return ds.dataset(self._root, format="parquet", partitioning=self._partitioning, filesystem=self._filesystem)
+
+    def _files(self) -> Iterable[str]:
+        for directory, _, files in os.walk(self._root):
+            for file in files:
+                if file.endswith(".parquet"):
+                    yield os.path.join(directory, file)
+
+    @staticmethod
+    def _to_pandas(table: pa.Table) -> pd.DataFrame:
+        df = table.to_pandas()
+        df = df.drop(columns=PARTITION_COLUMN, errors="ignore")
+        # Partition columns come last, restore the column order of the processed pickles
+        return df[["Tank-ID"] + [c for c in df.columns if c != "Tank-ID"]]
+
+
+def _and(expression, other):
+    return other if expression is None else expression & other
+
+
+def _scalar(timestamp: pd.Timestamp, type_: pa.DataType) -> pa.Scalar:
+    """Converts a timestamp to a scalar comparable with the stored Zeitstempel column."""
+    if pa.types.is_date(type_):
+        return pa.scalar(timestamp.date(), type=type_)
+    return pa.scalar(timestamp.to_datetime64(), type=type_)
+
+
+def store_path(path: str) -> str:
+    """Location of the store that replaces a processed pickle, e.g. data/processed/data_one_day_clean/"""
+    return os.path.splitext(path)[0]
+
+
+def load_readings(
+    path: str,
+    tank_ids: Optional[Iterable[int]] = None,
+    start=None,
+    end=None,
+    columns: Optional[list] = None,
+) -> pd.DataFrame:
+    """
+    Loads processed readings from the store next to ``path``, falling back to the pickle itself.
+
+    :param path: str -- Path of the processed pickle, e.g. data/processed/data_one_day_clean.pickle
+    :return: pd.DataFrame -- See TankStore.read
+    """
+    store = TankStore(store_path(path))
+    if store.exists():
+        return store.read(tank_ids=tank_ids, start=start, end=end, columns=columns)
+
+    logger.warning(f"No store found at '{store.root}', reading the whole pickle '{path}'")
+    df = pd.read_pickle(path)
+    if tank_ids is not None:
+        df = df[df["Tank-ID"].isin(list(tank_ids))]
+    if start is not None:
+        df = df[pd.to_datetime(df["Zeitstempel"]) >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[pd.to_datetime(df["Zeitstempel"]) <= pd.Timestamp(end)]
+    if columns is not None:
+        df = df[list(dict.fromkeys(["Tank-ID", "Zeitstempel"] + list(columns)))]
+    return df
+
+
+def readings_version(path: str) -> tuple:
+    """Fingerprint of the readings behind ``path``, taken from the store if there is one."""
+    store = TankStore(store_path(path))
+    if store.exists():
+        return store.version()
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def tank_versions(path: str) -> Optional[pd.Series]:
+    """Fingerprint per Tank-ID of the readings behind ``path``, None if they are only stored as pickle."""
+    store = TankStore(store_path(path))
+    return store.tank_versions() if store.exists() else None
+
+
+def convert_pickle(path: str) -> TankStore:
+    """Writes the store for a processed pickle. Run once after the preprocessing notebook."""
+    store = TankStore(store_path(path))
+    store.write(pd.read_pickle(path))
+    return store
+
+
+if __name__ == "__main__":
+    for pickle_path in ["data/processed/data_one_day_clean.pickle", "data/processed/final_data.pickle"]:
+        if os.path.exists(pickle_path):
+            convert_pickle(pickle_path)
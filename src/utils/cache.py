@@ -0,0 +1,129 @@
+import threading
+
+from concurrent.futures import Future
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class LRUCache:
+    """Thread-safe, size-bounded mapping that evicts the least recently used entry first.
+
+    Instances are meant to live at module level so that they are shared by all pages and Streamlit sessions
+    of the same process.
+    """
+
+    def __init__(self, maxsize: int = 128, name: str = "cache"):
+        """
+        :param maxsize: int -- Maximum number of entries before the least recently used one is evicted
+        :param name: str -- Name used in log messages
+        """
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be positive, got {maxsize}")
+        self._maxsize = maxsize
+        self._name = name
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        # Key -> Future of a computation in progress, concurrent misses on the same key wait for it
+        self._pending: dict = {}
+        # Incremented by clear(), computations started before it do not store their result
+        self._generation = 0
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "coalesced": self._coalesced,
+            "size": len(self._data),
+            "maxsize": self._maxsize,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default=None):
+        """Returns the cached value and marks it as most recently used."""
+        with self._lock:
+            if key not in self._data:
+                self._misses += 1
+                return default
+            self._hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value) -> None:
+        """Stores the value, evicting the least recently used entries if the cache is full."""
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_compute(self, key: Hashable, compute: Callable):
+        """Returns the cached value for key, computing and storing it first on a miss.
+
+        The lock is not held while computing, so a slow computation does not block lookups of other keys.
+        Concurrent misses on the same key are coalesced: only the first caller computes and counts as a miss, the
+        others wait for its result (or its exception, in which case nothing is cached) and count as coalesced.
+        """
+        with self._lock:
+            if key in self._data:
+                self._hits += 1
+                self._data.move_to_end(key)
+                return self._data[key]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                self._misses += 1
+                future = self._pending[key] = Future()
+                generation = self._generation
+            else:
+                self._coalesced += 1
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            with self._lock:
+                # A value computed before a clear() may be outdated, it is returned but not stored
+                if generation == self._generation:
+                    self._store(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+
+    def clear(self) -> None:
+        """Drops all entries.
+
+        Computations in progress are not waited for by later calls, their results are returned but not stored.
+        """
+        with self._lock:
+            self._data.clear()
+            self._pending.clear()
+            self._generation += 1
+
+    def _store(self, key: Hashable, value) -> None:
+        """put without taking the lock, the caller holds it."""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            evicted, _ = self._data.popitem(last=False)
+            logger.debug(f"Evicted {evicted} from {self._name}")
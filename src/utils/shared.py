@@ -0,0 +1,36 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def share_array(array: np.ndarray) -> tuple:
+    """
+    Copies an array into a new shared memory block that worker processes can attach to by name.
+
+    The caller owns the block and has to close and unlink it once the workers are done.
+
+    :return: memory: shared_memory.SharedMemory, array: np.ndarray -- The block and the original array
+    """
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=memory.buf)[...] = array
+    return memory, array
+
+
+def array_spec(memory: shared_memory.SharedMemory, array: np.ndarray) -> tuple:
+    """Picklable description of a shared array, see attach_arrays."""
+    return memory.name, array.shape, array.dtype.str
+
+
+def attach_arrays(specs: list) -> tuple:
+    """
+    Attaches to shared arrays in a worker process.
+
+    :param specs: list -- (name, shape, dtype) tuples as returned by array_spec
+    :return: memories: list of shared_memory.SharedMemory, arrays: list of np.ndarray -- Views of the shared blocks,
+        the memories have to be closed once the views are no longer used
+    """
+    memories = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    arrays = [
+        np.ndarray(shape, np.dtype(dtype), buffer=memory.buf) for memory, (_, shape, dtype) in zip(memories, specs)
+    ]
+    return memories, arrays
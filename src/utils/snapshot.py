@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+from typing import Callable, Optional
+
+import pandas as pd
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class Snapshot:
+    """
+    Lazily loaded value that is persisted on disk and refreshed in the background.
+
+    The first get() of a process serves the last good snapshot from disk immediately and brings it up to date in a
+    background thread, since the data may have changed while no process was running. Later calls refresh it in the
+    background once it is older than max_age. Only if no snapshot exists yet does get() block on the loader.
+    Instances are meant to live at module level so that all Streamlit sessions share them.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        loader: Callable,
+        max_age: float = 3600,
+        load: Callable = pd.read_pickle,
+        save: Callable = pd.to_pickle,
+    ):
+        """
+        :param path: str -- File the last good value is persisted to
+        :param loader: Callable -- loader(previous) computes a fresh value from the previous one (None if there is
+            none yet), e.g. by applying the data that arrived since
+        :param max_age: float -- Age in seconds after which a value is refreshed in the background
+        :param load: Callable -- load(path) reads a persisted value
+        :param save: Callable -- save(value, path) persists a value
+        """
+        self._path = path
+        self._loader = loader
+        self._max_age = max_age
+        self._load = load
+        self._save = save
+        self._value = None
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = threading.Event()
+
+    @property
+    def loaded_at(self) -> Optional[float]:
+        """Unix time the current value was computed, None before the first get()."""
+        return self._loaded_at
+
+    @property
+    def is_refreshing(self) -> bool:
+        return self._refreshing.is_set()
+
+    def get(self):
+        with self._lock:
+            if self._value is None and os.path.exists(self._path):
+                self._value = self._load(self._path)
+                self._loaded_at = os.path.getmtime(self._path)
+                logger.info(f"Serving snapshot '{self._path}' from {time.ctime(self._loaded_at)}")
+                stale = True
+            elif self._value is None:
+                self._store(self._loader(None))
+                return self._value
+            else:
+                stale = time.time() - self._loaded_at > self._max_age
+
+        if stale:
+            self.refresh_async()
+        return self._value
+
+    def refresh_async(self) -> None:
+        """Starts a background refresh unless one is already running."""
+        with self._refresh_lock:
+            if self._refreshing.is_set():
+                return
+            self._refreshing.set()
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _refresh(self) -> None:
+        try:
+            value = self._loader(self._value)
+            with self._lock:
+                self._store(value)
+            logger.info(f"Refreshed snapshot '{self._path}'")
+        except Exception as e:
+            # Keep serving the last good snapshot
+            logger.error(f"Refreshing snapshot '{self._path}' failed: {e}")
+        finally:
+            self._refreshing.clear()
+
+    def _store(self, value) -> None:
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        tmp_path = f"{self._path}.tmp"
+        self._save(value, tmp_path)
+        os.replace(tmp_path, self._path)
+        self._value = value
+        self._loaded_at = time.time()
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+# Typical tank sizes in liters
+CAPACITIES = np.array([3000.0, 5000.0, 8000.0, 10000.0, 20000.0])
+# Rough bounding box of Germany
+LATITUDES = (47.5, 54.8)
+LONGITUDES = (6.0, 14.8)
+
+
+def generate_fleet(
+    n_tanks: int, days: int = 3 * 365, start: str = "2021-10-01", tanks_per_plz: int = 20, seed: int = 0
+) -> pd.DataFrame:
+    """
+    Generates a synthetic fleet with the schema of data_one_day_clean: one row per tank and day with seasonal
+    consumption and refills whenever a tank drops below 25% of its capacity.
+
+    :param n_tanks: int -- Number of tanks
+    :param days: int -- Number of days per tank
+    :param start: str -- First day
+    :param tanks_per_plz: int -- Average number of tanks sharing a PLZ
+    :param seed: int -- Seed of the random generator, equal seeds give equal fleets
+    :return: pd.DataFrame -- Columns Tank-ID, Zeitstempel, Füllstand, Linear Prozentwert, Maximale Füllgrenze, PLZ,
+        Breitengrad, Längengrad and Verbrauch, sorted by Tank-ID and Zeitstempel
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=days, freq="D")
+
+    capacities = rng.choice(CAPACITIES, n_tanks)
+    # Winter peak, hardly any heating in summer
+    season = 1 + np.cos(2 * np.pi * (dates.dayofyear.to_numpy() - 15) / 365)
+    base = capacities * rng.uniform(0.001, 0.004, n_tanks)
+    consumption = base[:, None] * (0.1 + season[None, :]) * rng.lognormal(0, 0.3, (n_tanks, days))
+
+    # Simulate the levels day by day, vectorized over tanks
+    levels = np.empty((n_tanks, days))
+    level = capacities * rng.uniform(0.3, 1.0, n_tanks)
+    for day in range(days):
+        levels[:, day] = level
+        level = level - consumption[:, day]
+        refill = level < 0.25 * capacities
+        level[refill] = capacities[refill] * rng.uniform(0.85, 1.0, refill.sum())
+    levels = levels.round(0)
+
+    n_plz = max(1, n_tanks // tanks_per_plz)
+    plz_codes = rng.choice(np.arange(10000, 100000), n_plz, replace=False).astype(float)
+    plz_latitudes = rng.uniform(*LATITUDES, n_plz)
+    plz_longitudes = rng.uniform(*LONGITUDES, n_plz)
+    plz = rng.integers(0, n_plz, n_tanks)
+
+    verbrauch = np.full((n_tanks, days), np.nan)
+    verbrauch[:, :-1] = np.diff(levels, axis=1)
+
+    return pd.DataFrame(
+        {
+            "Tank-ID": np.repeat(np.arange(n_tanks, dtype="int64"), days),
+            "Zeitstempel": np.tile(dates.date, n_tanks),
+            "Füllstand": levels.ravel(),
+            "Linear Prozentwert": (levels / capacities[:, None] * 100).round(1).ravel(),
+            "Maximale Füllgrenze": np.repeat(capacities, days),
+            "PLZ": np.repeat(plz_codes[plz], days),
+            "Breitengrad": np.repeat(plz_latitudes[plz] + rng.normal(0, 0.02, n_tanks), days),
+            "Längengrad": np.repeat(plz_longitudes[plz] + rng.normal(0, 0.02, n_tanks), days),
+            "Verbrauch": verbrauch.ravel(),
+        }
+    )
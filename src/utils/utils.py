@@ -23,6 +23,12 @@ def parse_args() -> Dict:
         type=str,
         default="configs/config.yaml",
     )
+    parser.add_argument("--tanks", help="Tank-IDs to process, all tanks if omitted", type=int, nargs="+", default=None)
+    parser.add_argument("--horizon", help="Number of forecast days", type=int, default=30)
+    parser.add_argument("--context", help="Number of days the consumption model is fitted on", type=int, default=90)
+    parser.add_argument("--workers", help="Number of processes, defaults to all cores", type=int, default=None)
+    parser.add_argument("--output", help="Directory of the results, defaults to the config", type=str, default=None)
+    parser.add_argument("--restart", help="Discard the checkpoints of an earlier run", action="store_true")
     args = parser.parse_args()
     args_dict = vars(args)
 
@@ -0,0 +1,268 @@
+import json
+import os
+import warnings
+
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+STATS_FILE = "stats.npz"
+META_FILE = "meta.json"
+VALUES_FILE = "values.npy"
+
+
+class WindowDataset:
+    """
+    (window, horizon) training samples of all tanks for sequence models, e.g. the LSTM of
+    notebooks/oil_consumption_forcasting.ipynb.
+
+    The readings of all tanks are kept in one contiguous float32 buffer of shape (n_rows, n_columns), the rows of a
+    tank are consecutive. A sample is only the row its window starts at: its inputs are the next window rows and its
+    target the horizon rows after them, so windows are strided views into the buffer instead of copies and memory
+    does not grow with the window length. Every column is normalized per tank in place, with statistics computed from
+    the training days only, so the scaling does not leak later days into training, and kept to transform predictions
+    back. The buffer can be stored as .npy and memory-mapped, batches then only read the pages
+    they need.
+
+    Methods:
+    -------
+    from_frame(df, columns, target, window, horizon, path=None):
+        Builds the dataset from readings, in memory or directly into a memory-mapped file.
+    load(path, mmap_mode="r") / save(path):
+        Reads / writes the buffer, statistics and sample index.
+    views():
+        Returns the strided views of all inputs and targets, indexed by sample_starts.
+    batch(samples):
+        Returns the inputs and targets of the given samples.
+    iter_batches(batch_size, shuffle=False, seed=0):
+        Yields the batches of all samples.
+    subset(tank_ids):
+        Returns the dataset restricted to some tanks, sharing the buffer.
+    denormalize(values, tank_ids, column=None):
+        Transforms normalized values of a column back to their unit.
+    """
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        columns: list,
+        target: str,
+        window: int,
+        horizon: int,
+        tanks: pd.DataFrame,
+        mean: np.ndarray,
+        std: np.ndarray,
+        sample_starts: Optional[np.ndarray] = None,
+    ):
+        """
+        :param values: array (n_rows, n_columns) -- Normalized buffer, rows sorted by tank and day
+        :param columns: list -- Names of the columns of values
+        :param target: str -- Column that is forecasted
+        :param window: int -- Number of days a sample sees
+        :param horizon: int -- Number of days a sample forecasts
+        :param tanks: pd.DataFrame -- Indexed by Tank-ID with the row range "start", "stop" of each tank
+        :param mean: array (n_tanks, n_columns) -- Per tank mean before normalization
+        :param std: array (n_tanks, n_columns) -- Per tank standard deviation before normalization
+        :param sample_starts: array -- Rows the samples start at, defaults to all windows that stay within a tank
+        """
+        self.values = values
+        self.columns = list(columns)
+        self.target = target
+        self.window = window
+        self.horizon = horizon
+        self.tanks = tanks
+        self.mean = mean
+        self.std = std
+        self.sample_starts = _sample_starts(tanks, window + horizon) if sample_starts is None else sample_starts
+
+    def __len__(self) -> int:
+        return len(self.sample_starts)
+
+    @classmethod
+    def from_frame(
+        cls,
+        df: pd.DataFrame,
+        columns: Iterable[str] = ("Verbrauch",),
+        target: str = "Verbrauch",
+        window: int = 10,
+        horizon: int = 1,
+        path: Optional[str] = None,
+        train_until=None,
+    ) -> "WindowDataset":
+        """
+        :param df: pd.DataFrame -- Readings with the columns "Tank-ID", "Zeitstempel" and columns
+        :param columns: Iterable[str] -- Input columns, the target is added if missing
+        :param target: str -- Column that is forecasted
+        :param window: int -- Number of days a sample sees
+        :param horizon: int -- Number of days a sample forecasts
+        :param path: str -- Directory the buffer is written to and memory-mapped from, in memory if None
+        :param train_until: Last day of the training data, the normalization statistics ignore later days. All days
+            if None
+        """
+        columns = list(columns) + ([target] if target not in columns else [])
+        df = df.sort_values(["Tank-ID", "Zeitstempel"], kind="stable")
+        tank_ids, starts, counts = np.unique(df["Tank-ID"].to_numpy(), return_index=True, return_counts=True)
+        tanks = pd.DataFrame({"start": starts, "stop": starts + counts}, index=pd.Index(tank_ids, name="Tank-ID"))
+
+        shape = (len(df), len(columns))
+        if path is None:
+            values = np.empty(shape, dtype=np.float32)
+        else:
+            os.makedirs(path, exist_ok=True)
+            values = np.lib.format.open_memmap(os.path.join(path, VALUES_FILE), "w+", np.float32, shape)
+        # One column at a time, the frame is never copied as a whole
+        for column, name in enumerate(columns):
+            values[:, column] = df[name].to_numpy(dtype=np.float32)
+
+        train_counts = counts
+        if train_until is not None and len(df):
+            training = (pd.to_datetime(df["Zeitstempel"]) <= pd.Timestamp(train_until)).to_numpy()
+            train_counts = np.add.reduceat(training.astype(int), starts)
+        mean, std = _normalize(values, starts, counts, train_counts)
+        dataset = cls(values, columns, target, window, horizon, tanks, mean, std)
+        if path is not None:
+            values.flush()
+            dataset._save_index(path)
+        logger.info(f"Built {len(dataset)} windows of {window} + {horizon} days from {len(tanks)} tanks.")
+        return dataset
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = "r") -> "WindowDataset":
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        stats = np.load(os.path.join(path, STATS_FILE))
+        tanks = pd.DataFrame(
+            {"start": stats["starts"], "stop": stats["stops"]}, index=pd.Index(stats["tank_ids"], name="Tank-ID")
+        )
+        return cls(
+            np.load(os.path.join(path, VALUES_FILE), mmap_mode=mmap_mode),
+            meta["columns"],
+            meta["target"],
+            meta["window"],
+            meta["horizon"],
+            tanks,
+            stats["mean"],
+            stats["std"],
+            stats["sample_starts"],
+        )
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, VALUES_FILE), self.values)
+        self._save_index(path)
+
+    def views(self) -> tuple:
+        """
+        Strided views over the buffer, sample i has the inputs inputs[sample_starts[i]] and the targets
+        targets[sample_starts[i]]. Nothing is copied until they are indexed.
+
+        :return: inputs: array (n_rows - window + 1, window, n_columns), targets: array (n_rows - window + 1, horizon)
+        """
+        inputs = sliding_window_view(self.values, self.window, axis=0).transpose(0, 2, 1)
+        targets = sliding_window_view(self.values[self.window :, self.columns.index(self.target)], self.horizon)
+        return inputs, targets
+
+    def batch(self, samples: np.ndarray) -> tuple:
+        """
+        :param samples: array -- Positions of the samples in sample_starts
+        :return: inputs: float32 array (n_samples, window, n_columns), targets: float32 array (n_samples, horizon)
+        """
+        inputs, targets = self.views()
+        starts = self.sample_starts[samples]
+        return inputs[starts], targets[starts]
+
+    def iter_batches(self, batch_size: int = 32, shuffle: bool = False, seed: int = 0) -> Iterator[tuple]:
+        """
+        Yields (inputs, targets) of batch_size samples. Without shuffling the buffer is read front to back, which
+        is the fastest order for a memory-mapped buffer.
+        """
+        order = np.random.default_rng(seed).permutation(len(self)) if shuffle else np.arange(len(self))
+        for start in range(0, len(order), batch_size):
+            samples = order[start : start + batch_size]
+            yield self.batch(np.sort(samples) if shuffle else samples)
+
+    def subset(self, tank_ids: Iterable) -> "WindowDataset":
+        """Samples of the given tanks only, e.g. for a split by tank. The buffer is shared, not copied."""
+        tanks = self.tanks.loc[list(tank_ids)]
+        rows = np.zeros(len(self.values) + 1, dtype=int)
+        np.add.at(rows, tanks["start"].to_numpy(), 1)
+        np.add.at(rows, tanks["stop"].to_numpy(), -1)
+        selected = np.cumsum(rows)[:-1].astype(bool)
+        return WindowDataset(
+            self.values,
+            self.columns,
+            self.target,
+            self.window,
+            self.horizon,
+            self.tanks,
+            self.mean,
+            self.std,
+            self.sample_starts[selected[self.sample_starts]],
+        )
+
+    def sample_tank_ids(self, samples: Optional[np.ndarray] = None) -> np.ndarray:
+        """Tank-ID of each sample."""
+        starts = self.sample_starts if samples is None else self.sample_starts[samples]
+        positions = np.searchsorted(self.tanks["start"].to_numpy(), starts, side="right") - 1
+        return self.tanks.index.to_numpy()[positions]
+
+    def denormalize(self, values: np.ndarray, tank_ids: np.ndarray, column: Optional[str] = None) -> np.ndarray:
+        """
+        :param values: array (n_samples, ...) -- Normalized values, e.g. predicted targets
+        :param tank_ids: array (n_samples,) -- Tank-ID of each row of values, see sample_tank_ids
+        :param column: str -- Column of the values, defaults to the target
+        """
+        column = self.columns.index(column or self.target)
+        positions = self.tanks.index.get_indexer(tank_ids)
+        shape = (-1,) + (1,) * (np.ndim(values) - 1)
+        return values * self.std[positions, column].reshape(shape) + self.mean[positions, column].reshape(shape)
+
+    def _save_index(self, path: str) -> None:
+        np.savez(
+            os.path.join(path, STATS_FILE),
+            tank_ids=self.tanks.index.to_numpy(),
+            starts=self.tanks["start"].to_numpy(),
+            stops=self.tanks["stop"].to_numpy(),
+            mean=self.mean,
+            std=self.std,
+            sample_starts=self.sample_starts,
+        )
+        meta = {"columns": self.columns, "target": self.target, "window": self.window, "horizon": self.horizon}
+        with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as file:
+            json.dump(meta, file, ensure_ascii=False, indent=2)
+
+
+def _normalize(values: np.ndarray, starts: np.ndarray, counts: np.ndarray, train_counts: np.ndarray) -> tuple:
+    """
+    Standardizes the rows of every tank in place with the statistics of its first train_counts rows, missing values
+    are ignored. Constant columns only get centered, columns without any training value are left as they are.
+    """
+    mean = np.zeros((len(starts), values.shape[1]))
+    std = np.ones((len(starts), values.shape[1]))
+    # Tank by tank, temporaries never exceed the rows of one tank
+    for position, (start, count, train_count) in enumerate(zip(starts, counts, train_counts)):
+        rows = values[start : start + count]
+        with warnings.catch_warnings():
+            # All-NaN columns, handled below
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean[position] = np.nanmean(rows[:train_count], axis=0, dtype=np.float64)
+            std[position] = np.nanstd(rows[:train_count], axis=0, dtype=np.float64)
+        mean[position][np.isnan(mean[position])] = 0.0
+        std[position][~(std[position] > 0)] = 1.0
+        rows -= mean[position].astype(np.float32)
+        rows /= std[position].astype(np.float32)
+    return mean, std
+
+
+def _sample_starts(tanks: pd.DataFrame, length: int) -> np.ndarray:
+    """Rows where a window of length rows starts and ends within the same tank."""
+    counts = np.maximum(tanks["stop"].to_numpy() - tanks["start"].to_numpy() - length + 1, 0)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(tanks["start"].to_numpy(), counts) + offsets
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from src.utils.synthetic import generate_fleet
+
+# The modules load configs/config.yaml relative to the working directory, like when they are run from root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+
+
+@pytest.fixture(scope="session")
+def fleet():
+    """Small synthetic fleet: 40 tanks over 150 days, 2 PLZs."""
+    return generate_fleet(40, days=150, start="2022-01-01")
+
+
+@pytest.fixture
+def readings_path(tmp_path, fleet):
+    """Processed pickle of the fleet, stored as pickle only."""
+    path = str(tmp_path / "data_one_day_clean.pickle")
+    fleet.to_pickle(path)
+    return path
+
+
+@pytest.fixture
+def isolated_forecasts(tmp_path, monkeypatch):
+    """Fitted models go to a temporary artifact store and the process-wide forecast caches start empty."""
+    from src import forcasting
+    from src.artifacts import ArtifactStore
+
+    monkeypatch.setattr(forcasting, "ARTIFACTS", ArtifactStore(str(tmp_path / "models")))
+    for cache in (forcasting._FORECAST_CACHE, forcasting._CLEANED_DATA_CACHE, forcasting._PRICE_FORECAST_CACHE):
+        cache.clear()
+    yield forcasting.ARTIFACTS
+    for cache in (forcasting._FORECAST_CACHE, forcasting._CLEANED_DATA_CACHE, forcasting._PRICE_FORECAST_CACHE):
+        cache.clear()
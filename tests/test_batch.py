@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from src import batch
+from src.batch import run_batch
+
+
+def test_batch_forecasts_start_on_the_day_after_the_last_reading(tmp_path, monkeypatch, fleet, readings_path):
+    def price_forecasts(plzs, forecast_days=30, **kwargs):
+        return pd.DataFrame(90.0, index=pd.Index(list(plzs), name="PLZ"), columns=range(forecast_days))
+
+    monkeypatch.setattr(batch, "get_price_forecasts", price_forecasts)
+    output = str(tmp_path / "batch")
+    manifest = run_batch(readings_path, output, tank_ids=range(6), horizon=10, context=60, workers=1)
+    assert manifest["complete"]
+
+    recommendations = pd.read_parquet(f"{output}/recommendations").set_index("Tank-ID")
+    forecasts = pd.read_parquet(f"{output}/forecasts")
+    last_dates = pd.to_datetime(fleet.groupby("Tank-ID")["Zeitstempel"].max()).loc[recommendations.index]
+    np.testing.assert_array_equal(recommendations["last_date"], last_dates)
+
+    days = forecasts.groupby("Tank-ID")["Zeitstempel"].agg(["min", "max", "size"])
+    np.testing.assert_array_equal(days["min"], last_dates + pd.Timedelta(days=1))
+    np.testing.assert_array_equal(days["max"], last_dates + pd.Timedelta(days=10))
+    assert (days["size"] == 10).all()
+    planned = recommendations["date"].notna()
+    assert (recommendations.loc[planned, "date"] > recommendations.loc[planned, "last_date"]).all()
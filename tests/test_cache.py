@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from src.utils.cache import LRUCache
+
+
+def test_get_or_compute_counts_one_miss_per_computation():
+    cache = LRUCache(4)
+    started, released = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        released.wait(5)
+        return "value"
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.get_or_compute("key", compute)))
+    owner.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(cache.get_or_compute("key", compute))) for _ in range(8)]
+    for waiter in waiters:
+        waiter.start()
+    while cache.stats["coalesced"] < len(waiters):
+        time.sleep(0.01)
+    released.set()
+    for thread in [owner] + waiters:
+        thread.join()
+
+    assert results == ["value"] * 9 and len(calls) == 1
+    assert cache.get_or_compute("key", compute) == "value"
+    stats = cache.stats
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 8, 1)
+
+
+def test_failed_computation_is_not_cached():
+    cache = LRUCache(4)
+    with pytest.raises(ZeroDivisionError):
+        cache.get_or_compute("key", lambda: 1 / 0)
+    assert cache.get_or_compute("key", lambda: 2) == 2
+    assert cache.stats["misses"] == 2
+
+
+def test_clear_drops_computations_in_progress():
+    cache = LRUCache(4)
+    started, released = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        released.wait(5)
+        return "old"
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(cache.get_or_compute("key", slow)))
+    thread.start()
+    started.wait(5)
+    cache.clear()
+    # A call after clear() computes anew instead of waiting for the outdated computation
+    assert cache.get_or_compute("key", lambda: "new") == "new"
+    released.set()
+    thread.join()
+
+    assert result == ["old"]
+    assert cache.get("key") == "new"
+    assert not cache._pending
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.depletion import depletion_days
+from src.forcasting import _evaluate_polynomial
+
+
+def brute_force(coefs, context, levels, thresholds, max_days):
+    consumption = _evaluate_polynomial(coefs, context[:, None] - 1 + np.arange(max_days), context)
+    below = (levels - thresholds)[:, None] - np.cumsum(consumption, axis=1) < 0
+    return np.where(below.any(axis=1), below.argmax(axis=1), np.nan)
+
+
+@pytest.mark.parametrize("degree", [0, 1, 2, 3])
+def test_depletion_days_match_the_day_by_day_search(degree):
+    rng = np.random.default_rng(degree)
+    n_tanks, max_days = 500, 3000
+    coefs = rng.normal(0, 10, (n_tanks, degree + 1))
+    coefs[:, 0] += 20
+    context = rng.integers(30, 120, n_tanks)
+    levels = rng.uniform(500, 5000, n_tanks)
+    thresholds = 0.2 * levels
+    # Tanks that only gain oil never deplete
+    coefs[:10] = -np.abs(coefs[:10])
+
+    expected = brute_force(coefs, context, levels, thresholds, max_days)
+    actual = depletion_days(coefs, context, levels, thresholds, max_days=max_days)
+    assert np.isnan(expected).any() and np.isfinite(expected).any()
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_depletion_intervals_bootstrap_the_point_fit_once(isolated_forecasts, readings_path, fleet):
+    from src.depletion import bootstrap_depletion_dates, get_depletion_intervals
+    from src.forcasting import _FORECAST_CACHE, clean_readings
+
+    intervals = get_depletion_intervals(3, reserve=0.2, context=30, degree=3, path=readings_path)
+    misses = _FORECAST_CACHE.stats["misses"]
+    assert get_depletion_intervals(3, reserve=0.2, context=30, degree=3, path=readings_path).equals(intervals)
+    assert _FORECAST_CACHE.stats["misses"] == misses
+
+    tank = fleet[fleet["Tank-ID"] == 3]
+    latest = tank.tail(1).set_index("Tank-ID")
+    expected = bootstrap_depletion_dates(
+        clean_readings(tank), latest["Füllstand"], 0.2 * latest["Maximale Füllgrenze"], context=30, degree=3
+    ).loc[3]
+    pd.testing.assert_series_equal(intervals, expected)
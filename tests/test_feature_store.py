@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_store import FEATURES_PATH, FeatureStore
+from src.forcasting import get_data
+from src.storage import readings_version
+
+
+def weather(store, days=20):
+    dates = pd.date_range(store.start, periods=days, freq="D")
+    return pd.DataFrame(
+        {
+            "Tank-ID": np.repeat(store.tanks.index.to_numpy(), days),
+            "date": np.tile(dates, len(store.tanks)),
+            "temperature_2m_mean": np.tile(np.arange(days, dtype=float), len(store.tanks)),
+        }
+    )
+
+
+def test_weather_features_do_not_replace_the_sensor_temperature(fleet):
+    readings = fleet[fleet["Tank-ID"] < 3].assign(Temperatur=-3.5)
+    readings["Zeitstempel"] = pd.to_datetime(readings["Zeitstempel"])
+    store = FeatureStore().update_readings(readings)
+    store.update_weather(weather(store))
+
+    frame = store.frame(tank_ids=[1])
+    merged = readings[readings["Tank-ID"] == 1].merge(frame, on=["Tank-ID", "Zeitstempel"], suffixes=("", "_store"))
+    np.testing.assert_allclose(merged["Temperatur"], -3.5)
+    np.testing.assert_allclose(frame["Außentemperatur"].iloc[:20], np.arange(20))
+    np.testing.assert_allclose(frame["HDD"].iloc[:20], np.maximum(15 - np.arange(20), 0))
+    np.testing.assert_allclose(frame["Außentemperatur 15d"].iloc[14], np.arange(15).mean())
+
+
+def test_matrix_rejects_unknown_tanks(fleet):
+    readings = fleet[fleet["Tank-ID"] < 3].assign(Zeitstempel=lambda df: pd.to_datetime(df["Zeitstempel"]))
+    store = FeatureStore().update_readings(readings)
+
+    position = store.tanks.index.get_loc(2)
+    np.testing.assert_array_equal(store.matrix(tank_ids=[2]), store.values[position : position + 1])
+    with pytest.raises(KeyError, match=r"\[7\]"):
+        store.matrix(tank_ids=[1, 7])
+    with pytest.raises(KeyError):
+        store.frame(tank_ids=[7])
+
+
+def test_get_data_falls_back_to_the_readings_without_a_current_store(tmp_path, monkeypatch, fleet, readings_path):
+    monkeypatch.chdir(tmp_path)
+    X_train, y_train = get_data(3, readings_path)
+    assert "Price" not in X_train and (X_train["Tank-ID"] == 3).all()
+    assert len(y_train) == 149
+
+    store = FeatureStore().update_readings(fleet)
+    store.readings_version = list(readings_version(readings_path))
+    store.save(FEATURES_PATH)
+    assert FeatureStore.load().is_current(readings_path)
+    X_train, y_train = get_data(3, readings_path)
+    assert "Außentemperatur" in X_train and "Price" in X_train
+    assert len(y_train) == 149
+
+    # New readings make the store stale until it is refreshed
+    fleet.to_pickle(readings_path)
+    os.utime(readings_path, ns=(0, 0))
+    assert not FeatureStore.load().is_current(readings_path)
+    X_train, _ = get_data(3, readings_path)
+    assert "Price" not in X_train
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from src import forcasting
+
+
+def price_histories(plzs, days):
+    """Rising daily prices for the PLZ 79098 only, other PLZs have no quotes."""
+    dates = pd.date_range(end=pd.Timestamp.now().normalize(), periods=days, freq="D")
+    known = [plz for plz in plzs if plz == "79098"]
+    return pd.DataFrame(
+        {
+            "PLZ": np.repeat(known, days),
+            "Date": np.tile(dates, len(known)),
+            "Price": np.tile(100 + np.arange(days, dtype=float), len(known)),
+        }
+    )
+
+
+def test_price_forecast_of_a_plz_without_quotes_is_empty(monkeypatch, isolated_forecasts):
+    monkeypatch.setattr(forcasting, "get_price_histories", price_histories)
+    for plz, has_prices in (("79098", True), ("10115", False)):
+        monkeypatch.setattr(forcasting, "get_data", lambda tank_id: (pd.DataFrame({"PLZ": [float(plz)]}), None))
+        df = forcasting.run_oil_price_forecasting(30, 10, tank_id=0)
+        assert set(df["flag"]) == ({"train", "forcast"} if has_prices else set())
+        if has_prices:
+            forecast = df.loc[df["flag"] == "forcast", "value"]
+            assert len(forecast) == 10
+            np.testing.assert_allclose(forecast.to_numpy(), 129 + np.arange(10))
+
+
+def test_fit_linear_models_matches_fit_linear_model(fleet):
+    clean = forcasting.clean_readings(fleet[fleet["Tank-ID"] < 4])
+    # A tank shorter than the context is fitted on all of its days
+    clean = clean[(clean["Tank-ID"] != 3) | (pd.to_datetime(clean["Zeitstempel"]) >= "2022-04-01")]
+    for degree in (1, 3):
+        coefs, forecast = forcasting.fit_linear_models(clean, context=90, degree=degree, forecast_days=7)
+        for tank_id, tank in clean.groupby("Tank-ID"):
+            y_train, _, expected = forcasting.fit_linear_model(tank, context=90, degree=degree, forecast_days=7)
+            actual = forecast[forecast["Tank-ID"] == tank_id]
+            assert coefs.loc[tank_id, "n"] == len(y_train)
+            np.testing.assert_allclose(actual["Verbrauch"], expected["Verbrauch"], rtol=1e-8, atol=1e-8)
+            np.testing.assert_array_equal(actual.index, expected.index)
+            np.testing.assert_array_equal(pd.to_datetime(actual["Zeitstempel"]), expected["Zeitstempel"])
+
+
+def test_fit_linear_models_forecast_start_shifts_the_forecast(fleet):
+    clean = forcasting.clean_readings(fleet[fleet["Tank-ID"] < 4])
+    _, same_day = forcasting.fit_linear_models(clean, context=60, forecast_days=8)
+    _, next_day = forcasting.fit_linear_models(clean, context=60, forecast_days=7, forecast_start=1)
+    shifted = same_day.groupby("Tank-ID").tail(7)
+    np.testing.assert_allclose(next_day["Verbrauch"], shifted["Verbrauch"])
+    np.testing.assert_array_equal(next_day["Zeitstempel"], shifted["Zeitstempel"])
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+from src.ingestion import Ingestion, parse_numbers
+from src.storage import TankStore, store_path
+
+TANKS = {
+    "Tank Nord": (79098.0, 47.9990, 7.8421),
+    "Tank Süd": (79100.0, 47.9812, 7.8300),
+}
+
+
+def write_export(path, days, levels, tanks=TANKS):
+    """Raw DataExport CSV with two readings per tank and day, levels per tank name."""
+    rows = []
+    for name, (plz, latitude, longitude) in tanks.items():
+        for day, level in zip(days, levels[name]):
+            for hour, offset in ((6, 20), (18, 0)):
+                rows.append(
+                    {
+                        "Zeitstempel": f"{day} {hour:02d}:00:00",
+                        "Tankname": name,
+                        "Anlage": "A1",
+                        "Füllstand": f"{level + offset:,.0f} l",
+                        "Maximale Füllgrenze": "5,000 l",
+                        "Linear Prozentwert": f"{(level + offset) / 50:.1f} %",
+                        "Temperatur": "-3,5 °C",
+                        "PLZ": int(plz),
+                        "Breitengrad": latitude,
+                        "Längengrad": longitude,
+                    }
+                )
+    pd.DataFrame(rows).to_csv(path, sep=";", index=False)
+    return str(path)
+
+
+def test_parse_numbers_english_and_german_formats():
+    values = pd.Series(["1,234 l", "1.234,5 l", "-3,5 °C", "1,234.5 l", "12.5 %", "1.234.567 l", "0 l", None])
+    parsed = parse_numbers(values)
+    np.testing.assert_allclose(parsed[:7], [1234.0, 1234.5, -3.5, 1234.5, 12.5, 1234567.0, 0.0])
+    assert np.isnan(parsed[7])
+
+
+def test_ingestion_skips_known_files_and_days(tmp_path):
+    path = str(tmp_path / "data_one_day.pickle")
+    first = write_export(
+        tmp_path / "a_DataExport.csv",
+        ["2024-01-01", "2024-01-02"],
+        {"Tank Nord": [4000, 3900], "Tank Süd": [2000, 1950]},
+    )
+    appended = Ingestion(path).run([first])
+    assert len(appended) == 4
+    assert Ingestion(path).run([first]).empty
+
+    # The second export overlaps the first by one day
+    second = write_export(
+        tmp_path / "b_DataExport.csv",
+        ["2024-01-02", "2024-01-03"],
+        {"Tank Nord": [3900, 3850], "Tank Süd": [1950, 1900]},
+    )
+    Ingestion(path).run([second])
+
+    readings = TankStore(store_path(path)).read()
+    assert len(readings) == 6
+    nord = readings[readings["Tank-ID"] == 0].set_index("Zeitstempel")
+    np.testing.assert_allclose(nord["Füllstand"], [4000, 3900, 3850])
+    np.testing.assert_allclose(nord["Verbrauch"].iloc[:2], [-100, -50])
+    assert np.isnan(nord["Verbrauch"].iloc[-1])
+    np.testing.assert_allclose(readings["Temperatur"], -3.5)
+
+
+def test_ingestion_keeps_tank_ids_of_an_existing_store(tmp_path):
+    # Store written by the preprocessing notebook: no Tanknames, Tank Süd is 7 and Tank Nord is 3
+    path = str(tmp_path / "data_one_day.pickle")
+    stored = pd.DataFrame(
+        {
+            "Tank-ID": [7, 3],
+            "Zeitstempel": [pd.Timestamp("2023-12-31").date()] * 2,
+            "Füllstand": [2100.0, 4100.0],
+            "PLZ": [TANKS["Tank Süd"][0], TANKS["Tank Nord"][0]],
+            "Breitengrad": [TANKS["Tank Süd"][1], TANKS["Tank Nord"][1]],
+            "Längengrad": [TANKS["Tank Süd"][2], TANKS["Tank Nord"][2]],
+        }
+    )
+    TankStore(store_path(path)).write(stored)
+
+    export = write_export(tmp_path / "a_DataExport.csv", ["2024-01-01"], {"Tank Nord": [4000], "Tank Süd": [2000]})
+    Ingestion(path).run([export])
+
+    readings = TankStore(store_path(path)).read()
+    assert sorted(readings["Tank-ID"].unique()) == [3, 7]
+    np.testing.assert_allclose(readings.groupby("Tank-ID")["Füllstand"].last().loc[[3, 7]], [4000, 2000])
+    # The consumption of the last stored day is known now
+    np.testing.assert_allclose(readings.groupby("Tank-ID")["Verbrauch"].first().loc[[3, 7]], [-100, -100])
+
+    # A new tank gets the next free Tank-ID
+    export = write_export(
+        tmp_path / "b_DataExport.csv",
+        ["2024-01-02"],
+        {"Tank Nord": [3950], "Tank Süd": [1990], "Tank West": [800]},
+        tanks={**TANKS, "Tank West": (79104.0, 48.0100, 7.8000)},
+    )
+    Ingestion(path).run([export])
+    assert sorted(TankStore(store_path(path)).read()["Tank-ID"].unique()) == [3, 7, 8]
@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+from src.backtest import backtest
+from src.forcasting import clean_readings
+from src.models import MODELS, get_model
+
+
+@pytest.fixture(scope="module")
+def clean_data(fleet):
+    return clean_readings(fleet[fleet["Tank-ID"] < 6])
+
+
+@pytest.mark.parametrize("name", sorted(MODELS))
+def test_forecasts_start_on_the_day_after_the_last_training_day(name, clean_data):
+    model = get_model(name)
+    model.store = None
+    _, forecast = model.fit_predict(clean_data, context=60, forecast_days=5, workers=1)
+
+    last_days = pd.to_datetime(clean_data.groupby("Tank-ID")["Zeitstempel"].max())
+    expected = pd.DataFrame(
+        {
+            "Tank-ID": last_days.index.repeat(5),
+            "Zeitstempel": [day + pd.Timedelta(days=offset) for day in last_days for offset in range(1, 6)],
+        }
+    )
+    actual = forecast[["Tank-ID", "Zeitstempel"]].reset_index(drop=True)
+    actual["Zeitstempel"] = pd.to_datetime(actual["Zeitstempel"])
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_backtest_scores_every_horizon_of_every_model(clean_data):
+    summary, _ = backtest(clean_data, sorted(MODELS), context=60, horizons=(1, 7), folds=2, workers=1)
+    n_tanks = clean_data["Tank-ID"].nunique()
+    assert (summary["n"] == 2 * n_tanks).all()
+    assert len(summary) == 2 * len(MODELS)
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from src.forcasting import clean_readings, fit_linear_models
+from src.online import OnlinePolynomialFit
+
+
+def test_daily_updates_match_a_full_refit(fleet):
+    clean = clean_readings(fleet[fleet["Tank-ID"] < 8])
+    dates = pd.to_datetime(clean["Zeitstempel"])
+    cutoff = dates.min() + pd.Timedelta(days=40)
+    # Tank 7 only starts reporting after the initial fit
+    initial = clean[(dates < cutoff) & (clean["Tank-ID"] != 7)]
+
+    online = OnlinePolynomialFit(context=60, degree=3).fit(initial)
+    for _, day in clean[dates >= cutoff].groupby("Zeitstempel"):
+        online.update(day)
+    # Readings that are already applied are skipped
+    online.update(clean[dates >= cutoff])
+
+    expected, expected_forecast = fit_linear_models(clean, context=60, degree=3, forecast_days=5)
+    actual = online.coefs().loc[expected.index]
+    np.testing.assert_array_equal(actual["n"], expected["n"])
+    np.testing.assert_array_equal(actual["last_date"], expected["last_date"])
+    np.testing.assert_allclose(actual.filter(like="coef_"), expected.filter(like="coef_"), rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(actual["r2"], expected["r2"], atol=1e-8)
+    np.testing.assert_allclose(online.forecast(5)["Verbrauch"], expected_forecast["Verbrauch"], atol=1e-6)
@@ -0,0 +1,128 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linprog
+
+from src.recommendation import PRICE_UNIT, optimize_purchases
+
+
+def brute_force(level, capacity, consumption, prices, reserve, delivery_fee):
+    """Cheapest plan over all sets of delivery days, the quantities of every set are solved as a linear program."""
+    horizon = len(consumption)
+    consumed = np.concatenate([[0.0], np.cumsum(consumption)])
+    best = np.inf
+    for n in range(horizon + 1):
+        for days in itertools.combinations(range(horizon), n):
+            # Deliveries until the end of each day, the level after the consumption must keep the reserve
+            bought = (np.array(days)[None, :] <= np.arange(horizon)[:, None]).astype(float)
+            lower = level - consumed[1:] - reserve * capacity
+            if n == 0:
+                cost = 0.0 if (lower >= -1e-9).all() else np.inf
+            else:
+                # The tank has to hold each delivery on the day it arrives
+                upper = capacity - level + consumed[list(days)]
+                result = linprog(
+                    np.asarray(prices)[list(days)] / PRICE_UNIT,
+                    A_ub=np.vstack([-bought, bought[list(days)]]),
+                    b_ub=np.concatenate([lower, upper]),
+                    bounds=(0, None),
+                    method="highs",
+                )
+                cost = result.fun + n * delivery_fee if result.status == 0 else np.inf
+            best = min(best, cost)
+    return best
+
+
+def test_optimize_purchases_matches_brute_force():
+    rng = np.random.default_rng(0)
+    n_tanks, horizon = 40, 5
+    capacities = rng.choice([3000.0, 5000.0], n_tanks)
+    levels = capacities * rng.uniform(0.15, 0.9, n_tanks)
+    consumption = rng.uniform(0, 600, (n_tanks, horizon))
+    prices = rng.uniform(80, 120, (n_tanks, horizon))
+    # A day larger than the usable volume cannot be covered
+    consumption[:5, 2] = capacities[:5]
+
+    plan = optimize_purchases(levels, capacities, consumption, prices, reserve=0.2, delivery_fee=50.0)
+    expected = np.array(
+        [
+            brute_force(levels[i], capacities[i], consumption[i], prices[i], reserve=0.2, delivery_fee=50.0)
+            for i in range(n_tanks)
+        ]
+    )
+    feasible = np.isfinite(expected)
+    assert feasible.any() and (~feasible).any()
+    np.testing.assert_allclose(plan["cost"][feasible], expected[feasible])
+    assert np.isnan(plan["cost"][~feasible]).all()
+
+
+def test_optimize_purchases_fills_up_before_a_need_larger_than_the_tank():
+    # Buying the 600 liters of day 1 on day 0 and the 600 liters of day 2 on day 2 costs 900 EUR, filling up on the
+    # cheap day 0 and topping up 200 liters on day 2 costs 700 EUR
+    plan = optimize_purchases([0.0], [1000.0], [[0.0, 600.0, 600.0]], [[50.0, 100.0, 100.0]], reserve=0, delivery_fee=0)
+    assert plan["cost"][0] == 700
+    assert plan["day"][0] == 0 and plan["quantity"][0] == 1000
+    assert plan["deliveries"][0] == 2
+
+    rng = np.random.default_rng(1)
+    n_tanks, horizon = 30, 5
+    capacities = np.full(n_tanks, 3000.0)
+    levels = capacities * rng.uniform(0.2, 0.9, n_tanks)
+    # Two days fill the usable volume, the capacity binds in most plans
+    consumption = rng.uniform(0, 1200, (n_tanks, horizon))
+    prices = rng.uniform(60, 120, (n_tanks, horizon))
+
+    plan = optimize_purchases(levels, capacities, consumption, prices, reserve=0.2, delivery_fee=20.0)
+    expected = [
+        brute_force(levels[i], capacities[i], consumption[i], prices[i], reserve=0.2, delivery_fee=20.0)
+        for i in range(n_tanks)
+    ]
+    np.testing.assert_allclose(plan["cost"], expected)
+
+
+def test_optimize_purchases_without_need_or_prices():
+    levels = np.array([500.0, 5000.0, 4000.0])
+    capacities = np.full(3, 5000.0)
+    consumption = np.full((3, 10), 50.0)
+    prices = np.full((3, 10), 90.0)
+    prices[:2] = np.nan
+
+    plan = optimize_purchases(levels, capacities, consumption, prices)
+    # Tanks without prices are not planned, even if they run low
+    assert np.isnan(plan["day"][:2]).all()
+    assert np.isnan(plan["quantity"][:2]).all()
+    assert np.isnan(plan["price"][:2]).all()
+    assert np.isnan(plan["cost"][:2]).all()
+    np.testing.assert_array_equal(plan["deliveries"], [0, 0, 0])
+    # Enough oil for the horizon: no purchase at no cost
+    assert np.isnan(plan["day"][2])
+    assert plan["quantity"][2] == 0 and plan["cost"][2] == 0
+
+
+def test_optimize_purchases_fills_up_infeasible_tanks_on_day_zero():
+    # 3000 liters on day 0 do not fit into a 2000 liter tank
+    plan = optimize_purchases([1000.0], [2000.0], [[3000.0, 0.0]], [[90.0, 90.0]])
+    assert plan["day"][0] == 0
+    assert plan["quantity"][0] == 1000.0
+    assert plan["price"][0] == 90.0
+    assert np.isnan(plan["cost"][0])
+    assert plan["deliveries"][0] == 1
+
+
+def test_recommendations_start_after_the_last_reading(isolated_forecasts, readings_path, fleet):
+    from src.recommendation import get_recommendations
+
+    # Every tank is close to its reserve on the last reading, so that the plans have deliveries
+    readings = fleet.copy()
+    last = readings.groupby("Tank-ID").tail(1).index
+    readings.loc[last, "Füllstand"] = 0.2 * readings.loc[last, "Maximale Füllgrenze"] + 20
+    readings.to_pickle(readings_path)
+    plz = readings["PLZ"].astype(str).str.replace(".0", "", regex=False).unique()
+    prices = pd.DataFrame(90.0, index=plz, columns=range(10))
+
+    recommendations = get_recommendations(90, 10, prices=prices, path=readings_path)
+    last_readings = pd.to_datetime(readings.groupby("Tank-ID")["Zeitstempel"].max())
+    planned = recommendations.dropna(subset=["date"])
+    assert len(planned)
+    assert (planned["date"] > last_readings.loc[planned.index]).all()
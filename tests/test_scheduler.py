@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+
+from src.scheduler import Scheduler, Stage
+
+
+def scheduler(tmp_path, inputs, runs, fail_after=None):
+    """Two stages: "tanks" hashes the inputs, "fit" processes the stale tanks one commit at a time."""
+
+    def fit(outputs, stale, commit):
+        runs.append(list(stale))
+        for done, key in enumerate(stale):
+            if fail_after is not None and done == fail_after:
+                raise RuntimeError("interrupted")
+            commit([key])
+
+    stages = [
+        Stage("tanks", lambda outputs, stale, commit: None),
+        Stage("fit", fit, depends=["tanks"], keys=lambda outputs: pd.Series(inputs)),
+        Stage("report", lambda outputs, stale, commit: "report", depends=["fit"]),
+    ]
+    return Scheduler(stages, str(tmp_path / "_state.json"), workers=2)
+
+
+def test_only_stale_keys_are_recomputed(tmp_path):
+    inputs = {str(tank_id): f"hash{tank_id}" for tank_id in range(5)}
+    runs = []
+    report = scheduler(tmp_path, inputs, runs).run()
+    assert report["fit"]["status"] == "done" and report["fit"]["stale"] == 5
+    assert report["report"]["status"] == "done"
+
+    # A new process only sees the changed tank
+    inputs["3"] = "changed"
+    assert scheduler(tmp_path, inputs, runs).run()["fit"]["stale"] == 1
+    assert runs[-1] == ["3"]
+    assert scheduler(tmp_path, inputs, runs).run()["fit"]["status"] == "up to date"
+    assert scheduler(tmp_path, inputs, runs).run(force=True)["fit"]["stale"] == 5
+
+
+def test_an_interrupted_stage_resumes_after_its_last_commit(tmp_path):
+    inputs = {str(tank_id): f"hash{tank_id}" for tank_id in range(5)}
+    runs = []
+    report = scheduler(tmp_path, inputs, runs, fail_after=2).run()
+    assert report["fit"]["status"] == "failed"
+    assert report["report"]["status"] == "skipped"
+
+    report = scheduler(tmp_path, inputs, runs).run()
+    assert report["fit"]["status"] == "done"
+    assert runs[-1] == ["2", "3", "4"]
+
+
+@pytest.mark.parametrize("depends", [{"a": ["b"], "b": ["a"]}, {"a": ["missing"]}])
+def test_cycles_and_unknown_dependencies_are_rejected(tmp_path, depends):
+    stages = [Stage(name, lambda outputs, stale, commit: None, depends=on) for name, on in depends.items()]
+    with pytest.raises(ValueError):
+        Scheduler(stages, str(tmp_path / "_state.json"))
@@ -0,0 +1,105 @@
+import json
+import time
+
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import recommendation, service
+from src.service import ForecastService
+
+
+def price_forecasts(plzs, context=60, forecast_days=30, **kwargs):
+    # Rising prices make the cheapest plan unique, with flat prices many delivery days cost the same
+    prices = np.broadcast_to(90.0 + 0.1 * np.arange(forecast_days), (len(plzs), forecast_days))
+    return pd.DataFrame(prices, index=pd.Index([str(plz) for plz in plzs], name="PLZ"), columns=range(forecast_days))
+
+
+@pytest.fixture
+def forecast_service(monkeypatch, isolated_forecasts, readings_path):
+    monkeypatch.setattr(service, "get_price_forecasts", price_forecasts)
+    monkeypatch.setattr(recommendation, "get_price_forecasts", price_forecasts)
+    service._RESULT_CACHE.clear()
+    with ForecastService(path=readings_path) as running:
+        yield running
+    service._RESULT_CACHE.clear()
+
+
+def request(running, path, body=None):
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    try:
+        with urlopen(Request(running.url + path, data=data), timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def test_tank_routes_are_rows_of_the_fleet_results(forecast_service):
+    status, forecasts = request(forecast_service, "/forecasts?horizon=5")
+    assert status == 200 and len(forecasts) == 40
+    status, forecast = request(forecast_service, "/tanks/3/forecast?horizon=5")
+    assert status == 200
+    assert forecast == next(row for row in forecasts if row["Tank-ID"] == 3)
+    assert len(forecast["Verbrauch"]) == 5
+
+    status, recommendations = request(forecast_service, "/recommendations", {"tanks": [4, 2, 4], "horizon": 5})
+    assert status == 200 and [row["Tank-ID"] for row in recommendations] == [4, 2]
+    assert request(forecast_service, "/tanks/2/recommendation?horizon=5") == (200, recommendations[1])
+
+
+def test_results_are_computed_once_per_settings(forecast_service):
+    before = service._RESULT_CACHE.stats
+    for _ in range(3):
+        request(forecast_service, "/tanks/1/forecast?horizon=5")
+    request(forecast_service, "/tanks/1/forecast?horizon=6")
+    status, stats = request(forecast_service, "/stats")
+    assert status == 200
+    assert stats["cache"]["misses"] - before["misses"] == 2 and stats["cache"]["hits"] - before["hits"] == 2
+    # Latencies are recorded after the response is sent
+    deadline = time.time() + 5
+    while forecast_service.stats["endpoints"]["tank_forecast"]["count"] < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    assert forecast_service.stats["endpoints"]["tank_forecast"]["count"] == 4
+
+
+def test_errors_are_answered_with_their_status(forecast_service):
+    assert request(forecast_service, "/tanks/999/forecast")[0] == 404
+    assert request(forecast_service, "/unknown")[0] == 404
+    assert request(forecast_service, "/forecasts?horizon=0")[0] == 400
+    assert request(forecast_service, "/prices")[0] == 400
+    status, prices = request(forecast_service, "/prices?plz=79098&horizon=3")
+    assert status == 200 and prices == {"79098": {"0": 90.0, "1": 90.1, "2": 90.2}}
+    assert request(forecast_service, "/health") == (200, {"status": "ok"})
+
+
+def test_tank_responses_match_the_batch_run(forecast_service, monkeypatch, tmp_path, readings_path, fleet):
+    from src import batch
+
+    # Tank 5 runs low, so that its plan has a delivery
+    readings = fleet.copy()
+    last = readings.index[readings["Tank-ID"] == 5][-1]
+    readings.loc[last, "Füllstand"] = 0.2 * readings.loc[last, "Maximale Füllgrenze"] + 20
+    readings.to_pickle(readings_path)
+    monkeypatch.setattr(batch, "get_price_forecasts", price_forecasts)
+    output = str(tmp_path / "batch")
+    batch.run_batch(readings_path, output, tank_ids=[5], horizon=10, context=90, workers=1)
+    expected = pd.read_parquet(f"{output}/recommendations").set_index("Tank-ID").loc[5]
+    expected_forecast = pd.read_parquet(f"{output}/forecasts")
+
+    status, forecast = request(forecast_service, "/tanks/5/forecast?horizon=10&context=90")
+    assert status == 200
+    last_reading = pd.to_datetime(fleet.loc[fleet["Tank-ID"] == 5, "Zeitstempel"]).max()
+    assert pd.Timestamp(forecast["date"]) == last_reading + pd.Timedelta(days=1)
+    assert pd.Timestamp(forecast["date"]) == expected_forecast["Zeitstempel"].min()
+    np.testing.assert_allclose(forecast["Verbrauch"], expected_forecast["Verbrauch"], rtol=1e-6, atol=1e-6)
+
+    status, recommendation = request(forecast_service, "/tanks/5/recommendation?horizon=10&context=90")
+    assert status == 200
+    assert pd.Timestamp(recommendation["date"]) > last_reading
+    assert pd.Timestamp(recommendation["date"]) == expected["date"]
+    np.testing.assert_allclose(
+        [recommendation["quantity"], recommendation["cost"]], [expected["quantity"], expected["cost"]]
+    )
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pandas as pd
+
+from src.fleet_state import FleetState
+from src.utils.snapshot import Snapshot
+
+
+def wait_for_refresh(snapshot, timeout=5):
+    deadline = time.time() + timeout
+    while snapshot.is_refreshing and time.time() < deadline:
+        time.sleep(0.01)
+    assert not snapshot.is_refreshing
+
+
+def readings(fleet, days):
+    data = fleet[pd.to_datetime(fleet["Zeitstempel"]).isin(days)]
+    return data.rename(columns={"Linear Prozentwert": "Prozentualer Füllstand"})
+
+
+def test_first_get_blocks_on_the_loader(tmp_path):
+    calls = []
+    snapshot = Snapshot(str(tmp_path / "value.pickle"), lambda previous: calls.append(previous) or 1)
+    assert snapshot.get() == 1
+    assert calls == [None]
+    assert not snapshot.is_refreshing
+
+
+def test_restart_serves_the_persisted_value_and_brings_it_up_to_date(tmp_path):
+    path = str(tmp_path / "value.pickle")
+    Snapshot(path, lambda previous: 1).get()
+
+    released = threading.Event()
+    previous_values = []
+
+    def loader(previous):
+        previous_values.append(previous)
+        released.wait(5)
+        return previous + 1
+
+    # A new process serves the persisted value at once, even though it is younger than max_age
+    restarted = Snapshot(path, loader, max_age=3600)
+    assert restarted.get() == 1
+    assert restarted.is_refreshing
+    released.set()
+    wait_for_refresh(restarted)
+    assert restarted.get() == 2
+    assert previous_values == [1]
+    assert Snapshot(path, loader).get() == 2
+
+
+def test_concurrent_refreshes_run_the_loader_once(tmp_path):
+    released = threading.Event()
+    calls = []
+
+    def loader(previous):
+        calls.append(previous)
+        released.wait(5)
+        return len(calls)
+
+    snapshot = Snapshot(str(tmp_path / "value.pickle"), lambda previous: 0)
+    snapshot.get()
+    snapshot._loader = loader
+
+    threads = [threading.Thread(target=snapshot.refresh_async) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    released.set()
+    wait_for_refresh(snapshot)
+    assert calls == [0]
+    assert snapshot.get() == 1
+
+
+def test_fleet_state_snapshot_applies_new_readings_after_a_restart(tmp_path, fleet):
+    path = str(tmp_path / "fleet_state.pickle")
+    days = sorted(pd.to_datetime(fleet["Zeitstempel"]).unique())
+    available = days[:10]
+
+    def loader(state):
+        state = state.copy() if state is not None else FleetState()
+        start = state.watermark if state.watermark is not None else days[0]
+        state.update_readings(readings(fleet, [day for day in available if day >= start]))
+        return state
+
+    def snapshot():
+        return Snapshot(path, loader, load=FleetState.load, save=FleetState.save)
+
+    first = snapshot().get()
+    assert first.dates[1] == days[9]
+
+    # Readings arrive while no process runs
+    available = days[:12]
+    restarted = snapshot()
+    assert restarted.get().dates[1] == days[9]
+    wait_for_refresh(restarted)
+    state = restarted.get()
+    assert state.dates[1] == days[11]
+
+    full = FleetState()
+    full.update_readings(readings(fleet, days[:12]))
+    pd.testing.assert_frame_equal(state.today(), full.today())
+    pd.testing.assert_frame_equal(state.yesterday(), full.yesterday())
+
+
+def test_fleet_state_watermark_ignores_tanks_without_new_readings(fleet):
+    days = sorted(pd.to_datetime(fleet["Zeitstempel"]).unique())
+    # Tank 1 stops reporting after the third day
+    fleet = fleet[(fleet["Tank-ID"] != 1) | (pd.to_datetime(fleet["Zeitstempel"]) <= days[2])]
+
+    state = FleetState()
+    state.update_readings(readings(fleet, days[:10]))
+    assert state.watermark == days[9]
+    state.update_readings(readings(fleet, [day for day in days[:20] if day >= state.watermark]))
+    assert state.watermark == days[19]
+
+    full = FleetState()
+    full.update_readings(readings(fleet, days[:20]))
+    pd.testing.assert_frame_equal(state.today(), full.today())
+    pd.testing.assert_frame_equal(state.yesterday(), full.yesterday())
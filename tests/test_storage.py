@@ -0,0 +1,79 @@
+import os
+
+import pandas as pd
+
+from src.storage import TankStore, load_readings, readings_version, store_path
+
+
+def test_read_prunes_tanks_days_and_columns(tmp_path, fleet):
+    store = TankStore(str(tmp_path / "readings"))
+    assert not store.exists()
+    store.write(fleet)
+
+    df = store.read(tank_ids=[3, 5], start="2022-02-01", end="2022-02-10", columns=["Füllstand"])
+    assert list(df.columns) == ["Tank-ID", "Zeitstempel", "Füllstand"]
+    assert sorted(df["Tank-ID"].unique()) == [3, 5] and len(df) == 20
+    dates = pd.to_datetime(df["Zeitstempel"])
+    assert dates.min() == pd.Timestamp("2022-02-01") and dates.max() == pd.Timestamp("2022-02-10")
+
+    expected = fleet[fleet["Tank-ID"].isin([3, 5])]
+    expected = expected[(pd.to_datetime(expected["Zeitstempel"]) >= "2022-02-01")]
+    expected = expected[(pd.to_datetime(expected["Zeitstempel"]) <= "2022-02-10")]
+    pd.testing.assert_series_equal(df["Füllstand"], expected["Füllstand"].reset_index(drop=True), check_dtype=False)
+
+
+def test_append_replaces_days_and_keeps_other_tanks(tmp_path, fleet):
+    store = TankStore(str(tmp_path / "readings"))
+    days = pd.to_datetime(fleet["Zeitstempel"])
+    store.write(fleet[days < "2022-03-01"])
+    version = store.version()
+
+    update = fleet[(days >= "2022-02-28") & (fleet["Tank-ID"] == 2)].copy()
+    update["Füllstand"] = 1.0
+    store.append(update)
+
+    df = store.read()
+    assert store.version() != version
+    assert len(df) == (days < "2022-03-01").sum() + len(update) - 1
+    tank = df[df["Tank-ID"] == 2].set_index("Zeitstempel")["Füllstand"]
+    assert (tank.loc[tank.index >= update["Zeitstempel"].min()] == 1.0).all()
+    last_dates = store.last_dates()
+    assert last_dates.loc[2] == pd.to_datetime(update["Zeitstempel"]).max()
+    assert last_dates.loc[1] == pd.Timestamp("2022-02-28")
+
+
+def test_append_rewrites_only_the_touched_partitions(tmp_path, fleet):
+    store = TankStore(str(tmp_path / "readings"))
+    readings = fleet[fleet["Tank-ID"].isin([1, 2])]
+    earlier = readings.assign(Zeitstempel=(pd.to_datetime(readings["Zeitstempel"]) - pd.Timedelta(days=365)).dt.date)
+    store.write(pd.concat([earlier, readings], ignore_index=True))
+    partitions = {
+        (t, y): tmp_path / "readings" / f"Tank-ID={t}" / f"Jahr={y}" / "part-0.parquet"
+        for t in (1, 2)
+        for y in (2021, 2022)
+    }
+    mtimes = {key: os.stat(path).st_mtime_ns for key, path in partitions.items()}
+
+    # Tank 1 is updated in 2022 and tank 2 in 2021, the scan covers both years of both tanks
+    update = pd.concat([readings[readings["Tank-ID"] == 1].tail(3), earlier[earlier["Tank-ID"] == 2].tail(3)])
+    update = update.assign(Füllstand=1.0)
+    store.append(update)
+
+    assert os.stat(partitions[1, 2021]).st_mtime_ns == mtimes[1, 2021]
+    assert os.stat(partitions[2, 2022]).st_mtime_ns == mtimes[2, 2022]
+    df = store.read()
+    assert len(df) == 2 * len(readings)
+    assert (df.merge(update[["Tank-ID", "Zeitstempel"]])["Füllstand"] == 1.0).all()
+    assert (df["Füllstand"] == 1.0).sum() == len(update)
+
+
+def test_load_readings_prefers_the_store_over_the_pickle(readings_path, fleet):
+    from_pickle = load_readings(readings_path, tank_ids=[1], columns=["Füllstand"])
+    pickle_version = readings_version(readings_path)
+
+    TankStore(store_path(readings_path)).write(fleet)
+    from_store = load_readings(readings_path, tank_ids=[1], columns=["Füllstand"])
+    assert readings_version(readings_path) != pickle_version
+    pd.testing.assert_frame_equal(
+        from_store.reset_index(drop=True), from_pickle.reset_index(drop=True), check_dtype=False
+    )
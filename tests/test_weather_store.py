@@ -0,0 +1,61 @@
+import json
+import os
+
+import pandas as pd
+
+from src.api.weather_store import WeatherArchive
+
+
+def history(days=30, start="2024-01-01"):
+    dates = pd.date_range(start, periods=days, freq="D", tz="UTC")
+    return pd.DataFrame({"date": dates, "temperature_2m_mean": range(days)})
+
+
+def stored_bytes(archive):
+    return sum(
+        os.path.getsize(os.path.join(archive.root, f)) for f in os.listdir(archive.root) if f.endswith(".parquet")
+    )
+
+
+def test_batch_saves_the_index_once(tmp_path, monkeypatch):
+    archive = WeatherArchive(str(tmp_path))
+    dumps = []
+    original = json.dump
+    monkeypatch.setattr(json, "dump", lambda *args, **kwargs: dumps.append(1) or original(*args, **kwargs))
+
+    with archive.batch():
+        for i in range(20):
+            archive.put_history(f"key{i}", history())
+            archive.history(f"key{i}")
+        assert not os.path.exists(os.path.join(archive.root, "_index.json"))
+    assert len(dumps) == 1
+
+    reopened = WeatherArchive(str(tmp_path))
+    assert len(reopened._index) == 20
+    assert reopened._total == stored_bytes(archive)
+    assert len(reopened.history("key3", "2024-01-10", "2024-01-19")) == 10
+
+
+def test_eviction_keeps_the_recently_used_locations(tmp_path):
+    archive = WeatherArchive(str(tmp_path))
+    archive.put_history("old", history())
+    size = archive._total
+    archive.max_bytes = int(2.5 * size)
+    archive.put_history("middle", history())
+    archive.history("old")
+    archive.put_history("new", history())
+
+    assert set(archive._index) == {"old", "new"}
+    assert not os.path.exists(os.path.join(archive.root, "middle.history.parquet"))
+    assert archive._total == stored_bytes(archive)
+
+
+def test_index_without_sizes_is_measured_on_load(tmp_path):
+    archive = WeatherArchive(str(tmp_path))
+    archive.put_history("a", history())
+    archive.put_forecast("a", history(days=7, start="2030-01-01").set_index("date"))
+    # Index as written before the sizes were tracked
+    with open(os.path.join(archive.root, "_index.json"), "w", encoding="utf-8") as file:
+        json.dump({"a": {"accessed": 1.0}}, file)
+
+    assert WeatherArchive(str(tmp_path))._total == stored_bytes(archive)
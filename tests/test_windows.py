@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from src.windows import WindowDataset
+
+
+def test_samples_are_the_windows_of_each_tank(fleet):
+    df = fleet[fleet["Tank-ID"] < 3]
+    dataset = WindowDataset.from_frame(df, window=10, horizon=2)
+    days = df.groupby("Tank-ID").size()
+    assert len(dataset) == (days - 11).sum()
+
+    inputs, targets = dataset.batch(np.arange(len(dataset)))
+    tank_ids = dataset.sample_tank_ids()
+    first = tank_ids == 1
+    consumption = df[df["Tank-ID"] == 1].sort_values("Zeitstempel")["Verbrauch"].to_numpy()
+    np.testing.assert_allclose(dataset.denormalize(inputs[first][0, :, 0], np.full(10, 1)), consumption[:10], rtol=1e-5)
+    np.testing.assert_allclose(dataset.denormalize(targets[first], tank_ids[first])[0], consumption[10:12], rtol=1e-5)
+
+
+def test_statistics_ignore_days_after_training_and_missing_values(fleet):
+    df = fleet[fleet["Tank-ID"] < 3].copy()
+    dates = pd.to_datetime(df["Zeitstempel"])
+    train_until = dates.min() + pd.Timedelta(days=99)
+    df.loc[df.index[5], "Verbrauch"] = np.nan
+
+    dataset = WindowDataset.from_frame(df, window=10, horizon=2, train_until=train_until)
+    # Changing the days after training does not change the scaling
+    later = df.copy()
+    later.loc[dates > train_until, "Verbrauch"] *= 10
+    np.testing.assert_allclose(WindowDataset.from_frame(later, window=10, train_until=train_until).mean, dataset.mean)
+
+    training = df[dates <= train_until].groupby("Tank-ID")["Verbrauch"]
+    np.testing.assert_allclose(dataset.mean[:, 0], training.mean(), rtol=1e-5)
+    np.testing.assert_allclose(dataset.std[:, 0], training.std(ddof=0), rtol=1e-5)
+    assert np.isfinite(dataset.mean).all() and np.isfinite(dataset.std).all()